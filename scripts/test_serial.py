@@ -1,27 +1,63 @@
-import serial
+import itertools
+import os
+import sys
 import time
 
+import serial
+
+# the framing lives with the server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+from flaskr import serial_protocol as protocol  # noqa: E402
+from flaskr.exceptions import MotorControllerException  # noqa: E402
+
 PORT_NAME = '/dev/cu.usbmodem143101'
-BAUD_RATE = 9600
+BAUD_RATE = 9600  # the sketch boots at this rate
+BOOT_TIMEOUT = 3  # seconds, opening the port resets most boards
+ACK_TIMEOUT = 5  # seconds, long enough for a stepper move
+
+tags = itertools.cycle(range(1, 256))
+
+
+def read_until(arduino, decoder, done, timeout):
+    """ Prints frames as they arrive until `done(frame)`, returns that frame or None after `timeout` """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for frame in decoder.feed(arduino.read(arduino.in_waiting or 1)):
+            if frame.type == protocol.TYPE_EVENT:
+                print(f"event: {frame.payload.decode('utf-8', errors='replace')}")
+            elif frame.type == protocol.TYPE_BOOT:
+                print(f"boot, protocol version {frame.payload[0] if frame.payload else '?'}")
+            if done(frame):
+                return frame
+    return None
+
 
+def write_read(arduino, decoder, x):
+    """ Sends the text command `x`, e.g. z:up or heybuddy, and returns what the ACK says """
+    frame_type, payload = protocol.parse_command(x)
+    tag = next(tags)
+    arduino.write(protocol.encode_frame(frame_type, tag, payload))
+    is_ack = lambda frame: frame.type == protocol.TYPE_ACK and frame.tag == tag
+    ack = read_until(arduino, decoder, is_ack, ACK_TIMEOUT)
+    if ack is None:
+        return 'no ACK'
+    code, result = protocol.decode_ack(frame_type, ack.payload)
+    if code != protocol.ACK_OK:
+        return f"error: {protocol.ACK_MESSAGES.get(code, code)}"
+    return f"OK {result}" if result else 'OK'
 
-def write_read(x):
-    arduino = serial.Serial(port=PORT_NAME, baudrate=BAUD_RATE, timeout=1)
-    while not arduino.is_open:
-        print('not open')
-        time.sleep(0.5)
-    arduino.write(bytes(x, 'utf-8'))
-    time.sleep(0.05)
-    response = []
-    data = arduino.readline()
-    while data:
-        response.append(data.decode('utf-8').strip())
-        data = arduino.readline();
 
-    return '\n'.join(response)
+arduino = serial.Serial(port=PORT_NAME, baudrate=BAUD_RATE, timeout=0.1)
+decoder = protocol.FrameDecoder()
+is_boot = lambda frame: frame.type == protocol.TYPE_BOOT
+if read_until(arduino, decoder, is_boot, BOOT_TIMEOUT) is None:
+    print('no boot frame, trying anyway')
+print(f"commands: {', '.join(protocol.COMMANDS)} (hand:open, z:down, ...)")
 
 while True:
-    num = input("Enter a string: ")
-    value = write_read(num)
-    print(value)
+    command = input("Enter a command: ")
+    try:
+        print(write_read(arduino, decoder, command))
+    except MotorControllerException as e:
+        print(e)
     print('-- end --')
@@ -0,0 +1,51 @@
+"""
+Microbenchmark for Configuration.get()
+
+Compares reading a key through the cached snapshot against re-reading and merging
+default.json and user.json on every call, which is what get() used to do.
+
+Run from the server directory: python -m benchmarks.config_get
+"""
+import argparse
+import timeit
+
+from flaskr.config import Configuration
+
+KEYS = [
+    'board_x_offset',
+    'board_x_padding',
+    'space_width',
+    'printhead_x_offset',
+    'printhead_speed',
+    'z_axis_height',
+]
+
+
+def uncached_get(config):
+    for key in KEYS:
+        config._read_config()[key]
+
+
+def cached_get(config):
+    for key in KEYS:
+        config.get(key)
+
+
+def run(number, repeat):
+    config = Configuration()
+    results = {}
+    for name, fn in (('uncached', uncached_get), ('cached', cached_get)):
+        best = min(timeit.repeat(lambda: fn(config), number=number, repeat=repeat))
+        calls = number * len(KEYS)
+        results[name] = calls / best
+        print(f"{name:>8}: {calls / best:>12,.0f} get()/s  ({best / calls * 1e6:.2f} us/call)")
+    print(f" speedup: {results['cached'] / results['uncached']:.1f}x")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=2000, help='calls per timing run')
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs, best is reported')
+    args = parser.parse_args()
+    run(args.number, args.repeat)
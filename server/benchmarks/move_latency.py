@@ -0,0 +1,207 @@
+"""
+End-to-end move latency benchmark
+
+Runs standard workloads through ChessController.perform_moves against the fake OctoPrint server
+and fake Arduino from the simulator package, and reports wall-clock time per move broken down into
+OctoPrint round trips, serial round trips, configuration/geometry overhead, planning and idle
+waiting. Stage times are summed over every thread, so with both devices busy at once they can add
+up to more than the wall-clock time.
+
+Motion is sped up by --time-scale: printer speeds and the simulated stepper delays are scaled so
+every move takes time-scale times as long as it would on the real rig. HTTP, serial and config
+overhead are not scaled.
+
+Run from the server directory: python -m benchmarks.move_latency --output results.json
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONFIG_FILEPATH = os.path.join(BENCHMARK_DIRECTORY, '..', 'flaskr', 'config', 'default.json')
+
+# (name, list of perform_moves batches, skip_hand)
+SCHOLARS_MATE = [
+    [{'action': 'move_to_space', 'starting_space': 'E2', 'ending_space': 'E4'}],
+    [{'action': 'move_to_space', 'starting_space': 'E7', 'ending_space': 'E5'}],
+    [{'action': 'move_to_space', 'starting_space': 'F1', 'ending_space': 'C4'}],
+    [{'action': 'move_to_space', 'starting_space': 'B8', 'ending_space': 'C6'}],
+    [{'action': 'move_to_space', 'starting_space': 'D1', 'ending_space': 'H5'}],
+    [{'action': 'move_to_space', 'starting_space': 'G8', 'ending_space': 'F6'}],
+    [
+        {'action': 'remove_from_board', 'space': 'F7'},
+        {'action': 'move_to_space', 'starting_space': 'H5', 'ending_space': 'F7'},
+    ],
+]
+
+
+def board_sweep():
+    spaces = []
+    for file_index, file in enumerate('ABCDEFGH'):
+        ranks = range(1, 9) if file_index % 2 == 0 else range(8, 0, -1)
+        spaces += [f"{file}{rank}" for rank in ranks]
+    return [[
+        {'action': 'move_to_space', 'starting_space': start, 'ending_space': end}
+        for start, end in zip(spaces, spaces[1:])
+    ]]
+
+
+WORKLOADS = {
+    'quiet_move': ([[{'action': 'move_to_space', 'starting_space': 'E2', 'ending_space': 'E4'}]], False),
+    'capture': ([[
+        {'action': 'remove_from_board', 'space': 'D5'},
+        {'action': 'move_to_space', 'starting_space': 'E4', 'ending_space': 'D5'},
+    ]], False),
+    'board_sweep': (board_sweep(), True),
+    'game_replay': (SCHOLARS_MATE, False),
+}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_user_config(config_directory, values):
+    with open(os.path.join(config_directory, 'user.json'), 'w') as f:
+        f.write(json.dumps(values, sort_keys=True, indent=4))
+
+
+def scaled_profile(profile, speed_scale):
+    profile = json.loads(json.dumps(profile))
+    for settings in profile['axes'].values():
+        settings['speed'] *= speed_scale
+    return profile
+
+
+def run_workload(app, chess_controller, batches, skip_hand):
+    from flaskr import timing
+
+    moves = sum(len(batch) for batch in batches)
+    timing.timer().reset()
+    started = time.perf_counter()
+    with app.app_context():
+        for batch in batches:
+            chess_controller.perform_moves(batch, skip_hand=skip_hand)
+    wall = time.perf_counter() - started
+    stages = timing.timer().snapshot()
+    return {
+        'moves': moves,
+        'skip_hand': skip_hand,
+        'wall_seconds': wall,
+        'wall_seconds_per_move': wall / moves,
+        'stages': {
+            stage: {
+                'seconds': values['seconds'],
+                'count': values['count'],
+                'seconds_per_move': values['seconds'] / moves,
+            }
+            for stage, values in stages.items()
+        },
+    }
+
+
+def print_results(results, baseline=None):
+    for name, workload in results['workloads'].items():
+        line = f"{name:>12}: {workload['wall_seconds_per_move'] * 1000:9.1f} ms/move"
+        if baseline and name in baseline['workloads']:
+            before = baseline['workloads'][name]['wall_seconds_per_move']
+            line += f" ({(workload['wall_seconds_per_move'] - before) / before * 100:+.1f}%)"
+        print(line)
+        for stage, values in workload['stages'].items():
+            print(f"{stage:>22}: {values['seconds_per_move'] * 1000:9.1f} ms/move  {values['count']:6d} spans")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workloads', nargs='+', choices=sorted(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument('--time-scale', type=float, default=0.05, help='multiplier on simulated motion times')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds added to every OctoPrint request')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results from an earlier run to compare against')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+
+    # run against a scratch config directory, so the simulators' addresses don't end up in user.json
+    config_directory = tempfile.mkdtemp(prefix='remote_chess_bench_')
+    shutil.copy(DEFAULT_CONFIG_FILEPATH, os.path.join(config_directory, 'default.json'))
+    write_user_config(config_directory, {})
+    os.environ['REMOTE_CHESS_CONFIG_DIRECTORY'] = config_directory
+
+    import flaskr
+    from flaskr.config import Configuration
+    from simulator import FakeArduino, FakeOctoPrint
+    from simulator.octoprint import DEFAULT_ACCELERATION, DEFAULT_PROFILE, HOMING_TIME
+
+    config = Configuration()
+    speed_scale = 1 / args.time_scale
+    octoprint = FakeOctoPrint(
+        profile=scaled_profile(DEFAULT_PROFILE, speed_scale),
+        acceleration=DEFAULT_ACCELERATION * speed_scale ** 2,
+        latency=args.latency,
+    ).start()
+    arduino = FakeArduino(
+        hand_speed_delay=config.get('hand_stepper_speed_delay'),
+        z_speed_delay=config.get('z_stepper_speed_delay'),
+        time_scale=args.time_scale,
+        simulate_line_rate=True,
+    ).start()
+    write_user_config(config_directory, {
+        'octoprint_ip_address': octoprint.address,
+        'arduino_port': arduino.port,
+        'printhead_speed': config.get('printhead_speed') * speed_scale,
+        'printhead_acceleration': config.get('printhead_acceleration') * speed_scale ** 2,
+        'hand_stepper_speed_delay': config.get('hand_stepper_speed_delay') * args.time_scale,
+        'z_stepper_speed_delay': config.get('z_stepper_speed_delay') * args.time_scale,
+        'stepper_enable_delay': config.get('stepper_enable_delay') * args.time_scale,
+        'printer_homing_time': HOMING_TIME,
+    })
+
+    try:
+        app = flaskr.create_app()
+        logging.getLogger().setLevel(logging.WARNING)
+        rig = app.rigs.default
+        rig.axis_controller.intialize_octoprint()
+        rig.axis_controller.home(x=True, y=True, z=True)
+        # so the first workload doesn't pay for the homing
+        rig.axis_controller.wait_until_idle()
+        initialized, message = rig.motor_controller.initialize()
+        if not initialized:
+            raise RuntimeError(f"could not connect to fake Arduino: {message}")
+
+        results = {
+            'revision': git_revision(),
+            'timestamp': time.time(),
+            'time_scale': args.time_scale,
+            'latency': args.latency,
+            'workloads': {},
+        }
+        for name in args.workloads:
+            batches, skip_hand = WORKLOADS[name]
+            results['workloads'][name] = run_workload(app, rig.chess_controller, batches, skip_hand)
+    finally:
+        octoprint.stop()
+        arduino.stop()
+        shutil.rmtree(config_directory)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.loads(f.read())
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    main()
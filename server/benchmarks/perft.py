@@ -0,0 +1,71 @@
+"""
+Move generation benchmark for the chess engine
+
+Counts the legal move tree of standard perft positions to a fixed depth, checking the node counts
+against the published ones, and times validating whole games move by move, which is what the game
+endpoints do before anything is sent to the hardware.
+
+Run from the server directory: python -m benchmarks.perft
+"""
+import argparse
+import time
+
+from flaskr.chess_controller import ChessController
+from flaskr.chess_engine import Board, perft
+
+# (name, FEN, node counts by depth)
+POSITIONS = [
+    ('start', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1', [20, 400, 8902, 197281]),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', [48, 2039, 97862]),
+    ('endgame', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', [14, 191, 2812, 43238]),
+    ('promotions', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', [6, 264, 9467]),
+]
+
+GAMES = {
+    'scholars_mate': 'e4 e5 Bc4 Nc6 Qh5 Nf6 Qxf7#',
+    'opera_game': (
+        'e4 e5 Nf3 d6 d4 Bg4 dxe5 Bxf3 Qxf3 dxe5 Bc4 Nf6 Qb3 Qe7 Nc3 c6 Bg5 b5 Nxb5 cxb5 Bxb5+ Nbd7 '
+        'O-O-O Rd8 Rxd7 Rxd7 Rd1 Qe6 Bxd7+ Nxd7 Qb8+ Nxb8 Rd8#'
+    ),
+}
+
+
+def run_perft(max_depth):
+    total_nodes = 0
+    total_seconds = 0
+    for name, fen, counts in POSITIONS:
+        depth = min(max_depth, len(counts))
+        started = time.perf_counter()
+        nodes = perft(Board(fen), depth)
+        seconds = time.perf_counter() - started
+        status = 'ok' if nodes == counts[depth - 1] else f"WRONG, expected {counts[depth - 1]}"
+        print(f"{name:>12} depth {depth}: {nodes:>9,} nodes  {nodes / seconds:>9,.0f} nodes/s  {status}")
+        total_nodes += nodes
+        total_seconds += seconds
+    print(f"{'total':>12}: {total_nodes:>17,} nodes  {total_nodes / total_seconds:>9,.0f} nodes/s")
+
+
+def run_games(repeat):
+    for name, moves in GAMES.items():
+        moves = moves.split()
+        best = min(
+            _timed(lambda: ChessController.validate_game(moves, Board()))
+            for _ in range(repeat)
+        )
+        print(f"{name:>14}: {len(moves):>3} plies validated in {best * 1000:6.2f} ms  "
+              f"({best / len(moves) * 1e6:.0f} us/ply)")
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--depth', type=int, default=3, help='maximum perft depth')
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs per game, best is reported')
+    args = parser.parse_args()
+    run_perft(args.depth)
+    run_games(args.repeat)
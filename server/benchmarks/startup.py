@@ -0,0 +1,100 @@
+"""
+Startup time benchmark
+
+Starts a fresh interpreter for every run and times each step from `python -c "import flaskr"` to the
+first request being answered: interpreter start, importing flaskr, create_app, and the first
+request, which is also when the rig it's for gets built. Nothing talks to OctoPrint or the Arduino.
+
+Runs against a scratch copy of the default configuration, so user.json doesn't matter.
+
+Run from the server directory: python -m benchmarks.startup --runs 10
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIRECTORY = os.path.dirname(BENCHMARK_DIRECTORY)
+DEFAULT_CONFIG_FILEPATH = os.path.join(SERVER_DIRECTORY, 'flaskr', 'config', 'default.json')
+
+RESULT_PREFIX = 'STARTUP '
+STAGES = ('interpreter', 'import', 'create_app', 'first_request', 'total')
+
+PROBE = '''
+import json, logging, sys, time
+started_at = time.time()
+started = time.perf_counter()
+import flaskr
+imported = time.perf_counter()
+app = flaskr.create_app()
+created = time.perf_counter()
+logging.getLogger().setLevel(logging.WARNING)
+response = app.test_client().get(sys.argv[1])
+answered = time.perf_counter()
+print({prefix!r} + json.dumps({{
+    'started_at': started_at,
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_request': answered - created,
+    'status': response.status_code,
+}}))
+'''.format(prefix=RESULT_PREFIX)
+
+
+def run_once(path, env):
+    spawned_at = time.time()
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE, path],
+        cwd=SERVER_DIRECTORY,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True,
+        universal_newlines=True,
+    ).stdout
+    finished_at = time.time()
+    line = next(line for line in output.splitlines() if line.startswith(RESULT_PREFIX))
+    result = json.loads(line[len(RESULT_PREFIX):])
+    if result['status'] >= 400:
+        raise RuntimeError(f"first request to {path} failed with status {result['status']}")
+    result['interpreter'] = result['started_at'] - spawned_at
+    result['total'] = finished_at - spawned_at
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters to time')
+    parser.add_argument('--path', default='/chess_v1/game', help='the first request')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    config_directory = tempfile.mkdtemp(prefix='remote_chess_bench_')
+    shutil.copy(DEFAULT_CONFIG_FILEPATH, os.path.join(config_directory, 'default.json'))
+    env = dict(os.environ, REMOTE_CHESS_CONFIG_DIRECTORY=config_directory)
+    try:
+        # one untimed run so every run sees warm file system caches and compiled bytecode
+        run_once(args.path, env)
+        runs = [run_once(args.path, env) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(config_directory)
+
+    results = {'path': args.path, 'runs': args.runs, 'stages': {}}
+    for stage in STAGES:
+        values = [run[stage] for run in runs]
+        results['stages'][stage] = {'median': statistics.median(values), 'min': min(values), 'max': max(values)}
+        print(f"{stage:>14}: {statistics.median(values) * 1000:8.1f} ms median  "
+              f"{min(values) * 1000:8.1f} min  {max(values) * 1000:8.1f} max")
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    main()
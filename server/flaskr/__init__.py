@@ -5,10 +5,6 @@ import sys
 from flask import Flask
 from flask_cors import CORS
 
-from .axis_controller import AxisController
-from .motor_controller import MotorController
-from .config import Configuration
-
 
 def create_app(test_config=None):
     # create and configure the app
@@ -49,8 +45,9 @@ def create_app(test_config=None):
     from . import chess_v1
     app.register_blueprint(chess_v1.bp)
 
-    app.motor_controller = MotorController.instance()
-    app.axis_controller = AxisController.instance()
+    # rigs, and their controllers, are built on the first request that needs them
+    from .rig import RigRegistry
+    app.rigs = RigRegistry(app)
 
     logging.info("App initialization complete")
 
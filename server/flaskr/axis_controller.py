@@ -1,59 +1,50 @@
-import json
 import logging
-import re
+import time
 
 import funcy
 import requests
 
-from .config import Configuration
+from .board_geometry import BoardGeometry
 from .exceptions import AxisControllerException, OctoPrintException
+from .health import HealthPoller
+from .events import EVENT_POSITION, EventBus
+from .octoprint_client import OctoPrintClient
+from . import metrics
+from . import motion
+from . import timing
 
 PRINTER_PROFILE_DEFAULT_ID = '_default'  # set by OctoPrint
 
-NUM_RANKS = 8
-NUM_FILES = 8
+PRINTHEAD_PATH = 'api/printer/printhead'
+COMMAND_PATH = 'api/printer/command'
+PRINTER_STATE_PATH = 'api/printer'
+PRINTER_PROFILES_PATH = 'api/printerprofiles'
 
-space_position_regex = re.compile(r'(?P<file>[A-Z])(?P<rank>[0-9]+)')
-spr = re.compile(r'(?P<file>[A-Z])(?P<rank>[0-9]+)')
+# M400 holds the printer's acks until every queued move is done, M114 then reports where it ended up
+MOVE_BARRIER_COMMANDS = ['M400', 'M114']
 
-logger = logging.getLogger(__name__)
-
-
-def parse_space_position(position):
-    match = space_position_regex.match(position)
-    if not match:
-        raise Exception(f"invalid space position: {position}")
-    groups = match.groupdict()
-    return {
-        'rank': int(groups['rank']),
-        'file': groups['file'].upper(),
-    }
-
-
-def rank_to_index(rank):
-    logger.info(rank)
-    if not (1 <= rank <= 8):
-        raise Exception(f"bad rank: {rank}")
-    return rank - 1
+IDLE_POLL_SLEEP = 0.1  # seconds
+POSITION_TOLERANCE = 0.005  # mm, finer than the 0.01 mm the G-code is written with
 
-
-def file_to_index(file):
-    if file not in {'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H'}:
-        raise Exception(f"bad file: {file}")
-    return int(ord(file) - 65)
+logger = logging.getLogger(__name__)
 
 
 class AxisController(object):
-    def __init__(self):
+    """
+    Drives one rig's printer through OctoPrint.
+
+    :param config: the rig's Configuration
+    :param events: the rig's EventBus
+    """
+    def __init__(self, config, events=None):
+        self.config = config
+        self.events = events or EventBus()
         self._initialized = False
-        self.session = requests.Session()
-        self.session.headers.update({
-            'X-Api-Key': Configuration.config().get('octoprint_api_key'),
-            'Content-Type': 'application/json',
-        })
+        self.octoprint = OctoPrintClient(self.config)
+        self._profile_requests = {}  # profile id -> future for a profile requested ahead of time
 
         try:
-            int(Configuration.config().get('z_axis_height'))
+            int(self.config.get('z_axis_height'))
         except ValueError:
             raise Exception('need valid config value for z_axis_height')
 
@@ -62,164 +53,172 @@ class AxisController(object):
             'y': False,
             'z': False,
         }
-
-    @classmethod
-    def instance(cls):
-        return _instance
-
-    def octoprint_url(self, path):
-        return f"http://{Configuration.config().get('octoprint_ip_address')}/{path}"
-
-    @property
-    def printhead_url(self):
-        return self.octoprint_url(f"api/printer/printhead")
-
-    @property
-    def printer_profiles_url(self):
-        return self.octoprint_url(f"api/printerprofiles")
+        # last commanded printhead position, None until the axis has been homed or after anything
+        # that could have left the printhead somewhere else
+        # time.monotonic() when everything sent to the printer so far should be done
+        self.busy_until = 0
+        self.position = {
+            'x': None,
+            'y': None,
+            'z': None,
+        }
+        self.geometry = BoardGeometry(self.config)
+        self.health = HealthPoller(
+            'octoprint',
+            self.get_octoprint_server_status,
+            lambda: self.config.get('octoprint_status_ttl'),
+            events=self.events,
+        )
 
     @property
     def has_been_homed(self):
         return self.homed['x'] and self.homed['y'] and self.homed['z']
 
     # START Initialization methods #
+    @timing.timed(timing.STAGE_INIT, 'octoprint_initialize')
     def intialize_octoprint(self):
         # this is only really necessary for testing on the Ender since the z axis can slide down
         # if the steppers are disabled
-        config = Configuration.config()
+        config = self.config
         logger.info("starting OctoPrint initialization")
-        response = self.session.post(
-            self.octoprint_url("/api/printer/command"),
-            data=json.dumps({
-                'commands': [
-                    f"M84 S{config.get('printer_stepper_timeout')}",  # set stepper timeout
-                    "M107",  # disable extruder fan
-                ]
-            })
+        # the first move's time estimate needs the printer profile, fetch it alongside
+        self._profile_requests[PRINTER_PROFILE_DEFAULT_ID] = self.octoprint.submit(
+            'GET', f"{PRINTER_PROFILES_PATH}/{PRINTER_PROFILE_DEFAULT_ID}",
         )
+        response = self.octoprint.post(COMMAND_PATH, {
+            'commands': [
+                f"M84 S{config.get('printer_stepper_timeout')}",  # set stepper timeout
+                "M107",  # disable extruder fan
+            ]
+        })
         if response.ok:
             logger.info("OctoPrint initialization complete")
             self._initialized = True
+            # the printhead may have been moved while we weren't connected
+            self.invalidate_position()
             return True, ''
 
         logger.info(f"OctoPrint initialization failed: {response.status_code}, {response.reason}")
         return False, response.reason
 
+    def _check_octoprint(self, check, request, state_from_response, timeout):
+        """ Waits for one OctoPrint status check's `request`, returns its {'status', 'message'} """
+        try:
+            response = request.result()
+        except requests.exceptions.ConnectionError:
+            logger.error(f"ConnectionError encountered checking OctoPrint {check}")
+            return {'status': 'NOT OK', 'message': 'failed to connect, is OctoPrint running?'}
+        except requests.exceptions.Timeout:
+            logger.error(f"timed out checking OctoPrint {check}")
+            return {'status': 'NOT OK', 'message': f"timed out after {timeout}s checking OctoPrint {check}"}
+
+        if not response.ok:
+            logger.error(f"{check} check failed with status {response.status_code} {response.reason}")
+            return {
+                'status': 'NOT OK',
+                'message': f"received {response.status_code}, {response.reason} checking OctoPrint {check}",
+            }
+
+        if state_from_response is not None:
+            state = state_from_response(response.json())
+            if state != 'Operational':
+                logger.error(f"{check} check failed, non-operational status {state}")
+                return {'status': 'NOT OK', 'message': f"received non-operational state {state}"}
+
+        logger.info(f"{check} check OK")
+        return {'status': 'OK', 'message': ''}
+
     def get_octoprint_server_status(self):
+        """ Checks OctoPrint's version, connection and job endpoints, all at once """
         logger.info("getting OctoPrint server status")
         checks = {
             'initialized': self._initialized,
-            'version': {
-                'status': 'NOT OK',
-                'message': '',
-            },
-            'connection': {
-                'status': 'NOT OK',
-                'message': '',
-            },
-            'job': {
-                'status': 'NOT OK',
-                'message': '',
-            }
         }
-        config = Configuration.config()
-
-        def not_ok_message(response, check):
-            return f"received {response.status_code}, {response.reason} checking OctoPrint {check}"
-
-        logger.info("checking OctoPrint version")
-        try:
-            version_response = self.session.get(self.octoprint_url('/api/version'), timeout=10)
-        except requests.exceptions.ConnectionError:
-            logger.error(f"ConnectionError encountered connectinng to octoprint")
-            checks['version']['status'] = 'NOT OK'
-            checks['version']['message'] = 'failed to connect, is OctoPrint running?'
-            return checks
-
-        if version_response.ok:
-            logger.info("version check OK")
-            checks['version']['status'] = 'OK'
-        else:
-            logger.error(f"version check failed with status {version_response.status_code} {version_response.reason}")
-            checks['version']['status'] = 'NOT OK'
-            checks['version']['message'] = not_ok_message(version_response, 'version')
-            return checks
-
-        logger.info("checking OctoPrint connection")
-        connection_response = self.session.get(self.octoprint_url('/api/connection'))
-        if connection_response.ok:
-            connection_status = connection_response.json()['current']['state']
-            is_operational = connection_status == 'Operational'
-            if is_operational:
-                logger.info("connection check OK")
-                checks['connection']['status'] = 'OK'
-            else:
-                logger.error(f"connection check failed, non-operational status {connection_status}")
-                checks['connection']['status'] = 'NOT OK'
-                checks['connection']['message'] = f"received non-operational state {connection_status}"
-        else:
-            logger.error(f"connection check failed with status {connection_response.status_code} {connection_response.reason}")
-            checks['connection']['status'] = 'NOT OK'
-            checks['connection']['message'] = not_ok_message(connection_response, 'connection')
-            return checks
-
-        logger.info("checking OctoPrint job status")
-        job_response = self.session.get(self.octoprint_url('/api/job'))
-        if job_response.ok:
-            job_status = job_response.json()['state']
-            is_operational = job_status == 'Operational'
-            if is_operational:
-                logger.info("job check OK")
-                checks['job']['status'] = 'OK'
-                checks['job']['message'] = ''
-            else:
-                logger.error(f"job check failed, non-operational status {job_status}")
-                checks['job']['status'] = 'NOT OK'
-                checks['job']['message'] = f"received non-operational state {job_status}"
-        else:
-            logger.error(f"job check failed with status {job_response.status_code} {job_response.reason}")
-            checks['job']['status'] = 'NOT OK'
-            checks['job']['message'] = not_ok_message(job_response, 'job')
+        # no retries, the poller checks again soon enough and the status shouldn't wait on them
+        timeout = self.config.get('octoprint_status_timeout')
+        pending = {
+            check: (self.octoprint.submit('GET', path, timeout=timeout, retries=0), state_from_response)
+            for check, path, state_from_response in (
+                ('version', 'api/version', None),
+                ('connection', 'api/connection', lambda data: data['current']['state']),
+                ('job', 'api/job', lambda data: data['state']),
+            )
+        }
+        for check, (request, state_from_response) in pending.items():
+            checks[check] = self._check_octoprint(check, request, state_from_response, timeout)
 
         logger.info("OctoPrint server status check complete")
         return checks
 
-    # END Initialization methods #
+    def octoprint_status(self):
+        """ Latest OctoPrint status from the background health poller, without waiting on OctoPrint """
+        status = self.health.status()
+        status['initialized'] = self._initialized
+        return status
 
-    def _calculate_x_from_file(self, file):
-        file_index = file_to_index(file)
-        printer_profile = self.printer_profile()
-        width = printer_profile['volume']['width']
-
-        config = Configuration.config()
-        board_x_offset = config.get('board_x_offset')
-        board_x_padding = config.get('board_x_padding')
-        board_left_edge = board_x_offset + board_x_padding
-        space_edge = board_left_edge + int(config.get('space_width') * file_index)
-        space_center = space_edge + (config.get('space_width') / 2)
-        x_position = space_center - config.get('printhead_x_offset')
-        return x_position
-
-    def _calculate_y_from_rank(self, rank):
-        rank_index = rank_to_index(rank)
-
-        config = Configuration.config()
-        board_y_offset = config.get('board_y_offset')
-        board_y_padding = config.get('board_y_padding')
-        board_near_edge = board_y_offset + board_y_padding
-        space_edge = board_near_edge + int(config.get('space_depth') * rank_index)
-
-        space_center = space_edge + (config.get('space_depth') / 2)
-        y_position = space_center - config.get('printhead_y_offset')
-        return y_position
+    # END Initialization methods #
 
     @funcy.memoize
     def printer_profile(self, profile_id=PRINTER_PROFILE_DEFAULT_ID):
-        response = self.session.get(f"{self.printer_profiles_url}/{profile_id}")
+        request = self._profile_requests.pop(profile_id, None)
+        if request is not None:
+            response = request.result()
+        else:
+            response = self.octoprint.get(f"{PRINTER_PROFILES_PATH}/{profile_id}")
         if not response.ok:
             raise OctoPrintException(f"get printer profile failed with status {response.status_code} {response.reason}")
 
-        return json.loads(response.content)
+        return response.json()
+
+    def printer_state(self):
+        response = self.octoprint.get(PRINTER_STATE_PATH, params={'exclude': 'temperature,sd'})
+        if not response.ok:
+            raise OctoPrintException(f"get printer state failed with status {response.status_code} {response.reason}")
+        return response.json()['state']
+
+    def wait_until_idle(self, expected=0, barrier=True):
+        """ Block until every move queued so far should have finished
+
+            OctoPrint doesn't hand the printer's replies back over its REST API, so the M114 answer
+            never reaches us, and its `ready` flag only means operational and not printing, so it
+            stays true through homing, jogs and G-code. Nothing it reports says when a move is
+            done, so this waits until the tracked `busy_until`, which every move and home adds its
+            estimated time to, or `expected` seconds from now if that's later, plus
+            move_wait_margin, which has to cover how far the estimates can be off.
+
+            The M400 barrier holds back anything sent to the printer after it until the moves are
+            done, and the M114 after it logs the settled position in the OctoPrint terminal. Pass
+            `barrier=False` if the moves were sent with `execute_moves`, which already ends with it.
+
+            Then the printer state is checked, so an error while moving is raised here, and polled
+            until ready for as long as the printer says it isn't.
+        """
+        config = self.config
+        started = time.monotonic()
+        if barrier:
+            response = self.octoprint.post(COMMAND_PATH, {'commands': MOVE_BARRIER_COMMANDS})
+            if not response.ok:
+                raise OctoPrintException(f"move barrier failed with status {response.status_code} {response.reason}")
+
+        settled = max(self.busy_until, started + expected) + config.get('move_wait_margin')
+        with timing.span(timing.STAGE_WAIT, 'printer_idle'):
+            time.sleep(max(0, settled - time.monotonic()))
+        deadline = settled + config.get('printer_idle_timeout')
+        while True:
+            flags = self.printer_state()['flags']
+            if flags.get('error'):
+                raise OctoPrintException("printer reported an error while moving")
+            if flags.get('operational') and flags.get('ready'):
+                break
+            if time.monotonic() > deadline:
+                raise AxisControllerException("timed out waiting for printer to finish moving")
+            with timing.span(timing.STAGE_WAIT, 'printer_idle'):
+                time.sleep(IDLE_POLL_SLEEP)
+        logger.info(f"printer idle after {time.monotonic() - started:.2f}s (expected {expected:.2f}s)")
+
+    def _queue_motion(self, seconds):
+        """ Adds `seconds` of motion to the printer's queue, which it works through in order """
+        self.busy_until = max(self.busy_until, time.monotonic()) + seconds
 
     def home(self, x=False, y=False, z=False, use_hand_offset=False):
         axes = []
@@ -227,18 +226,22 @@ class AxisController(object):
         if y: axes.append('y')
         if z: axes.append('z')
         logger.info(f"Homing {axes}")
-        response = self.session.post(self.printhead_url, data=json.dumps({
+        response = self.octoprint.post(PRINTHEAD_PATH, {
             'command': 'home',
             'axes': axes,
-        }))
+        })
         if response.ok:
-            if x: self.homed['x'] = True
-            if y: self.homed['y'] = True
-            if z: self.homed['z'] = True
+            # OctoPrint answers straight away, the next wait has to allow for the homing itself
+            self._queue_motion(self.config.get('printer_homing_time'))
+            for axis in axes:
+                self.homed[axis] = True
+                self.position[axis] = 0
+            self._publish_position(self.busy_until - time.monotonic())
             logger.info("homing complete")
             if use_hand_offset:
-                self.move_to_relative(x=0, y=0, z=Configuration.config().get('z_axis_height'))
+                self.move_to_relative(x=0, y=0, z=self.config.get('z_axis_height'))
             return
+        self.invalidate_position(axes)
         logger.error(f"homing failed with status {response.status_code} {response.reason}")
         raise OctoPrintException(f"homing failed with status {response.status_code} {response.reason}")
 
@@ -254,23 +257,157 @@ class AxisController(object):
             data['y'] = y
         if z is not None:
             data['z'] = z
-        data['speed'] = Configuration.config().get('printhead_speed')
+        data['speed'] = self.config.get('printhead_speed')
         logger.info(data)
 
-        response = self.session.post(self.printhead_url, data=json.dumps(data))
+        response = self.octoprint.post(PRINTHEAD_PATH, data)
         if not response.ok:
             raise OctoPrintException(f"moving relative failed with status {response.status_code} {response.reason}")
 
+        estimate = self.estimate_move_time(x=x, y=y, z=z, relative=True)
+        self._queue_motion(estimate)
+        for axis, delta in (('x', x), ('y', y), ('z', z)):
+            if delta is not None and self.position[axis] is not None:
+                self.position[axis] += delta
+        self._publish_position(estimate)
+        return estimate
+
+    def estimate_move_time(self, x=None, y=None, z=None, relative=False):
+        """ Seconds the printhead needs to get from its last commanded position to (x, y, z)
+
+            If the starting position of an axis that's moving isn't known, assume the worst case
+            and travel the full length of that axis.
+        """
+        config = self.config
+        printer_profile = self.printer_profile()
+        volume = printer_profile.get('volume', {})
+        axis_lengths = {
+            'x': volume.get('width', 0),
+            'y': volume.get('depth', 0),
+            'z': volume.get('height', 0),
+        }
+        axis_feedrates = {
+            axis: settings.get('speed')
+            for axis, settings in printer_profile.get('axes', {}).items()
+        }
+
+        start = {}
+        end = {'x': x, 'y': y, 'z': z}
+        for axis, target in end.items():
+            if target is None:
+                continue
+            if relative:
+                start[axis] = 0
+            elif self.position[axis] is None:
+                start[axis] = target + axis_lengths[axis]
+            else:
+                start[axis] = self.position[axis]
+
+        return motion.printhead_move_time(
+            start,
+            end,
+            feedrate=config.get('printhead_speed'),
+            acceleration=config.get('printhead_acceleration'),
+            axis_feedrates=axis_feedrates,
+        )
+
+    def invalidate_position(self, axes=('x', 'y', 'z')):
+        """ Forget the tracked position so the next move sends every axis
+
+            OctoPrint doesn't hand back the printer's reply to M114, so the only way to get back in
+            sync is to stop trusting the model and command every axis absolutely.
+        """
+        for axis in axes:
+            self.position[axis] = None
+        self._publish_position()
+
+    def _publish_position(self, expected=0):
+        """ Publishes the commanded position, which the printhead reaches `expected` seconds from now """
+        self.events.publish(EVENT_POSITION, device='printer', expected=expected, homed=dict(self.homed), **self.position)
+
+    def _unchanged(self, axis, value, position=None):
+        position = self.position if position is None else position
+        return (
+            value is None
+            or (position[axis] is not None and abs(position[axis] - value) < POSITION_TOLERANCE)
+        )
+
     def move_to_space(self, space):
         logger.info(f"moving to space: ({space})")
-        data = {'absolute': True, 'command': 'job'}
-        parsed_space = parse_space_position(space)
-        data = {
-            'x': self._calculate_x_from_file(parsed_space['file']),
-            'y': self._calculate_y_from_rank(parsed_space['rank']),
-            'z': Configuration.config().get('z_axis_height'),
-        }
-        return self.move_to_absolute(**data)
+        x, y, z = self.geometry.position(space)
+        return self.move_to_absolute(x=x, y=y, z=z)
+
+    def move_through_spaces(self, spaces):
+        logger.info(f"moving through spaces: {spaces}")
+        return self.execute_moves([self.geometry.position(space) for space in spaces])
+
+    def compile_moves(self, positions):
+        """ G-code to move the printhead through each (x, y, z) in `positions` in absolute coordinates
+
+            Axes that are None, or already where they are asked to be, are left out. Every line carries
+            its own feedrate and the sequence ends with the move barrier. Nothing at all is returned
+            if nothing would move.
+        """
+        feedrate = self.config.get('printhead_speed')
+        commands = []
+        current = dict(self.position)
+        for position in positions:
+            words = []
+            for axis, value in zip(('x', 'y', 'z'), position):
+                if not self._unchanged(axis, value, current):
+                    words.append(f"{axis.upper()}{value:.2f}")
+                    current[axis] = value
+            if words:
+                commands.append(' '.join(['G0'] + words + [f"F{feedrate}"]))
+        if not commands:
+            return []
+        return ['G90'] + commands + MOVE_BARRIER_COMMANDS
+
+    def execute_moves(self, positions):
+        """ Sends every move in `positions` to the printer in a single request
+
+            The printer gets the whole sequence at once and plans straight through it, so there's no
+            round trip between segments. Follow up with `wait_until_idle(expected, barrier=False)`.
+
+            :param positions: sequence of (x, y, z), axes that are None don't move
+            :returns: expected seconds for the whole sequence, 0 if nothing needed to move
+        """
+        if not self._initialized:
+            raise AxisControllerException("axis controller not initialized")
+        if not self.has_been_homed:
+            raise AxisControllerException("home axes first")
+
+        commands = self.compile_moves(positions)
+        if not commands:
+            logger.info("printhead already in position")
+            metrics.commands_elided.inc(device='printer')
+            return 0
+        logger.info(commands)
+
+        # estimate segment by segment, tracking the position as we go
+        previous_position = dict(self.position)
+        expected = 0
+        for x, y, z in positions:
+            expected += self.estimate_move_time(x=x, y=y, z=z)
+            for axis, value in (('x', x), ('y', y), ('z', z)):
+                if value is not None:
+                    self.position[axis] = value
+
+        try:
+            response = self.octoprint.post(COMMAND_PATH, {'commands': commands})
+        except requests.RequestException:
+            # the printer may or may not have got the moves
+            self.invalidate_position()
+            self._queue_motion(expected)
+            raise
+        if not response.ok:
+            self.position = previous_position
+            raise OctoPrintException(f"batch move failed with status {response.status_code} {response.reason}")
+        self._queue_motion(expected)
+
+        self._publish_position(expected)
+        logger.info(f"expected move time: {expected:.2f}s")
+        return expected
 
     def move_to_absolute(self, x=None, y=None, z=None):
         logger.info(f"moving to absolute position: ({x}, {y}, {z})")
@@ -279,6 +416,13 @@ class AxisController(object):
         if not self.has_been_homed:
             raise AxisControllerException("home axes first")
 
+        # skip axes that are already in place, and the request entirely if none need to move
+        x, y, z = (None if self._unchanged(axis, value) else value for axis, value in (('x', x), ('y', y), ('z', z)))
+        if x is None and y is None and z is None:
+            logger.info("printhead already in position")
+            metrics.commands_elided.inc(device='printer')
+            return 0
+
         data = {'absolute': True, 'command': "jog"}
         if x is not None:
             data['x'] = x
@@ -286,16 +430,26 @@ class AxisController(object):
             data['y'] = y
         if z is not None:
             data['z'] = z
-        data['speed'] = Configuration.config().get('printhead_speed')
+        data['speed'] = self.config.get('printhead_speed')
         logger.info(data)
 
-        # I think we'll have to calculate how long we think this will take and wait that long -__-
-        # No support for polling position through octoprint and arbitrary commands return 204 no content
-        # So that means we'll have to keep track of current position? Oof, maybe we can just wait longer than
-        # we'll always need, since this is a proof of concept and all...
-        response = self.session.post(self.printhead_url, data=json.dumps(data))
+        # No support for polling position through octoprint and arbitrary commands return 204 no content,
+        # so keep track of the last commanded position and return how long we expect the move to take
+        estimate = self.estimate_move_time(x=x, y=y, z=z)
+        try:
+            response = self.octoprint.post(PRINTHEAD_PATH, data)
+        except requests.RequestException:
+            self.invalidate_position()
+            self._queue_motion(estimate)
+            raise
         if not response.ok:
             raise OctoPrintException(f"moving relative failed with status {response.status_code} {response.reason}")
+        self._queue_motion(estimate)
 
+        for axis, value in (('x', x), ('y', y), ('z', z)):
+            if value is not None:
+                self.position[axis] = value
+        self._publish_position(estimate)
+        logger.info(f"expected move time: {estimate:.2f}s")
+        return estimate
 
-_instance = AxisController()
@@ -0,0 +1,119 @@
+import logging
+
+from .exceptions import AxisControllerException
+from . import timing
+
+FILES = 'ABCDEFGH'
+RANKS = range(1, 9)
+
+# config keys that affect where the printhead has to go for a space
+GEOMETRY_KEY_PREFIXES = ('board_', 'printhead_', 'space_', 'graveyard_')
+GEOMETRY_KEYS = ('z_axis_height', 'off_board_slots')
+
+GRAVEYARD_EDGES = ('left', 'right', 'front', 'back')
+
+logger = logging.getLogger(__name__)
+
+
+def is_geometry_key(key):
+    return key.startswith(GEOMETRY_KEY_PREFIXES) or key in GEOMETRY_KEYS
+
+
+class BoardGeometry(object):
+    """
+    Printhead (x, y, z) positions for every space on the board, every graveyard slot along the board
+    edges and every named off-board slot.
+
+    The table is built once and only rebuilt when the configuration changes one of the keys
+    that goes into it, so looking up a position is a dictionary lookup.
+    """
+    def __init__(self, config):
+        self._config = config
+        self._config_version = None
+        self._geometry_values = None
+        self._positions = {}
+        self._graveyard_slots = []
+
+    @property
+    def positions(self):
+        conf = self._config._config
+        if self._config.version != self._config_version:
+            geometry_values = [(key, value) for key, value in sorted(conf.items()) if is_geometry_key(key)]
+            if geometry_values != self._geometry_values:
+                self._positions = self._build(conf)
+                self._geometry_values = geometry_values
+            self._config_version = self._config.version
+        return self._positions
+
+    def graveyard_slots(self):
+        """ Names of every slot captured pieces can be dropped in """
+        self.positions
+        return list(self._graveyard_slots)
+
+    def position(self, space):
+        with timing.span(timing.STAGE_CONFIG, 'geometry'):
+            try:
+                return self.positions[space.upper()]
+            except (KeyError, AttributeError):
+                raise AxisControllerException(f"invalid space position: {space}")
+
+    def _build(self, conf):
+        logger.info("building board geometry")
+        z = conf['z_axis_height']
+        board_left_edge = conf['board_x_offset'] + conf['board_x_padding']
+        board_near_edge = conf['board_y_offset'] + conf['board_y_padding']
+
+        positions = {}
+        for file_index, file in enumerate(FILES):
+            space_edge = board_left_edge + int(conf['space_width'] * file_index)
+            x = space_edge + (conf['space_width'] / 2) - conf['printhead_x_offset']
+            for rank in RANKS:
+                space_edge = board_near_edge + int(conf['space_depth'] * (rank - 1))
+                y = space_edge + (conf['space_depth'] / 2) - conf['printhead_y_offset']
+                positions[f"{file}{rank}"] = (x, y, z)
+
+        # off-board slots are given as bed coordinates of the hand center
+        slots = dict(self._edge_slots(conf))
+        slots.update({name.upper(): slot for name, slot in conf.get('off_board_slots', {}).items()})
+        for name, (slot_x, slot_y) in slots.items():
+            positions[name] = (
+                slot_x - conf['printhead_x_offset'],
+                slot_y - conf['printhead_y_offset'],
+                z,
+            )
+        self._graveyard_slots = list(slots)
+        return positions
+
+    @staticmethod
+    def _edge_slots(conf):
+        """ Yields (name, (x, y)) in bed coordinates of the hand center for each graveyard slot
+
+            Each edge in graveyard_edges gets graveyard_rows rows of slots, graveyard_margin mm out
+            from the board and graveyard_slot_spacing mm apart, centered on the edge. Slots are named
+            after their edge, row and index, e.g. GY_R1_3.
+        """
+        spacing = conf['graveyard_slot_spacing']
+        margin = conf['graveyard_margin']
+        left = conf['board_x_offset']
+        right = left + conf['board_width']
+        near = conf['board_y_offset']
+        far = near + conf['board_depth']
+        for edge in conf['graveyard_edges']:
+            if edge not in GRAVEYARD_EDGES:
+                raise AxisControllerException(f"invalid graveyard edge: {edge}")
+            along_x = edge in ('front', 'back')
+            start, end = (left, right) if along_x else (near, far)
+            count = int((end - start) // spacing)
+            first = start + (end - start - (count - 1) * spacing) / 2
+            for row in range(conf['graveyard_rows']):
+                offset = margin + row * spacing
+                across = {
+                    'left': left - offset,
+                    'right': right + offset,
+                    'front': near - offset,
+                    'back': far + offset,
+                }[edge]
+                for index in range(count):
+                    along = first + index * spacing
+                    name = f"GY_{edge[0].upper()}{row + 1}_{index + 1}"
+                    yield name, ((along, across) if along_x else (across, along))
@@ -1,71 +1,455 @@
-from flask import current_app
+import functools
+import logging
+import queue
+import threading
 import time
 
-from .axis_controller import AxisController
-from .motor_controller import MotorController
+from .chess_engine import Board, STARTING_FEN, WHITE
+from .exceptions import IllegalMoveException
+from .graveyard import Graveyard
+from .move_planner import MovePlanner
+from .pgn import PgnReader
+from .step_graph import DEVICE_ARDUINO, DEVICE_PRINTER, StepGraph
+from .events import EVENT_MOVE, EventBus
+from . import metrics
+from . import timing
+
+DEFAULT_DISCARD_SPACE = 'A4'  # only used if there are no graveyard slots configured
+REPLAY_LOOKAHEAD = 2  # plies parsed and planned ahead of the one on the board during a replay
+GRAVEYARD_FILENAME = 'graveyard.json'
+
+logger = logging.getLogger(__name__)
+
 
 class ChessController(object):
-    @classmethod
-    def instance(cls):
-        return _instance
+    """
+    Turns chess moves into work for one rig's printer and Arduino.
+
+    :param axis_controller: the rig's AxisController
+    :param motor_controller: the rig's MotorController
+    :param events: the rig's EventBus
+    """
+    def __init__(self, axis_controller, motor_controller, events=None):
+        self.axis_controller = axis_controller
+        self.motor_controller = motor_controller
+        self.events = events or EventBus()
+        # the game being played on the physical board, only as far as the board has got
+        self.game = Board()
+        self.game_moves = []
+        # the game after every move queued by play_moves, which later moves are validated against
+        self._queued_game = self.game.copy()
+        self._game_lock = threading.Lock()
+        # where captured pieces have been dropped
+        self.graveyard = Graveyard(
+            axis_controller.geometry,
+            axis_controller.config.rig_filepath(GRAVEYARD_FILENAME),
+        )
+
+    def new_game(self, fen=STARTING_FEN):
+        board = Board(fen)
+        with self._game_lock:
+            self.game = board
+            self.game_moves = []
+            self._queued_game = board.copy()
+        return self.game_state()
+
+    def game_state(self):
+        with self._game_lock:
+            board = self.game.copy()
+            moves = list(self.game_moves)
+        return {
+            'fen': board.fen(),
+            'turn': 'white' if board.turn == WHITE else 'black',
+            'moves': moves,
+            'check': board.is_check(),
+            'outcome': board.outcome(),
+            'legal_moves': sorted(move.uci() for move in board.legal_moves()),
+        }
+
+    @staticmethod
+    def validate_game(moves, board):
+        """ Plays `moves` (UCI or SAN) on `board` without touching the hardware
+
+            :raises IllegalMoveException: at the first illegal move
+            :returns: for each move its UCI and SAN and the perform_moves actions that carry it out
+        """
+        played = []
+        for text in moves:
+            move = board.parse_move(text)
+            played.append({
+                'uci': move.uci(),
+                'san': board.san(move),
+                'actions': board.physical_actions(move),
+            })
+            board.push(move)
+        return played
+
+    def play_moves(self, moves):
+        """ Validates `moves` against the game, following any moves already queued, and queues them
+
+            Nothing moves here, carry them out with perform_game_moves. The game only takes each
+            move once it's been played on the board.
+
+            :raises IllegalMoveException: if any move is illegal, in which case nothing is queued
+            :returns: (validated moves as from validate_game, FEN of the position they start from)
+        """
+        with self._game_lock:
+            board = self._queued_game.copy()
+            start_fen = board.fen()
+            played = self.validate_game(moves, board)
+            self._queued_game = board
+        return played, start_fen
+
+    def perform_game_moves(self, played, start_fen, skip_hand=True, job=None):
+        """ Carries out moves from play_moves a ply at a time, each joins the game once it's done
+
+            If a ply fails or the job is cancelled, the game stays at the last ply that was
+            finished, even if the board got partway through the next one, and every move queued
+            after it is dropped. Each ply is a step of `job`.
+
+            :raises IllegalMoveException: if the game isn't where these moves start from any more,
+                because it was restarted or moves queued before these didn't get played
+        """
+        if job is not None:
+            job.total_steps = len(played)
+        expected_fen = start_fen
+        for entry in played:
+            with self._game_lock:
+                if self.game.fen() != expected_fen:
+                    raise IllegalMoveException(f"the game changed before {entry['san']} was played")
+            try:
+                if job is not None:
+                    job.check_cancelled()
+                self.perform_plan(self.plan_moves(entry['actions']), skip_hand=skip_hand, job=job, report_steps=False)
+            except Exception:
+                # the game stops here, so nothing queued after this ply can be played now
+                with self._game_lock:
+                    self._queued_game = self.game.copy()
+                raise
+            with self._game_lock:
+                self.game.push(self.game.parse_move(entry['uci']))
+                self.game_moves.append(entry['san'])
+                expected_fen = self.game.fen()
+            if job is not None:
+                job.step_complete()
+        return played
+
+    def _move_printhead(self, *spaces):
+        """ Moves the printhead through `spaces` and returns once it should be over the last one
+
+            OctoPrint can't say when a move has finished, so this waits out the estimate plus
+            move_wait_margin. Travel steps run this, so the z steps that depend on them aren't
+            started any earlier.
+        """
+        expected = self.axis_controller.move_through_spaces(spaces)
+        if expected:
+            self.axis_controller.wait_until_idle(expected, barrier=False)
+
+    def _add_pickup(self, graph, space, after):
+        """ Adds the steps to pick up the piece on `space`, returns the last one
+
+            The hand is opened while the printhead travels; the sketch answers straight away if
+            it's already open. Lowering, grabbing and lifting are queued on the Arduino together,
+            so each starts as soon as the one before it is done.
+        """
+        motor_controller = self.motor_controller
+        travel = graph.add(
+            f"travel to {space}",
+            DEVICE_PRINTER,
+            functools.partial(self._move_printhead, space),
+            after=after,
+            checkpoint=True,
+        )
+        ready = graph.add("open hand", DEVICE_ARDUINO, motor_controller.hand_open, after=after)
+        # only lower the hand once the printhead is over the space, travel waits out move_wait_margin,
+        # and only travel again once z up says the piece is clear of the board
+        return graph.add(
+            "grab",
+            DEVICE_ARDUINO,
+            functools.partial(motor_controller.send_moves, 'z:down', 'hand:close', 'z:up'),
+            after=[travel, ready],
+        )
+
+    def _add_travel(self, graph, space, after):
+        return graph.add(
+            f"travel to {space}",
+            DEVICE_PRINTER,
+            functools.partial(self._move_printhead, space),
+            after=after,
+        )
+
+    def _add_move_to_space(self, graph, starting_space, ending_space, after=()):
+        motor_controller = self.motor_controller
+        lifted = self._add_pickup(graph, starting_space, after)
+        travel = self._add_travel(graph, ending_space, [lifted])
+        # same as the pickup, not before the printhead has settled over the space
+        return graph.add(
+            "release",
+            DEVICE_ARDUINO,
+            functools.partial(motor_controller.send_moves, 'z:down', 'hand:open', 'z:up'),
+            after=[travel],
+        )
+
+    def _add_remove_from_board(self, graph, space, discard_space, after=(), piece=None):
+        motor_controller = self.motor_controller
+        lifted = self._add_pickup(graph, space, after)
+        travel = self._add_travel(graph, discard_space, [lifted])
+
+        def drop():
+            # drop it from above
+            motor_controller.hand_open()
+            self._discarded(space, discard_space, piece)
+        return graph.add("open hand", DEVICE_ARDUINO, drop, after=[travel])
+
+    def _discarded(self, space, discard_space, piece=None):
+        """ Records the piece from `space` as being in `discard_space`, if that's a graveyard slot
+
+            Called for every performed discard, with the hand or without, so the graveyard follows
+            the board either way.
+        """
+        if discard_space.upper() in self.graveyard.geometry.graveyard_slots():
+            self.graveyard.occupy(discard_space, space, piece)
 
     def perform_move_to_space(self, starting_space, ending_space, skip_hand=False):
         # assume that we start above the pieces
-        axis_controller = current_app.axis_controller
-        motor_controller = current_app.motor_controller
-        axis_controller.move_to_space(starting_space)
-        time.sleep(5)  # Let's just make this more than it'll ever be
-        if not skip_hand:
-            motor_controller.z_down()
-            time.sleep(5)
-            motor_controller.hand_close()
-            time.sleep(3)
-            motor_controller.z_up()
-            time.sleep(5)
-        axis_controller.move_to_space(ending_space)
-        time.sleep(5)
-        if not skip_hand:
-            motor_controller.z_down()
-            time.sleep(5)
-            motor_controller.hand_open()
-            time.sleep(3)
-            motor_controller.z_up()
-
-    def perform_remove_from_board(self, space, skip_hand=False):
-        # TODO ??
-        # maybe just drop it off the side of the board? lol
-        axis_controller = current_app.axis_controller
-        motor_controller = current_app.motor_controller
-        axis_controller.move_to_space(space)
-        time.sleep(5)  # Let's just make this more than it'll ever be
-        if not skip_hand:
-            motor_controller.z_down()
-            time.sleep(5)
-            motor_controller.hand_close()
-            time.sleep(3)
-            motor_controller.z_up()
-            time.sleep(5)
-        discard_space = 'A4'  # TODO: find somewhere off the board to drop the piece
-        axis_controller.move_to_space(discard_space)
-        time.sleep(5)
-        if not skip_hand:
-            motor_controller.hand_open()
-            time.sleep(3)
+        if skip_hand:
+            self._move_printhead(starting_space, ending_space)
+            return
+        graph = StepGraph(events=self.events)
+        self._add_move_to_space(graph, starting_space, ending_space)
+        graph.run()
+
+    def perform_remove_from_board(self, space, discard_space=None, skip_hand=False):
+        """ Drops the piece on `space` in `discard_space`, or the nearest free graveyard slot """
+        if discard_space is None:
+            discard_space = self.graveyard.nearest_free(space) if self.graveyard.geometry.graveyard_slots() \
+                else DEFAULT_DISCARD_SPACE
+        if skip_hand:
+            self._move_printhead(space, discard_space)
+            self._discarded(space, discard_space)
+            return
+        graph = StepGraph(events=self.events)
+        self._add_remove_from_board(graph, space, discard_space)
+        graph.run()
+
+    def discard_spaces(self):
+        graveyard_slots = self.graveyard.geometry.graveyard_slots()
+        if graveyard_slots:
+            return graveyard_slots
+        return [DEFAULT_DISCARD_SPACE]
+
+    def plan_moves(self, moves, reserved=(), start=None):
+        """ Orders `moves` with MovePlanner, captures go to the nearest free graveyard slot
+
+            :param reserved: graveyard slots already handed out to moves that haven't been performed
+            :param start: (x, y) the printhead will start from, defaults to where it is now
+            :raises AxisControllerException: for an invalid space, or if the graveyard is full
+        """
+        axis_controller = self.axis_controller
+        if self.graveyard.geometry.graveyard_slots():
+            moves = self.graveyard.assign(moves, reserved=reserved)
+            planner = MovePlanner(axis_controller.geometry, [])
+        else:
+            planner = MovePlanner(axis_controller.geometry, self.discard_spaces())
+        if start is None:
+            start = self._printhead_xy()
+        with timing.span(timing.STAGE_PLANNING, 'plan'):
+            return planner.plan(moves, start=start)
+
+    def _printhead_xy(self):
+        """ (x, y) of the printhead, None until it has been homed """
+        position = self.axis_controller.position
+        if position['x'] is None or position['y'] is None:
+            return None
+        return position['x'], position['y']
+
+    def _plan_end(self, plan, start):
+        """ (x, y) the printhead is left at once `plan` has been performed from `start` """
+        if not plan['moves']:
+            return start
+        last = plan['moves'][-1]
+        space = last['ending_space'] if last['action'] == 'move_to_space' else last['discard_space']
+        return self.axis_controller.geometry.position(space)
+
+    def perform_moves(self, moves, skip_hand=True, job=None):
+        return self.perform_plan(self.plan_moves(moves), skip_hand=skip_hand, job=job)
 
-    def perform_moves(self, moves, skip_hand=True):
-        for move in moves:
+    def perform_plan(self, plan, skip_hand=True, job=None, report_steps=True):
+        """ Carries out a plan from plan_moves
+
+            :param report_steps: count each move as a step of `job`, otherwise the job is only
+                checked for cancellation
+        """
+        if skip_hand:
+            return self._perform_moves_without_hand(plan, job=job, report_steps=report_steps)
+
+        # one graph for the whole batch, so each move starts the moment the previous one allows
+        graph = StepGraph(events=self.events)
+        last_step = None
+        for move in plan['moves']:
             action = move['action']
+            first_step = len(graph.steps)
             if action == 'move_to_space':
-                self.perform_move_to_space(
+                last_step = self._add_move_to_space(
+                    graph,
                     move['starting_space'],
                     move['ending_space'],
-                    skip_hand=skip_hand,
+                    after=[last_step],
                 )
             elif action == 'remove_from_board':
-                self.perform_remove_from_board(
+                last_step = self._add_remove_from_board(
+                    graph,
                     move['space'],
-                    skip_hand=skip_hand,
+                    move['discard_space'],
+                    after=[last_step],
+                    piece=move.get('piece'),
                 )
+            graph.steps[first_step].action = self._announcing(graph.steps[first_step].action, move)
+            last_step.action = self._reporting_progress(last_step.action, move, job if report_steps else None)
+
+        if job is not None and report_steps:
+            job.total_steps = len(plan['moves'])
+        graph.run(job=job)
+        return plan
+
+    def _announcing(self, step_action, move):
+        def wrapped():
+            self.events.publish(EVENT_MOVE, status='started', move=move)
+            step_action()
+        return wrapped
+
+    def _reporting_progress(self, step_action, move, job):
+        def wrapped():
+            step_action()
+            metrics.moves_completed.inc(action=move['action'])
+            self.events.publish(EVENT_MOVE, status='finished', move=move)
+            if job is not None:
+                job.step_complete()
+        return wrapped
+
+    def _perform_moves_without_hand(self, plan, job=None, report_steps=True):
+        # nothing to wait on between spaces, so send the whole route to the printer at once
+        spaces = []
+        for move in plan['moves']:
+            if move['action'] == 'move_to_space':
+                spaces += [move['starting_space'], move['ending_space']]
+            elif move['action'] == 'remove_from_board':
+                spaces += [move['space'], move['discard_space']]
+        if job is not None:
+            if report_steps:
+                job.total_steps = 1
+            job.check_cancelled()
+        for move in plan['moves']:
+            self.events.publish(EVENT_MOVE, status='started', move=move)
+        if spaces:
+            self._move_printhead(*spaces)
+        for move in plan['moves']:
+            if move['action'] == 'remove_from_board':
+                self._discarded(move['space'], move['discard_space'], move.get('piece'))
+            metrics.moves_completed.inc(action=move['action'])
+            self.events.publish(EVENT_MOVE, status='finished', move=move)
+        if job is not None and report_steps:
+            job.step_complete()
+        return plan
+
+    def replay_pgn(self, lines, skip_hand=True, job=None):
+        """ Plays the main line of a PGN game on the board, replacing the current game
+
+            `lines` are read lazily, a ply at a time, by a second thread that parses, validates and
+            plans up to REPLAY_LOOKAHEAD plies ahead of the one being performed, so none of that
+            ever holds up the board. Each ply is a step of `job`; the total is only known once the
+            whole PGN has been read.
+
+            :raises IllegalMoveException: at the first illegal or unreadable move, the plies before
+                it have already been played
+            :returns: {'headers', 'result', 'plies': [{'ply', 'uci', 'san'}]}
+        """
+        reader = PgnReader(lines)
+        prepared = queue.Queue(maxsize=REPLAY_LOOKAHEAD)
+        stopped = threading.Event()
+        # graveyard slots planned for captures that haven't been dropped yet
+        reserved = set()
+        reserved_lock = threading.Lock()
+        # the head moves while later plies are planned, so they're planned from where the plies
+        # before them leave it
+        start = self._printhead_xy()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    prepared.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def prepare():
+            position = start
+            try:
+                board = None
+                ply = 0
+                for text in reader.moves():
+                    if board is None:
+                        # the tags are all read by the first move
+                        board = Board(reader.headers.get('FEN', STARTING_FEN))
+                        if not put(('start', board.copy())):
+                            return
+                    move = board.parse_move(text)
+                    ply += 1
+                    entry = {'ply': ply, 'uci': move.uci(), 'san': board.san(move)}
+                    with reserved_lock:
+                        plan = self.plan_moves(board.physical_actions(move), reserved=reserved, start=position)
+                        reserved.update(
+                            step['discard_space'] for step in plan['moves'] if step['action'] == 'remove_from_board'
+                        )
+                    position = self._plan_end(plan, position)
+                    board.push(move)
+                    if not put(('ply', entry, move, plan)):
+                        return
+                if job is not None:
+                    job.total_steps = ply
+                put(('end', None))
+            except Exception as e:
+                put(('error', e))
 
+        plies = []
+        if job is not None:
+            job.result = {'headers': reader.headers, 'result': None, 'plies': plies}
+        thread = threading.Thread(target=prepare, name='pgn-reader', daemon=True)
+        thread.start()
+        try:
+            while True:
+                waited = time.monotonic()
+                item = prepared.get()
+                kind = item[0]
+                if kind == 'error':
+                    raise item[1]
+                if kind == 'end':
+                    break
+                if kind == 'start':
+                    with self._game_lock:
+                        self.game = item[1]
+                        self.game_moves = []
+                        self._queued_game = self.game.copy()
+                    continue
+                _, entry, move, plan = item
+                waited = time.monotonic() - waited
+                if plies and waited > 0.01:
+                    logger.info(f"ply {entry['ply']} waited {waited:.2f}s for the PGN")
+                if job is not None:
+                    job.check_cancelled()
+                self.perform_plan(plan, skip_hand=skip_hand, job=job, report_steps=False)
+                with reserved_lock:
+                    reserved.difference_update(step.get('discard_space') for step in plan['moves'])
+                with self._game_lock:
+                    self.game.push(move)
+                    self.game_moves.append(entry['san'])
+                    self._queued_game = self.game.copy()
+                plies.append(entry)
+                logger.info(f"played ply {entry['ply']}: {entry['san']}")
+                if job is not None:
+                    job.step_complete()
+        finally:
+            stopped.set()
+        return {'headers': reader.headers, 'result': reader.result, 'plies': plies}
 
-_instance = ChessController()
@@ -0,0 +1,541 @@
+from collections import namedtuple
+import re
+
+from .exceptions import IllegalMoveException
+
+WHITE = 0
+BLACK = 1
+
+PAWN = 0
+KNIGHT = 1
+BISHOP = 2
+ROOK = 3
+QUEEN = 4
+KING = 5
+PIECE_SYMBOLS = 'pnbrqk'
+PIECE_NAMES = ('pawn', 'knight', 'bishop', 'rook', 'queen', 'king')
+
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# castling rights, one bit each
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+CASTLING_SYMBOLS = (('K', WHITE_KINGSIDE), ('Q', WHITE_QUEENSIDE), ('k', BLACK_KINGSIDE), ('q', BLACK_QUEENSIDE))
+
+FILES = 'abcdefgh'
+BB_ALL = (1 << 64) - 1
+BB_FILE_A = 0x0101010101010101
+BB_FILE_H = BB_FILE_A << 7
+BB_RANK_1 = 0xFF
+BB_RANK_8 = BB_RANK_1 << 56
+
+uci_regex = re.compile(r'^(?P<from>[a-h][1-8])(?P<to>[a-h][1-8])(?P<promotion>[nbrq]?)$')
+san_suffix_regex = re.compile(r'[+#!?]+$')
+
+
+def square(file, rank):
+    return rank * 8 + file
+
+
+def square_file(sq):
+    return sq & 7
+
+
+def square_rank(sq):
+    return sq >> 3
+
+
+def square_name(sq):
+    return f"{FILES[square_file(sq)]}{square_rank(sq) + 1}"
+
+
+def parse_square(name):
+    return square(FILES.index(name[0]), int(name[1]) - 1)
+
+
+def space_name(sq):
+    """ The board space for a square, as used by the axis controller ("E2") """
+    return square_name(sq).upper()
+
+
+def lsb(bb):
+    return (bb & -bb).bit_length() - 1
+
+
+def msb(bb):
+    return bb.bit_length() - 1
+
+
+def squares(bb):
+    while bb:
+        sq = lsb(bb)
+        yield sq
+        bb &= bb - 1
+
+
+def _step_attacks(deltas):
+    table = []
+    for sq in range(64):
+        attacks = 0
+        for df, dr in deltas:
+            file, rank = square_file(sq) + df, square_rank(sq) + dr
+            if 0 <= file < 8 and 0 <= rank < 8:
+                attacks |= 1 << square(file, rank)
+        table.append(attacks)
+    return table
+
+
+KNIGHT_ATTACKS = _step_attacks([(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)])
+KING_ATTACKS = _step_attacks([(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)])
+PAWN_ATTACKS = (_step_attacks([(-1, 1), (1, 1)]), _step_attacks([(-1, -1), (1, -1)]))
+
+# rays run away from the square; the first four head towards higher square indexes, so the first
+# blocker along them is the least significant bit, the last four towards lower ones
+ROOK_DIRECTIONS = ((0, 1), (1, 0), (0, -1), (-1, 0))
+BISHOP_DIRECTIONS = ((1, 1), (-1, 1), (1, -1), (-1, -1))
+
+
+def _rays(df, dr):
+    table = []
+    for sq in range(64):
+        ray = 0
+        file, rank = square_file(sq) + df, square_rank(sq) + dr
+        while 0 <= file < 8 and 0 <= rank < 8:
+            ray |= 1 << square(file, rank)
+            file, rank = file + df, rank + dr
+        table.append(ray)
+    return table
+
+
+RAYS = {direction: _rays(*direction) for direction in ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+POSITIVE_DIRECTIONS = {(0, 1), (1, 0), (1, 1), (-1, 1)}
+
+
+def _slider_attacks(sq, occupied, directions):
+    attacks = 0
+    for direction in directions:
+        ray = RAYS[direction][sq]
+        blockers = ray & occupied
+        if blockers:
+            blocker = lsb(blockers) if direction in POSITIVE_DIRECTIONS else msb(blockers)
+            ray ^= RAYS[direction][blocker]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(sq, occupied):
+    return _slider_attacks(sq, occupied, ROOK_DIRECTIONS)
+
+
+def bishop_attacks(sq, occupied):
+    return _slider_attacks(sq, occupied, BISHOP_DIRECTIONS)
+
+
+class Move(namedtuple('Move', ['from_square', 'to_square', 'promotion'])):
+    __slots__ = ()
+
+    def uci(self):
+        promotion = PIECE_SYMBOLS[self.promotion] if self.promotion is not None else ''
+        return f"{square_name(self.from_square)}{square_name(self.to_square)}{promotion}"
+
+
+class Board(object):
+    """
+    Chess position held as one bitboard (a 64 bit int, bit 0 is a1, bit 63 is h8) per colour and
+    piece type. Moves are validated against the full rules, including castling through check, en
+    passant and promotion, and every legal move can be turned into the physical actions that
+    ChessController.perform_moves understands.
+    """
+    def __init__(self, fen=STARTING_FEN):
+        self.set_fen(fen)
+
+    def copy(self):
+        board = Board.__new__(Board)
+        board.pieces = [list(self.pieces[WHITE]), list(self.pieces[BLACK])]
+        board.occupied_by = list(self.occupied_by)
+        board.turn = self.turn
+        board.castling = self.castling
+        board.ep_square = self.ep_square
+        board.halfmove_clock = self.halfmove_clock
+        board.fullmove_number = self.fullmove_number
+        return board
+
+    # START FEN #
+    def set_fen(self, fen):
+        try:
+            placement, turn, castling, ep_square, halfmove, fullmove = fen.split()
+        except ValueError:
+            raise IllegalMoveException(f"invalid FEN: {fen}")
+        self.pieces = [[0] * 6, [0] * 6]
+        ranks = placement.split('/')
+        if len(ranks) != 8:
+            raise IllegalMoveException(f"invalid FEN placement: {placement}")
+        for rank_index, rank in enumerate(ranks):
+            file = 0
+            for symbol in rank:
+                if symbol.isdigit():
+                    file += int(symbol)
+                    continue
+                if symbol.lower() not in PIECE_SYMBOLS or file > 7:
+                    raise IllegalMoveException(f"invalid FEN placement: {placement}")
+                color = WHITE if symbol.isupper() else BLACK
+                self.pieces[color][PIECE_SYMBOLS.index(symbol.lower())] |= 1 << square(file, 7 - rank_index)
+                file += 1
+        self.occupied_by = [
+            self._union(self.pieces[WHITE]),
+            self._union(self.pieces[BLACK]),
+        ]
+        if turn not in ('w', 'b'):
+            raise IllegalMoveException(f"invalid FEN side to move: {turn}")
+        self.turn = WHITE if turn == 'w' else BLACK
+        self.castling = 0
+        for symbol, right in CASTLING_SYMBOLS:
+            if symbol in castling:
+                self.castling |= right
+        self.ep_square = None if ep_square == '-' else parse_square(ep_square)
+        self.halfmove_clock = int(halfmove)
+        self.fullmove_number = int(fullmove)
+
+    def fen(self):
+        ranks = []
+        for rank in range(7, -1, -1):
+            row = ''
+            empty = 0
+            for file in range(8):
+                piece = self.piece_at(square(file, rank))
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                color, piece_type = piece
+                symbol = PIECE_SYMBOLS[piece_type]
+                row += symbol.upper() if color == WHITE else symbol
+            if empty:
+                row += str(empty)
+            ranks.append(row)
+        castling = ''.join(symbol for symbol, right in CASTLING_SYMBOLS if self.castling & right) or '-'
+        ep_square = square_name(self.ep_square) if self.ep_square is not None else '-'
+        turn = 'w' if self.turn == WHITE else 'b'
+        return f"{'/'.join(ranks)} {turn} {castling} {ep_square} {self.halfmove_clock} {self.fullmove_number}"
+    # END FEN #
+
+    @staticmethod
+    def _union(bitboards):
+        union = 0
+        for bb in bitboards:
+            union |= bb
+        return union
+
+    @property
+    def occupied(self):
+        return self.occupied_by[WHITE] | self.occupied_by[BLACK]
+
+    def piece_at(self, sq):
+        mask = 1 << sq
+        for color in (WHITE, BLACK):
+            if self.occupied_by[color] & mask:
+                for piece_type in range(6):
+                    if self.pieces[color][piece_type] & mask:
+                        return color, piece_type
+        return None
+
+    def king_square(self, color):
+        return lsb(self.pieces[color][KING])
+
+    def is_attacked(self, sq, by_color):
+        pieces = self.pieces[by_color]
+        occupied = self.occupied
+        if PAWN_ATTACKS[1 - by_color][sq] & pieces[PAWN]:
+            return True
+        if KNIGHT_ATTACKS[sq] & pieces[KNIGHT]:
+            return True
+        if KING_ATTACKS[sq] & pieces[KING]:
+            return True
+        if rook_attacks(sq, occupied) & (pieces[ROOK] | pieces[QUEEN]):
+            return True
+        if bishop_attacks(sq, occupied) & (pieces[BISHOP] | pieces[QUEEN]):
+            return True
+        return False
+
+    def is_check(self):
+        return self.is_attacked(self.king_square(self.turn), 1 - self.turn)
+
+    # START Move generation #
+    def pseudo_legal_moves(self):
+        us, them = self.turn, 1 - self.turn
+        own = self.occupied_by[us]
+        enemy = self.occupied_by[them]
+        occupied = own | enemy
+        pieces = self.pieces[us]
+
+        # pawns
+        forward = 8 if us == WHITE else -8
+        start_rank = 1 if us == WHITE else 6
+        last_rank = 7 if us == WHITE else 0
+        ep_mask = 1 << self.ep_square if self.ep_square is not None else 0
+        for sq in squares(pieces[PAWN]):
+            targets = PAWN_ATTACKS[us][sq] & (enemy | ep_mask)
+            one = sq + forward
+            if not occupied & (1 << one):
+                targets |= 1 << one
+                two = one + forward
+                if square_rank(sq) == start_rank and not occupied & (1 << two):
+                    targets |= 1 << two
+            for to_square in squares(targets):
+                if square_rank(to_square) == last_rank:
+                    for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                        yield Move(sq, to_square, promotion)
+                else:
+                    yield Move(sq, to_square, None)
+
+        for piece_type, attacks in (
+            (KNIGHT, lambda sq: KNIGHT_ATTACKS[sq]),
+            (BISHOP, lambda sq: bishop_attacks(sq, occupied)),
+            (ROOK, lambda sq: rook_attacks(sq, occupied)),
+            (QUEEN, lambda sq: rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)),
+            (KING, lambda sq: KING_ATTACKS[sq]),
+        ):
+            for sq in squares(pieces[piece_type]):
+                for to_square in squares(attacks(sq) & ~own):
+                    yield Move(sq, to_square, None)
+
+        yield from self._castling_moves()
+
+    def _castling_moves(self):
+        us, them = self.turn, 1 - self.turn
+        rank = 0 if us == WHITE else 7
+        king = square(4, rank)
+        if not self.pieces[us][KING] & (1 << king):
+            return
+        kingside = WHITE_KINGSIDE if us == WHITE else BLACK_KINGSIDE
+        queenside = WHITE_QUEENSIDE if us == WHITE else BLACK_QUEENSIDE
+        occupied = self.occupied
+        rooks = self.pieces[us][ROOK]
+        # (right, rook file, squares that must be empty, squares the king passes through)
+        for right, rook_file, empty_files, passing_files in (
+            (kingside, 7, (5, 6), (5, 6)),
+            (queenside, 0, (1, 2, 3), (3, 2)),
+        ):
+            if not self.castling & right or not rooks & (1 << square(rook_file, rank)):
+                continue
+            if any(occupied & (1 << square(file, rank)) for file in empty_files):
+                continue
+            if self.is_attacked(king, them):
+                return
+            if any(self.is_attacked(square(file, rank), them) for file in passing_files):
+                continue
+            yield Move(king, square(passing_files[-1], rank), None)
+
+    def legal_moves(self):
+        moves = []
+        us = self.turn
+        for move in self.pseudo_legal_moves():
+            board = self.copy()
+            board._apply(move)
+            if not board.is_attacked(board.king_square(us), 1 - us):
+                moves.append(move)
+        return moves
+    # END Move generation #
+
+    def is_castling(self, move):
+        return (
+            self.pieces[self.turn][KING] & (1 << move.from_square)
+            and abs(square_file(move.to_square) - square_file(move.from_square)) == 2
+        )
+
+    def is_en_passant(self, move):
+        return (
+            move.to_square == self.ep_square
+            and self.pieces[self.turn][PAWN] & (1 << move.from_square)
+            and square_file(move.from_square) != square_file(move.to_square)
+        )
+
+    def captured_square(self, move):
+        """ The square of the piece `move` captures, or None """
+        if self.is_en_passant(move):
+            return square(square_file(move.to_square), square_rank(move.from_square))
+        if self.occupied_by[1 - self.turn] & (1 << move.to_square):
+            return move.to_square
+        return None
+
+    def _remove(self, color, piece_type, sq):
+        mask = ~(1 << sq) & BB_ALL
+        self.pieces[color][piece_type] &= mask
+        self.occupied_by[color] &= mask
+
+    def _put(self, color, piece_type, sq):
+        self.pieces[color][piece_type] |= 1 << sq
+        self.occupied_by[color] |= 1 << sq
+
+    def _apply(self, move):
+        us, them = self.turn, 1 - self.turn
+        _, piece_type = self.piece_at(move.from_square)
+        captured = self.captured_square(move)
+        castling = piece_type == KING and abs(square_file(move.to_square) - square_file(move.from_square)) == 2
+
+        if captured is not None:
+            _, captured_type = self.piece_at(captured)
+            self._remove(them, captured_type, captured)
+        self._remove(us, piece_type, move.from_square)
+        self._put(us, move.promotion if move.promotion is not None else piece_type, move.to_square)
+        if castling:
+            rank = square_rank(move.from_square)
+            kingside = square_file(move.to_square) == 6
+            rook_from = square(7 if kingside else 0, rank)
+            rook_to = square(5 if kingside else 3, rank)
+            self._remove(us, ROOK, rook_from)
+            self._put(us, ROOK, rook_to)
+
+        # moving the king or a rook, or capturing a rook on its home square, loses the right
+        for sq in (move.from_square, move.to_square):
+            self.castling &= ~CASTLING_LOST.get(sq, 0)
+
+        self.ep_square = None
+        if piece_type == PAWN and abs(move.to_square - move.from_square) == 16:
+            self.ep_square = (move.from_square + move.to_square) // 2
+
+        if piece_type == PAWN or captured is not None:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if us == BLACK:
+            self.fullmove_number += 1
+        self.turn = them
+
+    def push(self, move):
+        """ Plays a legal move """
+        self._apply(move)
+
+    # START Notation #
+    def parse_uci(self, text):
+        match = uci_regex.match(text.strip().lower())
+        if match is None:
+            raise IllegalMoveException(f"not a UCI move: {text}")
+        promotion = PIECE_SYMBOLS.index(match.group('promotion')) if match.group('promotion') else None
+        move = Move(parse_square(match.group('from')), parse_square(match.group('to')), promotion)
+        if move not in self.legal_moves():
+            raise IllegalMoveException(f"illegal move {text} in {self.fen()}")
+        return move
+
+    def _san_without_suffix(self, move, legal_moves):
+        if self.is_castling(move):
+            return 'O-O' if square_file(move.to_square) == 6 else 'O-O-O'
+        _, piece_type = self.piece_at(move.from_square)
+        capture = self.captured_square(move) is not None
+        to_name = square_name(move.to_square)
+        if piece_type == PAWN:
+            san = f"{FILES[square_file(move.from_square)]}x{to_name}" if capture else to_name
+            if move.promotion is not None:
+                san += f"={PIECE_SYMBOLS[move.promotion].upper()}"
+            return san
+
+        # disambiguate against other pieces of the same type that could go to the same square
+        others = [
+            other.from_square for other in legal_moves
+            if other.to_square == move.to_square
+            and other.from_square != move.from_square
+            and self.pieces[self.turn][piece_type] & (1 << other.from_square)
+        ]
+        disambiguation = ''
+        if others:
+            if all(square_file(sq) != square_file(move.from_square) for sq in others):
+                disambiguation = FILES[square_file(move.from_square)]
+            elif all(square_rank(sq) != square_rank(move.from_square) for sq in others):
+                disambiguation = str(square_rank(move.from_square) + 1)
+            else:
+                disambiguation = square_name(move.from_square)
+        return f"{PIECE_SYMBOLS[piece_type].upper()}{disambiguation}{'x' if capture else ''}{to_name}"
+
+    def san(self, move):
+        legal_moves = self.legal_moves()
+        san = self._san_without_suffix(move, legal_moves)
+        board = self.copy()
+        board.push(move)
+        if board.is_check():
+            san += '#' if not board.legal_moves() else '+'
+        return san
+
+    def parse_san(self, text):
+        wanted = san_suffix_regex.sub('', text.strip()).replace('0', 'O')
+        legal_moves = self.legal_moves()
+        for move in legal_moves:
+            if self._san_without_suffix(move, legal_moves) == wanted:
+                return move
+        raise IllegalMoveException(f"illegal move {text} in {self.fen()}")
+
+    def parse_move(self, text):
+        """ Parses a move in either UCI ("e2e4", "e7e8q") or SAN ("e4", "Nxf7+", "O-O") """
+        if uci_regex.match(text.strip().lower()):
+            return self.parse_uci(text)
+        return self.parse_san(text)
+    # END Notation #
+
+    def physical_actions(self, move):
+        """ The perform_moves actions that carry out `move` on the physical board
+
+            A captured piece comes off first, including the pawn taken en passant, which isn't on
+            the square the capturing pawn lands on, tagged with its FEN symbol so the graveyard
+            knows what it's holding. Castling moves the king and then the rook.
+            There's no store of spare pieces to promote from, so a promoting pawn is moved like any
+            other and the move is marked with the piece it stands for from then on.
+        """
+        actions = []
+        captured = self.captured_square(move)
+        if captured is not None:
+            color, piece_type = self.piece_at(captured)
+            symbol = PIECE_SYMBOLS[piece_type]
+            actions.append({
+                'action': 'remove_from_board',
+                'space': space_name(captured),
+                'piece': symbol.upper() if color == WHITE else symbol,
+            })
+        action = {
+            'action': 'move_to_space',
+            'starting_space': space_name(move.from_square),
+            'ending_space': space_name(move.to_square),
+        }
+        if move.promotion is not None:
+            action['promotion'] = PIECE_NAMES[move.promotion]
+        actions.append(action)
+        if self.is_castling(move):
+            rank = square_rank(move.from_square)
+            kingside = square_file(move.to_square) == 6
+            actions.append({
+                'action': 'move_to_space',
+                'starting_space': space_name(square(7 if kingside else 0, rank)),
+                'ending_space': space_name(square(5 if kingside else 3, rank)),
+            })
+        return actions
+
+    def outcome(self):
+        """ 'checkmate', 'stalemate' or None """
+        if self.legal_moves():
+            return None
+        return 'checkmate' if self.is_check() else 'stalemate'
+
+
+CASTLING_LOST = {
+    square(4, 0): WHITE_KINGSIDE | WHITE_QUEENSIDE,
+    square(7, 0): WHITE_KINGSIDE,
+    square(0, 0): WHITE_QUEENSIDE,
+    square(4, 7): BLACK_KINGSIDE | BLACK_QUEENSIDE,
+    square(7, 7): BLACK_KINGSIDE,
+    square(0, 7): BLACK_QUEENSIDE,
+}
+
+
+def perft(board, depth):
+    """ Counts the leaf nodes of the legal move tree `depth` plies deep """
+    moves = board.legal_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        child = board.copy()
+        child.push(move)
+        nodes += perft(child, depth - 1)
+    return nodes
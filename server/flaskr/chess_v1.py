@@ -1,3 +1,6 @@
+import functools
+import threading
+
 from flask import (
     current_app,
     Blueprint,
@@ -5,35 +8,68 @@ from flask import (
     request,
     Response,
     jsonify,
+    url_for,
 )
 from flask_cors import cross_origin
-from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import BadRequest, Conflict, NotFound
 
-from .exceptions import AxisControllerException, MotorControllerException
+from .chess_engine import Board, STARTING_FEN
+from .exceptions import AxisControllerException, IllegalMoveException, MotorControllerException, RigBusyException
+from .pgn import LineFeed
+from . import events
+from .rig import current_rig, rig_route
 
-from .axis_controller import AxisController
 from .chess_controller import ChessController
 
 
+UPLOAD_POLL_INTERVAL = 0.1  # seconds between checks that a replay job hasn't ended without reading its upload
+
+# every rig_route is also served under /chess_v1/rigs/<rig_id>/ for rigs other than the default one
 bp = Blueprint('chess_v1', __name__, url_prefix='/chess_v1')
 
-@bp.route('/test', methods=['GET', 'POST'])
+
+def exclusive(f):
+    """ Runs the view with the rig's hardware to itself, 409 Conflict while a job is using it """
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        try:
+            with current_rig.job_queue.exclusive():
+                return f(*args, **kwargs)
+        except RigBusyException as e:
+            raise Conflict(e)
+    return wrapper
+
+
+@bp.route('/rigs', methods=['GET'])
+@cross_origin()
+def rigs():
+    return jsonify(current_app.rigs.status())
+
+
+@rig_route(bp, '/test', methods=['GET', 'POST'])
 def test():
-    return render_template('test_page.html')
+    # the page's requests go to the rig it was opened for
+    rig_prefix = url_for('chess_v1.test', **request.view_args).rpartition('/')[0]
+    return render_template('test_page.html', rig_prefix=rig_prefix)
 
 
-@bp.route('/raw_write', methods=['POST'])
+@rig_route(bp, '/raw_write', methods=['POST'])
+@exclusive
 def raw_write():
     json_data = request.get_json()
-    response = current_app.motor_controller.write_read(json_data['command'])
+    try:
+        response = current_rig.motor_controller.write_read(json_data['command'])
+    except MotorControllerException as e:
+        raise BadRequest(e)
     return jsonify({'data': response})
 
 
-@bp.route('/printer_action_test', methods=['POST'])
+@rig_route(bp, '/printer_action_test', methods=['POST'])
+@exclusive
 def test_printer_action():
     json_data = request.get_json()
     action = json_data['action']
-    controller = current_app.axis_controller
+    controller = current_rig.axis_controller
     if action == 'homeXY':
         response = controller.home(x=True, y=True)
     elif action == 'homeZ':
@@ -59,7 +95,7 @@ def test_printer_action():
         response = controller.move_to_space(**params)
         return jsonify(response)
     elif action == 'movePiece':
-        response = ChessController.instance().move_piece(json_data['starting_space'], json_data['ending_space'])
+        response = current_rig.chess_controller.move_piece(json_data['starting_space'], json_data['ending_space'])
         return jsonify(response)
     else:
         response = Response(f"invalid action {action}", status_code=400)
@@ -67,79 +103,259 @@ def test_printer_action():
     return response
 
 
-@bp.route('/octoprint_status', methods=['GET'])
+@rig_route(bp, '/octoprint_status', methods=['GET'])
 @cross_origin()
 def octoprint_status():
-    status = current_app.axis_controller.get_octoprint_server_status()
+    status = current_rig.axis_controller.octoprint_status()
     return jsonify(status)
 
 
-@bp.route('/initialize_octoprint', methods=['GET'])
+@rig_route(bp, '/initialize_octoprint', methods=['GET'])
 @cross_origin()
+@exclusive
 def intialize_octoprint():
-    initialized, message = current_app.axis_controller.intialize_octoprint()
+    initialized, message = current_rig.axis_controller.intialize_octoprint()
     if initialized:
         return '', 204
     raise BadRequest(response.reason)
 
 
-@bp.route('/initialize_controller', methods=['GET'])
+@rig_route(bp, '/initialize_controller', methods=['GET'])
 @cross_origin()
+@exclusive
 def initialize_controller():
-    initialized, message = current_app.motor_controller.initialize()
+    initialized, message = current_rig.motor_controller.initialize()
     if initialized:
         return '', 204
     raise BadRequest(response.reason)
 
 
-@bp.route('/controller_serial_status', methods=['GET'])
+@rig_route(bp, '/controller_serial_status', methods=['GET'])
 @cross_origin()
 def controller_serial_status():
     try:
-        status = current_app.motor_controller.get_controller_serial_status()
+        status = current_rig.motor_controller.get_controller_serial_status()
     except MotorControllerException as e:
         raise BadRequest(e)
     return jsonify(status)
 
 
-@bp.route('/home_axes', methods=['GET'])
+@rig_route(bp, '/home_axes', methods=['GET'])
 @cross_origin()
+@exclusive
 def home_axes():
-    current_app.axis_controller.home(x=True, y=True, z=True, use_hand_offset=True)
+    current_rig.axis_controller.home(x=True, y=True, z=True, use_hand_offset=True)
     return '', 204
 
 
-@bp.route('/move_to_space', methods=['GET'])
+@rig_route(bp, '/move_to_space', methods=['GET'])
 @cross_origin()
+@exclusive
 def move_to_space():
     space = user = request.args.get('space')
-    current_app.axis_controller.move_to_space(space)
+    current_rig.axis_controller.move_to_space(space)
     return '', 204
 
 
-@bp.route('/move_hand_z_axis', methods=['GET'])
+@rig_route(bp, '/move_hand_z_axis', methods=['GET'])
 @cross_origin()
+@exclusive
 def move_hand_z_axis():
     direction = request.args.get('direction')
     if direction == 'up':
-        current_app.motor_controller.z_up()
+        current_rig.motor_controller.z_up()
     elif direction == 'down':
-        current_app.motor_controller.z_down()
+        current_rig.motor_controller.z_down()
     else:
         raise BadRequest("direction param must be either 'up' or 'down'")
     return '', 204
 
 
-@bp.route('/perform_moves', methods=['POST'])
+@rig_route(bp, '/perform_moves', methods=['POST'])
 @cross_origin()
 def perform_moves():
     # change to a list of dicts with {action: [move|capture], startingSpace: B3, endingSpace: A1}
+    # the moves are run by the job worker, poll the returned job for progress
     json_data = request.get_json()
+    moves = json_data['moves']
+    skip_hand = json_data.get('skip_hand') == 'true'
+    controller = current_rig.chess_controller
     try:
-        response = ChessController.instance().perform_moves(
-            moves=json_data['moves'],
-            skip_hand=json_data.get('skip_hand') == 'true',
-        );
+        # plan up front so bad spaces are rejected before anything is queued
+        controller.plan_moves(moves)
     except AxisControllerException as e:
         raise BadRequest(e)
+
+    job = current_rig.job_queue.submit(
+        f"perform {len(moves)} moves",
+        lambda job: controller.perform_moves(moves=moves, skip_hand=skip_hand, job=job),
+    )
+    return jsonify(job.to_dict()), 202
+
+
+@rig_route(bp, '/game', methods=['GET'])
+@cross_origin()
+def game_state():
+    return jsonify(current_rig.chess_controller.game_state())
+
+
+@rig_route(bp, '/game', methods=['POST'])
+@cross_origin()
+def new_game():
+    # optional {fen: ...} to start from a position other than the standard one
+    json_data = request.get_json(silent=True) or {}
+    try:
+        state = current_rig.chess_controller.new_game(json_data.get('fen') or STARTING_FEN)
+    except IllegalMoveException as e:
+        raise BadRequest(e)
+    return jsonify(state)
+
+
+@rig_route(bp, '/game/validate', methods=['POST'])
+@cross_origin()
+def validate_game():
+    # {moves: ['e4', 'e7e5', ...], fen: optional}, checks every move and returns the physical actions
+    # for each one without touching the game or the hardware
+    json_data = request.get_json()
+    try:
+        board = Board(json_data.get('fen') or STARTING_FEN)
+        played = ChessController.validate_game(json_data['moves'], board)
+    except IllegalMoveException as e:
+        raise BadRequest(e)
+    return jsonify({'moves': played, 'fen': board.fen(), 'outcome': board.outcome()})
+
+
+@rig_route(bp, '/game/moves', methods=['POST'])
+@cross_origin()
+def play_moves():
+    # {moves: ['e4', ...]} in UCI or SAN, validated after any moves already queued and played on the
+    # board by the job worker. Either every move is legal and the lot is queued, or nothing happens.
+    # /game only shows each move once it's on the board
+    json_data = request.get_json()
+    skip_hand = json_data.get('skip_hand') == 'true'
+    controller = current_rig.chess_controller
+    try:
+        played, start_fen = controller.play_moves(json_data['moves'])
+    except IllegalMoveException as e:
+        raise BadRequest(e)
+
+    job = current_rig.job_queue.submit(
+        f"play {' '.join(move['san'] for move in played)}",
+        lambda job: controller.perform_game_moves(played, start_fen, skip_hand=skip_hand, job=job),
+    )
+    return jsonify(dict(job.to_dict(), moves=played)), 202
+
+
+@rig_route(bp, '/game/replay', methods=['POST'])
+@cross_origin()
+def replay_game():
+    # a PGN file, uploaded as the `pgn` form field or sent as the request body. A body can be
+    # streamed (chunked): the job reads it and starts playing the first moves while the rest is
+    # still arriving, and the response comes once the job has read it all. Poll the job for
+    # per-ply progress
+    skip_hand = request.args.get('skip_hand') == 'true'
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('pgn')
+        if upload is None:
+            raise BadRequest("missing pgn file")
+        source = upload.stream
+    else:
+        source = request.stream
+
+    lines = LineFeed()
+    uploaded = threading.Event()
+    controller = current_rig.chess_controller
+
+    def read_upload():
+        try:
+            for line in iter(source.readline, b''):
+                lines.put(line.decode('utf-8', errors='replace'))
+        except Exception as e:
+            lines.close(IllegalMoveException(f"PGN upload failed: {e}"))
+        else:
+            lines.close()
+        finally:
+            uploaded.set()
+
+    def replay(job):
+        threading.Thread(target=read_upload, name='pgn-upload', daemon=True).start()
+        return controller.replay_pgn(lines, skip_hand=skip_hand, job=job)
+
+    job = current_rig.job_queue.submit("replay PGN", replay)
+    # the upload can only be read while the request is open
+    while not uploaded.wait(UPLOAD_POLL_INTERVAL) and not job.finished:
+        pass
+    return jsonify(job.to_dict()), 202
+
+
+@rig_route(bp, '/events', methods=['GET'])
+@cross_origin()
+def event_stream():
+    # Server-Sent Events: moves, steps, jobs, head position, hand/z state, health and errors as
+    # they happen. Served from what the controllers already know, so it never touches the hardware
+    last_event_id = request.headers.get('Last-Event-ID')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    subscription = current_rig.events.subscribe(last_event_id=last_event_id)
+    return Response(
+        events.stream(subscription),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@rig_route(bp, '/graveyard', methods=['GET'])
+@cross_origin()
+def graveyard():
+    # every slot captured pieces are dropped in, and which piece from which space is in each
+    return jsonify(current_rig.chess_controller.graveyard.status())
+
+
+@rig_route(bp, '/graveyard/clear', methods=['POST'])
+@cross_origin()
+@exclusive
+def clear_graveyard():
+    # once the captured pieces have been taken off the slots by hand, not while a job may be
+    # dropping more in
+    current_rig.chess_controller.graveyard.clear()
     return '', 204
+
+
+@rig_route(bp, '/plan_moves', methods=['POST'])
+@cross_origin()
+def plan_moves():
+    # same body as perform_moves, returns the planned order and travel without moving anything
+    json_data = request.get_json()
+    try:
+        plan = current_rig.chess_controller.plan_moves(json_data['moves'])
+    except AxisControllerException as e:
+        raise BadRequest(e)
+    return jsonify(plan)
+
+
+@rig_route(bp, '/jobs', methods=['GET'])
+@cross_origin()
+def jobs():
+    return jsonify([job.to_dict() for job in current_rig.job_queue.jobs()])
+
+
+@rig_route(bp, '/jobs/<job_id>', methods=['GET'])
+@cross_origin()
+def job_status(job_id):
+    job = current_rig.job_queue.get(job_id)
+    if job is None:
+        raise NotFound(f"no job {job_id}")
+    return jsonify(job.to_dict())
+
+
+@rig_route(bp, '/jobs/<job_id>/cancel', methods=['POST'])
+@cross_origin()
+def cancel_job(job_id):
+    job = current_rig.job_queue.cancel(job_id)
+    if job is None:
+        raise NotFound(f"no job {job_id}")
+    if job.finished:
+        raise Conflict(f"job {job_id} already {job.status}")
+    return jsonify(job.to_dict()), 202
@@ -2,42 +2,94 @@ import funcy
 import json
 import logging
 import os
+import threading
 
 from .exceptions import InvalidConfigurationException
+from . import timing
 
-CONFIG_DIRECTORY = os.path.relpath(os.path.join('flaskr', 'config'))
+CONFIG_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+# points at an alternate config directory, e.g. for the benchmarks. Read whenever a Configuration is
+# made, so it can be set after importing flaskr
+CONFIG_DIRECTORY_ENV = 'REMOTE_CHESS_CONFIG_DIRECTORY'
 
 DEFAULT_CONFIG_FILENAME = 'default.json'
 USER_CONFIG_FILENAME = 'user.json'
 
+# the rig configured by user.json in the config directory itself. Every other rig has a directory
+# of its own under rigs/ with its own user.json, sharing default.json
+DEFAULT_RIG = 'default'
+RIGS_DIRECTORY = 'rigs'
+
 
 logger = logging.getLogger(__name__)
 
 """
     "arduino_port": null,             # if null, attempt to detect port automatically, else use defined port
+    "arduino_usb_ids": [],            # USB "vendor" or "vendor:product" hex ids to look for when detecting the port
     "serial_timeout": 0.5,            # timeout for serial comms with arduino
-    "serial_baudrate": 9600,          # baudrate for arduino
+    "serial_baudrate": 9600,          # baudrate the arduino boots at
+    "serial_fast_baudrate": 115200,   # baudrate negotiated after the handshake, null to stay at serial_baudrate
+    "arduino_boot_timeout": 3,        # seconds to wait for the sketch's boot banner after opening the port
     "octoprint_api_key": "",          # octoprint api key
     "octoprint_ip_address": "",       # local ip of octopi instance
+    "octoprint_status_timeout": 2,    # timeout for each OctoPrint status check (seconds)
+    "octoprint_status_ttl": 5,        # how often the background poller refreshes OctoPrint status (seconds)
+    "octoprint_connect_timeout": 2,   # seconds to wait for a connection to OctoPrint
+    "octoprint_read_timeout": 5,      # seconds to wait for OctoPrint to answer once connected
+    "octoprint_retries": 2,           # times to retry an OctoPrint request that's safe to send again
+    "octoprint_retry_backoff": 0.1,   # seconds, retries wait a random time up to this, doubling each retry
+    "octoprint_pool_size": 4,         # keep-alive connections to OctoPrint, and requests sent at once
     "printer_stepper_timeout": 600,   # printer timeout to disable steppers (seconds)
     "printhead_x_offset": 0,          # (printer only), x offset between printer nozzle and hand center
                                       #    positive value means hand is in positive x direction (towards right) of head
     "printhead_z_offset": 100,        # (printer only), y offset between printer nozzle and hand center
                                       #    positive value means hand is in positive y direction (towards back) of head
     "z_axis_height": 50,              # (printer only), height of z axis
+    "printhead_speed": 4000,          # (printer only), feedrate for printhead moves (mm/min)
+    "printhead_acceleration": 500,    # (printer only), printer acceleration limit used to estimate move times (mm/s^2)
     "board_x_offset": 10,             # mm between left side of print bed and board
     "board_y_offset": 10,             # mm between front side of print bed and board
     "board_width": 210,               # x axis length of board in mm
     "board_depth": 210,               # y axis length of board in mm
     "space_width": 24,                # x axis length of space
-    "space_depth": 24                 # y axis length of space
+    "space_depth": 24,                # y axis length of space
+    "off_board_slots": {},            # named positions off the board, {name: [x, y]} in mm of hand center on the bed
+    "graveyard_edges": ["right", "back"],  # board edges lined with slots for captured pieces: left, right, front, back
+    "graveyard_rows": 2,              # rows of graveyard slots along each of those edges
+    "graveyard_margin": 12,           # mm between the board edge and the first row of graveyard slots
+    "graveyard_slot_spacing": 24,     # mm between graveyard slots, and between rows
+    "hand_stepper_steps": 15,         # steps between hand open and closed, HAND_MOVEMENT_DISTANCE in the sketch
+    "hand_stepper_speed_delay": 25,   # ms between hand stepper phases, SPEED_DELAY_SLOW in the sketch
+    "z_stepper_steps": 500,           # steps between z up and down, Z_MOVEMENT_DISTANCE in the sketch
+    "z_stepper_speed_delay": 2,       # ms between z stepper phases, SPEED_DELAY_MEDIUM in the sketch
+    "stepper_enable_delay": 100,      # ms the sketch waits after enabling the hand/z driver
+    "move_wait_margin": 0.5,          # seconds to allow on top of every estimated move time
+    "printer_homing_time": 15,        # seconds to allow for a home, the printer doesn't say when it's done
+    "printer_idle_timeout": 5         # seconds to keep polling for the printer to go idle after a move
 """
 
 
+def config_directory():
+    return os.path.abspath(os.environ.get(CONFIG_DIRECTORY_ENV) or CONFIG_DIRECTORY)
+
+
+def configured_rigs():
+    """ Ids of every rig with a directory under rigs/, the default rig always comes first """
+    rigs_directory = os.path.join(config_directory(), RIGS_DIRECTORY)
+    try:
+        names = sorted(os.listdir(rigs_directory))
+    except FileNotFoundError:
+        names = []
+    return [DEFAULT_RIG] + [
+        name for name in names if name != DEFAULT_RIG and os.path.isdir(os.path.join(rigs_directory, name))
+    ]
+
+
 class Configuration(object):
     # TODO: make this dict-like and save to user file
-    def __init__(self):
-        self.config_directory = os.path.abspath(CONFIG_DIRECTORY)
+    def __init__(self, rig_id=DEFAULT_RIG):
+        self.rig_id = rig_id
+        self.config_directory = config_directory()
         if not os.path.exists(self.config_directory) or not os.path.isdir(self.config_directory):
             msg = f"config directory does not exist: {self.config_directory}"
             logger.error(msg)
@@ -49,16 +101,24 @@ class Configuration(object):
             logger.error(msg)
             raise InvalidConfigurationException(msg)
 
-        self.user_filepath = os.path.join(self.config_directory, USER_CONFIG_FILENAME)
+        self.user_filepath = self.rig_filepath(USER_CONFIG_FILENAME)
         self.user_filepath_exists = True
         if not os.path.exists(self.user_filepath):
             msg = f"user config file does not exist: {self.user_filepath}"
             logger.warning(msg)
             self.user_filepath_exists = False
 
-    @classmethod
-    def config(self):
-        return _instance
+        # merged default + user config, rebuilt when either file changes on disk
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._snapshot_signature = None
+        self.version = 0
+
+    def rig_filepath(self, filename):
+        """ Where this rig keeps `filename` """
+        if self.rig_id == DEFAULT_RIG:
+            return os.path.join(self.config_directory, filename)
+        return os.path.join(self.config_directory, RIGS_DIRECTORY, self.rig_id, filename)
 
     # TODO: dict-like
     def get(self, key):
@@ -76,8 +136,18 @@ class Configuration(object):
         self._validate_config_value(key, value)
         user_config = self._user_config.copy()
         user_config[key] = value
-        with open(self.user_filepath, 'w') as f:
-            f.write(json.dumps(user_config, sort_keys=True, indent=4))
+        with self._lock:
+            snapshot_is_current = self._file_signature() == self._snapshot_signature
+            with open(self.user_filepath, 'w') as f:
+                f.write(json.dumps(user_config, sort_keys=True, indent=4))
+            self.user_filepath_exists = True
+            if snapshot_is_current:
+                self._snapshot[key] = value
+                self._snapshot_signature = self._file_signature()
+            else:
+                # something else changed the files too, reload everything on the next get
+                self._snapshot_signature = None
+            self.version += 1
         logger.info(f"config set: {key}={value}")
 
     @property
@@ -98,12 +168,35 @@ class Configuration(object):
             raise e
         return {}
 
-    @property
-    def _config(self):
-        # TODO: cache this, using date modified timestamp of file as key?
+    def _file_signature(self):
+        signature = []
+        for filepath in (self.default_filepath, self.user_filepath):
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                signature.append(None)
+                continue
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def _read_config(self):
+        self.user_filepath_exists = os.path.exists(self.user_filepath)
         conf = self._default_config.copy()
         conf.update(self._user_config)
         return conf
 
+    @property
+    def _config(self):
+        signature = self._file_signature()
+        if signature == self._snapshot_signature:
+            return self._snapshot
+        with self._lock:
+            if signature != self._snapshot_signature:
+                logger.debug("config files changed, reloading")
+                # only reloads are timed, a span on every cached get would cost as much as the get
+                with timing.span(timing.STAGE_CONFIG, 'reload'):
+                    self._snapshot = self._read_config()
+                self._snapshot_signature = signature
+                self.version += 1
+            return self._snapshot
 
-_instance = Configuration()
@@ -0,0 +1,148 @@
+"""
+In-process event bus behind the /chess_v1/events Server-Sent Events stream, one per rig.
+
+The controllers publish what they already know as it changes (commanded head position, hand/z
+state, step and job progress, health snapshots, errors), so watching the rig costs the hardware
+links nothing no matter how many viewers there are. Each viewer gets its own bounded queue; one
+that falls too far behind loses its oldest events rather than holding anything up.
+"""
+from collections import deque
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+
+EVENT_JOB = 'job'
+EVENT_STEP = 'step'
+EVENT_MOVE = 'move'
+EVENT_POSITION = 'position'
+EVENT_STEPPERS = 'steppers'
+EVENT_HEALTH = 'health'
+EVENT_SERIAL = 'serial'  # unsolicited messages from the sketch
+EVENT_ERROR = 'error'
+# the last event of these types, per device, is replayed to every new viewer, so it starts with
+# the full picture
+STATE_EVENTS = (EVENT_POSITION, EVENT_STEPPERS, EVENT_HEALTH)
+
+SUBSCRIBER_QUEUE_SIZE = 256  # events buffered per viewer before its oldest are dropped
+HISTORY_SIZE = 256  # recent events kept for viewers reconnecting with Last-Event-ID
+KEEPALIVE_INTERVAL = 15  # seconds between comments on an otherwise quiet stream
+
+logger = logging.getLogger(__name__)
+
+
+class Event(object):
+    def __init__(self, event_id, event_type, data):
+        self.id = event_id
+        self.type = event_type
+        self.data = data
+        self.time = time.time()
+
+    def encode(self):
+        """ The event in text/event-stream format """
+        data = json.dumps(dict(self.data, time=self.time))
+        return f"id: {self.id}\nevent: {self.type}\ndata: {data}\n\n"
+
+
+class Subscription(object):
+    def __init__(self, bus):
+        self._bus = bus
+        self._queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = 0
+
+    def offer(self, event):
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """ The next event, or None after `timeout` seconds without one """
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+
+class EventBus(object):
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._subscribers = set()
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._state = {}  # (event type, device) -> last event, for STATE_EVENTS
+        self._subscribe_listeners = []
+        self._lock = threading.Lock()
+
+    @property
+    def watched(self):
+        """ True while anyone is subscribed """
+        return bool(self._subscribers)
+
+    def on_subscribe(self, callback):
+        """ `callback()` is called whenever a viewer subscribes, e.g. to start something it'll want to see """
+        self._subscribe_listeners.append(callback)
+
+    def publish(self, event_type, **data):
+        with self._lock:
+            event = Event(next(self._ids), event_type, data)
+            self._history.append(event)
+            if event_type in STATE_EVENTS:
+                self._state[(event_type, data.get('device'))] = event
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.offer(event)
+        return event
+
+    def subscribe(self, last_event_id=None):
+        """ Starts a subscription, primed with what the viewer needs to catch up
+
+            :param last_event_id: the last event a reconnecting viewer saw, it gets everything
+                since then if that's still in the history, otherwise the current state
+        """
+        subscription = Subscription(self)
+        with self._lock:
+            self._subscribers.add(subscription)
+            missed = None
+            if last_event_id is not None and self._history and \
+                    self._history[0].id <= last_event_id + 1 <= self._history[-1].id + 1:
+                missed = [event for event in self._history if event.id > last_event_id]
+            if missed is None:
+                missed = sorted(self._state.values(), key=lambda event: event.id)
+            for event in missed:
+                subscription.offer(event)
+        logger.info(f"event subscriber added, {len(self._subscribers)} watching")
+        for callback in self._subscribe_listeners:
+            callback()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+        logger.info(f"event subscriber left, {len(self._subscribers)} watching")
+
+    def state(self):
+        with self._lock:
+            return [dict(event.data, type=event.type) for event in self._state.values()]
+
+
+def stream(subscription):
+    """ Yields the subscription's events as text/event-stream chunks until the viewer goes away """
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            event = subscription.get(timeout=KEEPALIVE_INTERVAL)
+            yield event.encode() if event is not None else ": keepalive\n\n"
+    finally:
+        subscription.close()
+
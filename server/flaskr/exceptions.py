@@ -15,3 +15,15 @@ class AxisControllerException(Exception):
 
 class MotorControllerException(Exception):
     pass
+
+
+class JobCancelledException(Exception):
+    pass
+
+
+class RigBusyException(Exception):
+    pass
+
+
+class IllegalMoveException(Exception):
+    pass
@@ -0,0 +1,125 @@
+import json
+import logging
+import threading
+
+from .exceptions import AxisControllerException
+from .move_planner import distance
+
+logger = logging.getLogger(__name__)
+
+
+class Graveyard(object):
+    """
+    Occupancy of the graveyard slots around the board, and which slot each captured piece goes to.
+
+    Every capture gets the free slot nearest its square, so pieces never travel further than they
+    have to and never land on a slot, or a square, that's already in use. The occupants, and where
+    each one was captured, are what a board reset has to bring back.
+
+    :param geometry: the rig's BoardGeometry
+    :param filepath: where the occupants are kept, so a restart doesn't forget them, None to only
+        keep them in memory
+    """
+    def __init__(self, geometry, filepath=None):
+        self.geometry = geometry
+        self.filepath = filepath
+        self._occupants = self._load()  # slot -> {'space': captured on, 'piece': FEN symbol if known}
+        self._lock = threading.Lock()
+        self._by_distance = {}  # space -> every slot, nearest first
+        self._positions = None
+
+    def _load(self):
+        if self.filepath is None:
+            return {}
+        try:
+            with open(self.filepath) as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"could not read graveyard occupants from {self.filepath}, starting empty: {e}")
+            return {}
+
+    def _save(self):
+        """ Writes the occupants out, call with the lock held so writes don't overtake each other """
+        if self.filepath is None:
+            return
+        try:
+            with open(self.filepath, 'w') as f:
+                f.write(json.dumps(self._occupants))
+        except OSError as e:
+            logger.warning(f"could not save graveyard occupants to {self.filepath}: {e}")
+
+    def _slots_by_distance(self, space):
+        positions = self.geometry.positions
+        if positions is not self._positions:
+            # the geometry was rebuilt, so were the slots
+            self._by_distance = {}
+            self._positions = positions
+        space = space.upper()
+        slots = self._by_distance.get(space)
+        if slots is None:
+            origin = self.geometry.position(space)
+            slots = sorted(self.geometry.graveyard_slots(), key=lambda slot: distance(origin, positions[slot]))
+            self._by_distance[space] = slots
+        return slots
+
+    def nearest_free(self, space, reserved=()):
+        """ The free slot closest to `space`, skipping any in `reserved`
+
+            :raises AxisControllerException: if every slot is taken
+        """
+        with self._lock:
+            occupied = set(self._occupants)
+        for slot in self._slots_by_distance(space):
+            if slot not in occupied and slot not in reserved:
+                return slot
+        raise AxisControllerException("graveyard is full, clear it before capturing more pieces")
+
+    def assign(self, moves, reserved=()):
+        """ Copies `moves` with a `discard_space` on every remove_from_board that doesn't have one
+
+            Nothing is marked occupied until the piece is actually dropped, see `occupy`, so slots
+            handed out for moves that haven't been performed yet have to be passed in `reserved`.
+        """
+        reserved = set(reserved)
+        assigned = []
+        for move in moves:
+            if move['action'] == 'remove_from_board' and not move.get('discard_space'):
+                move = dict(move, discard_space=self.nearest_free(move['space'], reserved))
+                reserved.add(move['discard_space'])
+            assigned.append(move)
+        return assigned
+
+    def occupy(self, slot, space, piece=None):
+        with self._lock:
+            self._occupants[slot.upper()] = {'space': space.upper(), 'piece': piece}
+            self._save()
+        logger.info(f"{piece or 'piece'} from {space} dropped in {slot}")
+
+    def release(self, slot):
+        with self._lock:
+            occupant = self._occupants.pop(slot.upper(), None)
+            self._save()
+        return occupant
+
+    def clear(self):
+        with self._lock:
+            self._occupants = {}
+            self._save()
+
+    def occupants(self):
+        """ [{'slot', 'space', 'piece'}] for every occupied slot """
+        with self._lock:
+            occupants = dict(self._occupants)
+        return [dict(occupant, slot=slot) for slot, occupant in sorted(occupants.items())]
+
+    def status(self):
+        slots = self.geometry.graveyard_slots()
+        occupants = self.occupants()
+        occupied = {occupant['slot'] for occupant in occupants}
+        return {
+            'slots': len(slots),
+            'free': len([slot for slot in slots if slot not in occupied]),
+            'occupants': occupants,
+        }
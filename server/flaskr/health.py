@@ -0,0 +1,91 @@
+import copy
+import logging
+import threading
+import time
+
+from .events import EVENT_HEALTH
+
+POLL_IDLE_TIMEOUT = 60  # seconds without a status request before the poller stops
+
+logger = logging.getLogger(__name__)
+
+
+class HealthPoller(object):
+    """
+    Keeps a status snapshot fresh on a background thread so status requests are answered from memory.
+
+    `check` is called every `ttl` seconds (a number, or a callable returning one so it can follow the
+    configuration). The thread starts on the first status request, or when someone starts watching
+    `events`, and stops once nobody has asked for POLL_IDLE_TIMEOUT seconds and nobody is watching,
+    so an idle server leaves the hardware alone. Until the first check since the thread started is
+    done, status requests get a pending status instead of waiting for it or getting the snapshot
+    from before the poller stopped. Snapshots that differ from the previous one are published as
+    health events.
+    """
+    def __init__(self, name, check, ttl, events=None):
+        self.name = name
+        self.events = events
+        self.check = check
+        self._ttl = ttl
+        self._snapshot = None
+        self._checked_at = None
+        self._last_requested = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+        if events is not None:
+            # event stream viewers see health changes without having to ask for the status
+            events.on_subscribe(self._ensure_running)
+
+    @property
+    def ttl(self):
+        return self._ttl() if callable(self._ttl) else self._ttl
+
+    def status(self):
+        self._last_requested = time.monotonic()
+        self._ensure_running()
+        if not self._ready.is_set():
+            return {'status': 'pending', 'checked_at': None, 'age': None}
+
+        with self._lock:
+            status = copy.deepcopy(self._snapshot)
+            checked_at = self._checked_at
+        status['checked_at'] = checked_at
+        status['age'] = time.time() - checked_at
+        return status
+
+    def refresh(self):
+        try:
+            snapshot = self.check()
+        except Exception as e:
+            logger.exception(f"{self.name} health check failed")
+            snapshot = {'error': str(e)}
+        with self._lock:
+            changed = snapshot != self._snapshot
+            self._snapshot = snapshot
+            self._checked_at = time.time()
+        self._ready.set()
+        if changed and self.events is not None:
+            self.events.publish(EVENT_HEALTH, device=self.name, status=copy.deepcopy(snapshot))
+        return snapshot
+
+    def _ensure_running(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-health", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        logger.info(f"starting {self.name} health poller")
+        while True:
+            self.refresh()
+            time.sleep(self.ttl)
+            with self._lock:
+                watched = self.events is not None and self.events.watched
+                if time.monotonic() - self._last_requested > POLL_IDLE_TIMEOUT and not watched:
+                    logger.info(f"stopping idle {self.name} health poller")
+                    # the snapshot goes stale from here on
+                    self._ready.clear()
+                    self._thread = None
+                    return
@@ -0,0 +1,184 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import logging
+import queue
+import threading
+import time
+import uuid
+
+from .exceptions import JobCancelledException, RigBusyException
+from .events import EVENT_ERROR, EVENT_JOB, EventBus
+from . import metrics
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETE = 'complete'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+FINISHED_STATUSES = {JOB_COMPLETE, JOB_FAILED, JOB_CANCELLED}
+MAX_FINISHED_JOBS = 100  # finished jobs are kept around this long for status requests
+
+logger = logging.getLogger(__name__)
+
+
+class Job(object):
+    """
+    A unit of work for the rig. `work` is called with the job on the worker thread and should
+    call `step_complete` as it goes and `check_cancelled` between steps.
+    """
+    def __init__(self, description, work, events=None):
+        self.id = uuid.uuid4().hex
+        self.events = events or EventBus()
+        self.description = description
+        self.work = work
+        self.status = JOB_QUEUED
+        self.total_steps = None
+        self.completed_steps = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_requested = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def cancel_requested(self):
+        return self._cancel_requested.is_set()
+
+    def cancel(self):
+        self._cancel_requested.set()
+
+    def check_cancelled(self):
+        if self.cancel_requested:
+            raise JobCancelledException(f"job {self.id} cancelled")
+
+    def step_complete(self):
+        self.completed_steps += 1
+        self.publish()
+
+    def publish(self):
+        self.events.publish(
+            EVENT_JOB,
+            id=self.id,
+            description=self.description,
+            status=self.status,
+            total_steps=self.total_steps,
+            completed_steps=self.completed_steps,
+            error=self.error,
+        )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'description': self.description,
+            'status': self.status,
+            'total_steps': self.total_steps,
+            'completed_steps': self.completed_steps,
+            'cancel_requested': self.cancel_requested,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobQueue(object):
+    """
+    Runs jobs one at a time on a single worker thread, which is the only thread that drives the
+    rig's hardware while jobs are running. The worker is started on the first submitted job.
+    Each rig has its own queue, so rigs run their jobs independently of each other.
+
+    Anything else that drives the hardware, like the manual controls, has to do it inside
+    `exclusive`, so it never runs at the same time as a job.
+    """
+    def __init__(self, app, events=None, name='job-worker'):
+        self.app = app
+        self.events = events or EventBus()
+        self.name = name
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._hardware = threading.Lock()  # held by whoever is driving the rig
+        self._worker = None
+
+    def submit(self, description, work):
+        job = Job(description, work, events=self.events)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+        self._queue.put(job)
+        job.publish()
+        logger.info(f"queued job {job.id}: {description}")
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        job.cancel()
+        logger.info(f"cancel requested for job {job.id}")
+        return job
+
+    @contextmanager
+    def exclusive(self):
+        """ Holds the rig's hardware for work done outside a job, jobs wait until it's done
+
+            :raises RigBusyException: if a job is running
+        """
+        if not self._hardware.acquire(blocking=False):
+            raise RigBusyException("the rig is running a job, wait for it to finish or cancel it")
+        try:
+            yield
+        finally:
+            self._hardware.release()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job.cancel_requested:
+                job.status = JOB_CANCELLED
+                job.finished_at = time.time()
+                metrics.jobs_finished.inc(status=job.status)
+                job.publish()
+                continue
+
+            logger.info(f"starting job {job.id}")
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+            job.publish()
+            try:
+                with self._hardware, self.app.app_context():
+                    job.result = job.work(job)
+                job.status = JOB_COMPLETE
+            except JobCancelledException:
+                logger.info(f"job {job.id} cancelled after {job.completed_steps} steps")
+                job.status = JOB_CANCELLED
+            except Exception as e:
+                logger.exception(f"job {job.id} failed")
+                job.status = JOB_FAILED
+                job.error = str(e)
+                self.events.publish(EVENT_ERROR, source='job', id=job.id, error=job.error)
+            job.finished_at = time.time()
+            metrics.jobs_finished.inc(status=job.status)
+            job.publish()
+            logger.info(f"finished job {job.id}: {job.status}")
@@ -0,0 +1,69 @@
+import math
+
+AXES = ('x', 'y', 'z')
+
+# TwoPositionStepper::cwStep/ccwStep write four coil phases per step, each followed by delay(speedDelay)
+PHASES_PER_STEP = 4
+
+
+def travel_time(distance, feedrate, acceleration):
+    """ Time to travel `distance` along a trapezoidal velocity profile
+
+        :param distance: mm
+        :param feedrate: cruise speed in mm/min, same units as G-code F
+        :param acceleration: mm/s^2, used for both acceleration and deceleration
+        :returns: seconds
+    """
+    if distance <= 0:
+        return 0.0
+    cruise_speed = feedrate / 60.0
+    if acceleration <= 0:
+        return distance / cruise_speed
+
+    ramp_distance = cruise_speed * cruise_speed / acceleration  # speeding up plus slowing down
+    if distance >= ramp_distance:
+        return distance / cruise_speed + cruise_speed / acceleration
+    # never reaches cruise speed, triangular profile
+    return 2 * math.sqrt(distance / acceleration)
+
+
+def printhead_move_time(start, end, feedrate, acceleration, axis_feedrates=None):
+    """ Time for the printhead to move in a straight line from `start` to `end`
+
+        The requested feedrate is applied along the path, as the printer firmware does, but
+        is scaled down so no single axis exceeds its limit in `axis_feedrates`.
+
+        :param start: dict of axis -> mm
+        :param end: dict of axis -> mm, axes that are None or missing don't move
+        :param feedrate: mm/min
+        :param acceleration: mm/s^2
+        :param axis_feedrates: optional dict of axis -> max mm/min, e.g. from the printer profile
+        :returns: seconds
+    """
+    deltas = {}
+    for axis in AXES:
+        if end.get(axis) is None:
+            continue
+        deltas[axis] = abs(end[axis] - start[axis])
+    distance = math.sqrt(sum(d * d for d in deltas.values()))
+    if distance == 0:
+        return 0.0
+
+    for axis, delta in deltas.items():
+        axis_limit = (axis_feedrates or {}).get(axis)
+        if not delta or not axis_limit:
+            continue
+        feedrate = min(feedrate, axis_limit * distance / delta)
+
+    return travel_time(distance, feedrate, acceleration)
+
+
+def stepper_move_time(steps, speed_delay, enable_delay=0):
+    """ Time for the Arduino to drive a TwoPositionStepper `steps` steps
+
+        :param steps: number of steps, sign is ignored
+        :param speed_delay: ms between coil phases (`speedDelay` in the sketch)
+        :param enable_delay: ms the sketch waits after toggling the hand/z driver
+        :returns: seconds
+    """
+    return (abs(steps) * PHASES_PER_STEP * speed_delay + enable_delay) / 1000.0
@@ -1,69 +1,136 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import serial
+from serial.tools import list_ports
 import time
-import sys
-import glob
+import json
 import logging
 
-from .config import Configuration
 from .exceptions import MotorControllerException
+from .events import EVENT_ERROR, EVENT_HEALTH, EVENT_SERIAL, EVENT_STEPPERS, EventBus
+from . import metrics
+from . import motion
+from . import timing
+from .serial_link import SerialLink
+from . import serial_protocol as protocol
 
 CONNECT_TIMEOUT = 5  # seconds
 CONNECT_POLL_SLEEP = 0.05  # seconds
 CONNECT_POLL_ATTEMPTS = int(CONNECT_TIMEOUT / CONNECT_POLL_SLEEP)
 
 HANDSHAKE = 'heybuddy'
-HANDSHAKE_ACK = 'eyyy'
 HANDSHAKE_TIMEOUT = 3  # seconds
-HANDSHAKE_POLL_SLEEP = 0.05  # seconds
-HANDSHAKE_POLL_ATTEMPTS = int((HANDSHAKE_TIMEOUT * 1000) / HANDSHAKE_POLL_SLEEP)
+BAUD_SWITCH_SETTLE = 0.01  # seconds for the sketch to restart its UART after ACKing a new baud rate
+BAUD_CONFIRM_TIMEOUT = 0.5  # seconds the sketch waits for a frame at a new baud rate before reverting
+
+PORT_CACHE_FILENAME = 'last_port.json'
+
+# the command that drives each stepper to its home switch and the one that drives it away
+STEPPER_POSITIONS = {
+    'hand': {'home': 'close', 'away': 'open'},
+    'z': {'home': 'up', 'away': 'down'},
+}
 
 
 logger = logging.getLogger(__name__)
 
 
-def serial_ports():
-    """ Lists serial port names
+def _usb_id_matches(port_info, usb_ids):
+    for usb_id in usb_ids:
+        vendor, _, product = usb_id.lower().partition(':')
+        if port_info.vid != int(vendor, 16):
+            continue
+        if not product or port_info.pid == int(product, 16):
+            return True
+    return False
+
+
+def candidate_ports(usb_ids):
+    """ Lists serial ports that look like they could be the Arduino
 
-        :raises EnvironmentError:
-            On unsupported or unknown platforms
-        :returns:
-            A list of the serial ports available on the system
+        Ports whose USB vendor (and product, if given) is in `usb_ids` come first. If none match,
+        fall back to every USB serial port; ports with no USB metadata at all (built in UARTs,
+        Bluetooth, virtual terminals) are never probed.
+
+        :param usb_ids: hex ids like "2341" (any Arduino SA board) or "1a86:7523" (CH340)
     """
-    if sys.platform.startswith('win'):
-        ports = ['COM%s' % (i + 1) for i in range(256)]
-    elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-        # this excludes your current terminal "/dev/tty"
-        ports = glob.glob('/dev/tty[A-Za-z]*')
-    elif sys.platform.startswith('darwin'):
-        ports = glob.glob('/dev/cu*')
-        # ports = glob.glob('/dev/tty.*')
-    else:
-        raise EnvironmentError('Unsupported platform')
-
-    logger.info(f"Found available ports: {ports}")
+    usb_ports = [port_info for port_info in list_ports.comports() if port_info.vid is not None]
+    matching = [port_info.device for port_info in usb_ports if _usb_id_matches(port_info, usb_ids)]
+    if matching:
+        logger.info(f"Found ports matching known Arduino USB ids: {matching}")
+        return matching
+    ports = [port_info.device for port_info in usb_ports]
+    logger.info(f"No ports match known Arduino USB ids, trying all USB serial ports: {ports}")
     return ports
 
 
+def _probe_result(future):
+    """ What a finished probe found, None if it was cancelled or failed """
+    if future.cancelled() or future.exception() is not None:
+        return None
+    return future.result()
+
+
+def _close_probe(future):
+    found = _probe_result(future)
+    if found is not None:
+        _serial, _ = found
+        _serial.close()
+
+
 class MotorController(object):
-    def __init__(self):
+    """
+    Talks to one rig's Arduino.
+
+    :param config: the rig's Configuration
+    :param events: the rig's EventBus
+    :param claimed_ports: callable returning the ports other rigs are using, which port discovery
+        leaves alone
+    """
+    def __init__(self, config, events=None, claimed_ports=lambda: ()):
+        self.config = config
+        self.events = events or EventBus()
+        self.claimed_ports = claimed_ports
         self._serial = None
+        self._link = None
         self._initialized = False
+        self.port = None
+        self.handshake_seconds = None
+        # last position each stepper was driven to, None when we can't be sure
+        self.state = {
+            'hand': None,
+            'z': None,
+        }
+
+    @property
+    def baudrate(self):
+        if self._serial is not None:
+            return self._serial.baudrate
+        return self.config.get('serial_baudrate')
 
-    @classmethod
-    def instance(cls):
-        return _instance
+    @property
+    def timeout(self):
+        return self.config.get('serial_timeout')
 
+    @timing.timed(timing.STAGE_INIT, 'serial_initialize')
     def initialize(self):
         self._serial = self.get_serial()
         if self._serial is None:
+            self.events.publish(EVENT_HEALTH, device='arduino', status={'initialized': False, 'port': None})
             return False, 'failed to open serial connection'
         self._initialized = True
+        self.events.publish(EVENT_HEALTH, device='arduino', status={
+            'initialized': True,
+            'port': self.port,
+            'baudrate': self.baudrate,
+            'handshake_seconds': self.handshake_seconds,
+        })
+        self.resync()
         return True, ''
 
     def get_controller_serial_status(self):
-        port = Configuration.config().get('arduino_port')
-        baudrate = Configuration.config().get('serial_baudrate')
-        timeout = Configuration.config().get('serial_timeout')
+        port = self.config.get('arduino_port')
+        baudrate = self.config.get('serial_baudrate')
+        timeout = self.config.get('serial_timeout')
 
         logger.info(f"starting initialization port={port} baud={baudrate} timeout={timeout}")
 
@@ -90,128 +157,383 @@ class MotorController(object):
             checks['serial']['message'] = 'could not open connection to serial port'
             logger.info("failed to open connection to port")
         else:
-            if not self._confirm_with_handshake(self._serial):
+            handshake_seconds = self._link_handshake()
+            if handshake_seconds is None:
                 checks['serial']['status'] = 'NOT OK'
                 checks['serial']['message'] = 'no ACK received'
                 logger.info("failed to receive ACK")
             else:
                 checks['serial']['status'] = 'OK'
+                checks['serial']['handshake_seconds'] = handshake_seconds
                 logger.info("initialization complete")
+        checks['serial']['connect_handshake_seconds'] = self.handshake_seconds
+        checks['serial']['steppers'] = dict(self.state)
 
         return checks
 
+    @property
+    def _port_cache_filepath(self):
+        return self.config.rig_filepath(PORT_CACHE_FILENAME)
+
+    def _cached_port(self):
+        try:
+            with open(self._port_cache_filepath) as f:
+                return json.loads(f.read()).get('arduino_port')
+        except (OSError, ValueError):
+            return None
+
+    def _cache_port(self, port):
+        try:
+            with open(self._port_cache_filepath, 'w') as f:
+                f.write(json.dumps({'arduino_port': port}))
+        except OSError as e:
+            logger.warning(f"could not remember serial port {port}: {e}")
+
+    def _probe_port(self, port):
+        """ Opens `port` and returns (serial, handshake seconds) if the Arduino answers the handshake,
+            else closes it and returns None
+
+            Never raises, one misbehaving port mustn't stop the others being probed.
+        """
+        try:
+            _serial = serial.Serial(port=port, baudrate=self.config.get('serial_baudrate'), timeout=self.timeout)
+        except (serial.SerialException, OSError) as e:
+            logger.info(f"[{port}] ...could not open: {e}")
+            return None
+        try:
+            handshake_seconds = self._establish(_serial)
+        except Exception as e:
+            logger.info(f"[{port}] ...failed during handshake: {e}")
+            handshake_seconds = None
+        if handshake_seconds is not None:
+            logger.info(f"[{port}] ...ACKed!")
+            return _serial, handshake_seconds
+        logger.info(f"[{port}] ...no ACK")
+        try:
+            _serial.close()
+        except (serial.SerialException, OSError):
+            pass
+        return None
+
     def _find_port(self):
+        """ Finds the Arduino, returns an open serial connection to it or None
+
+            The last port that worked is tried on its own first. After that every candidate is
+            probed at once and the first one to answer wins.
+        """
         logger.info("Finding a worthy port")
-        available_ports = serial_ports()
-        for port in available_ports:
-            logger.info(f"[{port}]")
-            confirmed_handshake = False
-            s = serial.Serial(port=port, baudrate=self.baudrate, timeout=self.timeout)
-            for i in range(CONNECT_POLL_ATTEMPTS):
-                if s.is_open:
-                    logger.info("   ...connected")
-                    confirmed_handshake = self._confirm_with_handshake(s)
-                    break
-                time.sleep(CONNECT_POLL_SLEEP)
-            s.close()
-            if confirmed_handshake:
-                logger.info("   ...ACKed!")
-                return port
-            logger.info("   ...no ACK")
+        claimed = set(self.claimed_ports())
+        cached_port = self._cached_port()
+        if cached_port and cached_port not in claimed:
+            logger.info(f"trying last known port {cached_port}")
+            winner = self._probe_port(cached_port)
+            if winner is not None:
+                _serial, self.handshake_seconds = winner
+                return _serial
+
+        usb_ids = self.config.get('arduino_usb_ids')
+        candidates = [port for port in candidate_ports(usb_ids) if port != cached_port and port not in claimed]
+        if not candidates:
+            return None
+
+        winner = None
+        executor = ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix='port-probe')
+        futures = [executor.submit(self._probe_port, port) for port in candidates]
+        for future in as_completed(futures):
+            winner = _probe_result(future)
+            if winner is not None:
+                break
+        # don't wait on the stragglers, just close whatever else answers
+        for future in futures:
+            if not future.done() or _probe_result(future) is not winner:
+                future.add_done_callback(_close_probe)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        if winner is None:
+            return None
+        # only the port that's kept, the other probes' handshakes don't matter
+        _serial, self.handshake_seconds = winner
+        self._cache_port(_serial.port)
+        return _serial
+
+    @staticmethod
+    def _read_frame(_serial, decoder, done, timeout):
+        """ Reads frames until `done(frame)` is true, returns that frame or None after `timeout` seconds """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            for frame in decoder.feed(_serial.read(_serial.in_waiting or 1)):
+                if done(frame):
+                    return frame
         return None
 
-    def _confirm_with_handshake(self, _serial):
-        timeout = Configuration.config().get('serial_timeout')
-        for i in range(5):
-            _serial.write(bytes(f"{HANDSHAKE}:", 'utf-8'))
-            time.sleep(1)
-            data = _serial.readline()
-            attempts = int(HANDSHAKE_TIMEOUT / (HANDSHAKE_POLL_SLEEP + timeout))
-            for i in range(attempts):
-                data = _serial.readline().decode('utf-8').strip()
-                if data == HANDSHAKE_ACK:
-                    return True
-                if i < attempts - 1:
-                    time.sleep(HANDSHAKE_POLL_SLEEP)
+    def _request(self, _serial, frame_type, payload=b'', timeout=HANDSHAKE_TIMEOUT):
+        """ Sends an untagged command before the link is running, returns (ack code, result) or None """
+        decoder = protocol.FrameDecoder()
+        _serial.write(protocol.encode_frame(frame_type, protocol.UNTAGGED, payload))
+        ack = self._read_frame(_serial, decoder, lambda frame: frame.type == protocol.TYPE_ACK, timeout)
+        if ack is None:
+            return None
+        return protocol.decode_ack(frame_type, ack.payload)
+
+    @timing.timed(timing.STAGE_INIT, 'handshake')
+    def _confirm_with_handshake(self, _serial, wait_for_boot=True):
+        """ Checks the sketch is listening on `_serial`
+
+            Opening the port resets most boards and anything sent while the bootloader runs is
+            lost, so on a freshly opened port this first waits for the sketch's boot frame. Boards
+            that don't reset on open never send it, so that wait gives up after
+            arduino_boot_timeout. Reads return as soon as a frame arrives, nothing sleeps.
+
+            :returns: seconds from the call until the ACK arrived, or None if it never did
+        """
+        started = time.monotonic()
+        if wait_for_boot:
+            boot_timeout = self.config.get('arduino_boot_timeout')
+            is_boot = lambda frame: frame.type == protocol.TYPE_BOOT
+            if self._read_frame(_serial, protocol.FrameDecoder(), is_boot, boot_timeout) is None:
+                logger.info(f"[{_serial.port}] no boot frame after {boot_timeout}s, handshaking anyway")
+            else:
+                logger.info(f"[{_serial.port}] booted after {time.monotonic() - started:.3f}s")
+
+        _serial.reset_input_buffer()
+        ack = self._request(_serial, protocol.TYPE_HANDSHAKE)
+        if ack is None:
+            return None
+        code, result = ack
+        if code != protocol.ACK_OK or result.get('version') != protocol.PROTOCOL_VERSION:
+            logger.error(f"[{_serial.port}] sketch speaks protocol {result.get('version')}, "
+                         f"expected {protocol.PROTOCOL_VERSION}, is the firmware up to date?")
+            return None
+        handshake_seconds = time.monotonic() - started
+        logger.info(f"[{_serial.port}] handshake took {handshake_seconds:.3f}s")
+        return handshake_seconds
+
+    def _negotiate_baud(self, _serial, baudrate):
+        """ Moves both ends to `baudrate`, staying at the current rate if the sketch can't follow """
+        boot_baudrate = _serial.baudrate
+        ack = self._request(_serial, protocol.TYPE_SET_BAUD, protocol.set_baud_payload(baudrate))
+        if ack is None or ack[0] != protocol.ACK_OK:
+            logger.warning(f"Arduino refused {baudrate} baud, staying at {boot_baudrate}")
+            return False
+        time.sleep(BAUD_SWITCH_SETTLE)
+        _serial.baudrate = baudrate
+        if self._confirm_with_handshake(_serial, wait_for_boot=False) is not None:
+            logger.info(f"switched to {baudrate} baud")
+            return True
+        logger.warning(f"no ACK at {baudrate} baud, falling back to {boot_baudrate}")
+        _serial.baudrate = boot_baudrate
+        time.sleep(BAUD_CONFIRM_TIMEOUT)  # the sketch reverts on its own after this
         return False
 
+    def _establish(self, _serial):
+        """ Handshakes on a freshly opened port and moves it to serial_fast_baudrate
+
+            :returns: the handshake latency in seconds, or None if the sketch never answered
+        """
+        boot_baudrate = _serial.baudrate
+        fast_baudrate = self.config.get('serial_fast_baudrate')
+        handshake_seconds = self._confirm_with_handshake(_serial)
+        if handshake_seconds is None:
+            if not fast_baudrate:
+                return None
+            # a board that doesn't reset on open is still at the rate negotiated last time
+            _serial.baudrate = fast_baudrate
+            handshake_seconds = self._confirm_with_handshake(_serial, wait_for_boot=False)
+            if handshake_seconds is None:
+                _serial.baudrate = boot_baudrate
+            return handshake_seconds
+        if fast_baudrate and fast_baudrate != _serial.baudrate:
+            self._negotiate_baud(_serial, fast_baudrate)
+        return handshake_seconds
+
     def get_serial(self):
         if self._serial:
             return self._serial
-        port = Configuration.config().get('arduino_port')
-        baudrate = Configuration.config().get('serial_baudrate')
-        timeout = Configuration.config().get('serial_timeout')
-        _serial = serial.Serial(port=port, baudrate=baudrate, timeout=timeout)
+        port = self.config.get('arduino_port')
+        if port is None:
+            _serial = self._find_port()
+            if _serial is None:
+                logger.error("Failed to find a port that is worthy")
+                return None
+            self._serial = _serial
+            self.port = _serial.port
+            return self._serial
+
+        _serial = serial.Serial(port=port, baudrate=self.config.get('serial_baudrate'), timeout=self.timeout)
         for i in range(CONNECT_POLL_ATTEMPTS):
             if _serial.is_open:
                 logger.info("serial port opened successfully")
-                self._confirm_with_handshake(_serial)
+                self.handshake_seconds = self._establish(_serial)
                 self._serial = _serial
+                self.port = port
                 return self._serial
             time.sleep(CONNECT_POLL_SLEEP)
         return None
 
-    # TODO: not sure how port detection will play with the rest of the flow yet
-    # def configure(self, port=None, baudrate=None, timeout=None):
-    #     # TODO: should we just set port, baudrate, and timeout in config
-    #     # and read directly from there?
-    #     logger.info("# Starting MotorController configure #")
-    #     if baudrate is not None:
-    #         self.baudrate = baudrate
-    #     if timeout is not None:
-    #         self.timeout = timeout
-
-    #     if port is not None:
-    #         self.port = port
-    #         return
-    #     else:
-    #         self.port = self._find_port()
-    #         if not self.port:
-    #             msg = "Failed to find a port that is worthy"
-    #             logger.error(msg)
-    #             raise Exception(msg)
-
-    #     logger.info(f"--> MotorController: port={self.port}, baudrate={self.baudrate}, timeout={self.timeout}")
-    #     self._serial = serial.Serial(port=self.port, baudrate=self.baudrate, timeout=self.timeout)
-    #     # Serial may not open right away.. give it a little bit
-    #     for i in range(CONNECT_POLL_ATTEMPTS):
-    #         if self._serial.is_open:
-    #             logger.info(f"    Connected to {self.port}!")
-    #             return
-    #         time.sleep(CONNECT_POLL_SLEEP)
-
-    #     msg = f"Failed to connect to {self.port}"
-    #     logger.error(msg)
-    #     raise Exception(msg)
-
-    def write_read(self, cmd):
+    def _link_handshake(self):
+        """ Handshake over the running link, returns the round trip in seconds or None """
+        started = time.monotonic()
+        try:
+            response = self.write_read(f"{HANDSHAKE}:", timeout=HANDSHAKE_TIMEOUT)
+        except MotorControllerException as e:
+            logger.info(f"handshake failed: {e}")
+            return None
+        if response.get('version') != protocol.PROTOCOL_VERSION:
+            return None
+        return time.monotonic() - started
+
+    def link(self):
+        """ The reader for the current serial connection, started on first use """
+        _serial = self.get_serial()
+        if _serial is None:
+            raise MotorControllerException('no serial connection')
+        if self._link is None or self._link.serial is not _serial or not self._link.alive:
+            self._link = SerialLink(_serial)
+            self._link.add_listener(self._on_unsolicited)
+        return self._link
+
+    def _on_unsolicited(self, message):
+        self.events.publish(EVENT_SERIAL, device='arduino', message=message)
+        if message == 'boot':
+            # the sketch forgets where its steppers are when it resets
+            self.invalidate_state()
+
+    def invalidate_state(self):
+        for stepper_id in self.state:
+            self.state[stepper_id] = None
+        self._publish_state()
+
+    def _publish_state(self):
+        self.events.publish(EVENT_STEPPERS, device='arduino', **self.state)
+
+    def resync(self):
+        """ Rebuilds the stepper model from the sketch's debug readout
+
+            The sketch reports where it last drove each stepper, or nothing if it hasn't since it
+            booted. In that case a stepper sitting on its home switch is still known to be home.
+        """
+        self.invalidate_state()
+        try:
+            readout = self.write_read('debug:')
+        except MotorControllerException as e:
+            logger.warning(f"could not read stepper state: {e}")
+            return dict(self.state)
+        for stepper_id, positions in STEPPER_POSITIONS.items():
+            position = readout.get(f"{stepper_id}_position")
+            if position is None and readout.get(f"{stepper_id}_home"):
+                position = 'home'
+            self.state[stepper_id] = positions.get(position)
+        self._publish_state()
+        logger.info(f"stepper state: {self.state}")
+        return dict(self.state)
+
+    def _send(self, cmd, expected=0, timeout=None):
+        """ Queues `cmd` without waiting for it, returns a future for its result
+
+            Commands run on the Arduino in the order they were sent. Pass the future to `_wait`.
+
+            :param expected: seconds the command is expected to keep the Arduino busy
+            :param timeout: seconds of slack on top of that, defaults to serial_timeout
+        """
         if not self._initialized:
             raise MotorControllerException('controller not initialized')
-        _serial = self.get_serial()
-        _serial.write(bytes(cmd, 'utf-8'))
-        time.sleep(0.05)
-        response = []
-        data = _serial.readline()
-        while data:
-            data = _serial.readline().decode('utf-8').strip()
-            response.append(data)
-        return response
+        if timeout is None:
+            timeout = self.config.get('serial_timeout')
+        return self.link().send(cmd, expected=expected, timeout=timeout)
+
+    def _wait(self, future):
+        """ Blocks until a future from `_send` is done, returns its result or raises MotorControllerException """
+        return self._link.wait(future)
+
+    def write_read(self, cmd, timeout=None):
+        """ Sends `cmd` and blocks until the Arduino reports that it's done handling it
+
+            Stepper moves go through the same path as hand_open and friends, so the tracked state
+            follows them, but they're always sent even if the stepper should already be there.
+
+            :param timeout: seconds to wait for the command to complete, defaults to serial_timeout
+            :raises MotorControllerException: if `cmd` isn't a command the sketch knows, the Arduino
+                doesn't finish in time or it reports an error
+            :returns: the ACK's result as a dict, e.g. {'version': 1} for the handshake or the
+                readout for debug, empty for commands that only say they're done
+        """
+        # cmd can come straight from the raw_write endpoint, don't let it make up span names
+        name = protocol.command_name(cmd)
+        stepper_id = name.partition(':')[0]
+        if stepper_id in self.state:
+            return self.send_moves(name, timeout=timeout, elide=False)[0]
+        with timing.span(timing.STAGE_SERIAL, name):
+            return self._wait(self._send(cmd, timeout=timeout))
+
+    def send_moves(self, *commands, timeout=None, elide=True):
+        """ Queues the stepper moves `commands`, e.g. 'z:down', 'hand:close', 'z:up', back to back
+            and blocks until the Arduino has done them all
+
+            The sketch runs them in order, so each one starts the moment the one before it is done
+            instead of a serial round trip later. The tracked state follows each move as its ACK
+            arrives.
+
+            :param timeout: seconds of slack for each move on top of its expected time, defaults to
+                serial_timeout
+            :param elide: skip moves that leave a stepper where it already is
+            :raises MotorControllerException: at the first move that fails, after resyncing the
+                tracked state with the sketch
+            :returns: the ACK's result for each move, empty for moves that were skipped
+        """
+        for cmd in commands:
+            if cmd.partition(':')[0] not in self.state:
+                raise MotorControllerException(f"{cmd} isn't a stepper move")
+        planned = dict(self.state)
+        queued = []
+        try:
+            for cmd in commands:
+                stepper_id, _, position = cmd.partition(':')
+                if elide and planned[stepper_id] == position:
+                    logger.info(f"{stepper_id} already {position}, skipping {cmd}")
+                    metrics.commands_elided.inc(device='arduino')
+                    queued.append((stepper_id, cmd, None))
+                    continue
+                planned[stepper_id] = position
+                expected = self.move_time(stepper_id) + self.config.get('move_wait_margin')
+                queued.append((stepper_id, cmd, self._send(cmd, expected=expected, timeout=timeout)))
+
+            results = []
+            for stepper_id, cmd, future in queued:
+                if future is None:
+                    results.append({})
+                    continue
+                with timing.span(timing.STAGE_SERIAL, cmd):
+                    results.append(self._wait(future))
+                self.state[stepper_id] = cmd.partition(':')[2]
+                self._publish_state()
+            return results
+        except MotorControllerException as e:
+            self.events.publish(EVENT_ERROR, source='arduino', command=' '.join(commands), error=str(e))
+            self.resync()
+            raise
+
+    def move_time(self, stepper_id):
+        """ Seconds the Arduino needs to drive `stepper_id` ('hand' or 'z') between its two positions """
+        config = self.config
+        return motion.stepper_move_time(
+            config.get(f"{stepper_id}_stepper_steps"),
+            config.get(f"{stepper_id}_stepper_speed_delay"),
+            enable_delay=config.get('stepper_enable_delay'),
+        )
 
     def hand_open(self):
         logger.info('Performing hand:open')
-        return self.write_read('hand:open')
+        return self.send_moves('hand:open')[0]
 
     def hand_close(self):
         logger.info('Performing hand:close')
-        return self.write_read('hand:close')
+        return self.send_moves('hand:close')[0]
 
     def z_down(self):
         logger.info('Performing z:down')
-        return self.write_read('z:down')
+        return self.send_moves('z:down')[0]
 
     def z_up(self):
         logger.info('Performing z:up')
-        return self.write_read('z:up')
-
+        return self.send_moves('z:up')[0]
 
-_instance = MotorController()
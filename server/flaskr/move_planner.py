@@ -0,0 +1,157 @@
+import logging
+import math
+
+# plans with at most this many steps are searched exhaustively, longer ones greedily
+EXACT_PLAN_LIMIT = 7
+# discard candidates considered per capture when searching exhaustively
+DISCARD_CANDIDATES = 3
+
+logger = logging.getLogger(__name__)
+
+
+def distance(a, b):
+    if a is None or b is None:
+        return 0.0
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def spaces_touched(move):
+    if move['action'] == 'move_to_space':
+        return {move['starting_space'].upper(), move['ending_space'].upper()}
+    return {move['space'].upper()}
+
+
+class _Step(object):
+    def __init__(self, index, move, geometry):
+        self.index = index
+        self.move = move
+        self.spaces = spaces_touched(move)
+        self.depends_on = set()
+        if move['action'] == 'move_to_space':
+            self.pickup = geometry.position(move['starting_space'])
+            self.dropoff = geometry.position(move['ending_space'])
+        else:
+            self.pickup = geometry.position(move['space'])
+            # a capture that already has a slot is dropped there, otherwise the planner picks one
+            self.dropoff = geometry.position(move['discard_space']) if move.get('discard_space') else None
+
+
+class MovePlanner(object):
+    """
+    Orders a batch of `move_to_space` and `remove_from_board` actions to minimize printhead travel.
+
+    Two actions that touch the same space keep their submitted order, so a captured piece is always
+    cleared before its space is reused. Everything else is free to move around, and every capture
+    is dropped at whichever discard space makes the whole plan shortest, unless it already has one.
+    """
+    def __init__(self, geometry, discard_spaces):
+        self.geometry = geometry
+        self.discard_spaces = list(discard_spaces)
+        self.discard_positions = [(space, geometry.position(space)) for space in self.discard_spaces]
+
+    def plan(self, moves, start=None):
+        """ Returns a dict with the reordered `moves` and the `planned_distance` and `naive_distance` in mm
+
+            :param moves: actions as accepted by ChessController.perform_moves
+            :param start: (x, y) of the printhead, if known
+        """
+        steps = []
+        for index, move in enumerate(moves):
+            if move['action'] not in ('move_to_space', 'remove_from_board'):
+                logger.warning(f"skipping unknown action {move['action']}")
+                continue
+            step = _Step(index, move, self.geometry)
+            for earlier in steps:
+                if earlier.spaces & step.spaces:
+                    step.depends_on.add(earlier.index)
+            steps.append(step)
+
+        naive_distance = self._naive_distance(steps, start)
+        if len(steps) <= EXACT_PLAN_LIMIT:
+            order, planned_distance = self._search(steps, start)
+        else:
+            order, planned_distance = self._greedy(steps, start)
+
+        planned_moves = []
+        for step, discard_space in order:
+            move = dict(step.move)
+            if discard_space is not None:
+                move['discard_space'] = discard_space
+            planned_moves.append(move)
+
+        logger.info(f"planned {len(planned_moves)} moves, travel {planned_distance:.0f}mm (naive {naive_distance:.0f}mm)")
+        return {
+            'moves': planned_moves,
+            'planned_distance': planned_distance,
+            'naive_distance': naive_distance,
+        }
+
+    def _options(self, step, position, limit=None):
+        """ Yields (cost, end position, discard space) for each way of performing `step` from `position` """
+        if step.dropoff is not None:
+            yield distance(position, step.pickup) + distance(step.pickup, step.dropoff), step.dropoff, None
+            return
+        discards = sorted(self.discard_positions, key=lambda discard: distance(step.pickup, discard[1]))
+        for space, discard_position in discards[:limit]:
+            cost = distance(position, step.pickup) + distance(step.pickup, discard_position)
+            yield cost, discard_position, space
+
+    def _naive_distance(self, steps, position):
+        total = 0.0
+        for step in steps:
+            dropoff = step.dropoff
+            if dropoff is None:
+                # submitted order always used the first discard space
+                dropoff = self.discard_positions[0][1]
+            total += distance(position, step.pickup) + distance(step.pickup, dropoff)
+            position = dropoff
+        return total
+
+    def _greedy(self, steps, position):
+        remaining = {step.index: step for step in steps}
+        done = set()
+        order = []
+        total = 0.0
+        while remaining:
+            best = None
+            for step in remaining.values():
+                if not step.depends_on <= done:
+                    continue
+                option = min(self._options(step, position, limit=1), key=lambda option: option[0])
+                if best is None or option[0] < best[0]:
+                    best = option + (step,)
+            cost, position, discard_space, step = best
+            total += cost
+            order.append((step, discard_space))
+            done.add(step.index)
+            del remaining[step.index]
+        return order, total
+
+    def _search(self, steps, start):
+        # depth first branch and bound, seeded with the greedy plan
+        best_order, best_total = self._greedy(steps, start)
+        best = [best_order, best_total]
+        remaining = {step.index: step for step in steps}
+        done = set()
+        order = []
+
+        def visit(position, total):
+            if total >= best[1]:
+                return
+            if not remaining:
+                best[0], best[1] = list(order), total
+                return
+            for step in list(remaining.values()):
+                if not step.depends_on <= done:
+                    continue
+                del remaining[step.index]
+                done.add(step.index)
+                for cost, end, discard_space in self._options(step, position, limit=DISCARD_CANDIDATES):
+                    order.append((step, discard_space))
+                    visit(end, total + cost)
+                    order.pop()
+                done.discard(step.index)
+                remaining[step.index] = step
+
+        visit(start, 0.0)
+        return best[0], best[1]
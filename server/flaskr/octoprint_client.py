@@ -0,0 +1,143 @@
+"""
+HTTP client for one rig's OctoPrint server.
+
+Requests go out over a pool of keep-alive connections, so a move doesn't pay for a new TCP
+connection to the Pi, and every request has a connect and a read timeout, so a stalled OctoPrint
+fails the move instead of hanging it. Idempotent requests that fail to connect, time out or hit a
+gateway error are retried after a jittered backoff. Anything else is only retried if it never
+reached OctoPrint.
+
+Independent requests can be sent together with `submit`, each on its own pooled connection, so
+their round trips overlap instead of adding up.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from . import metrics
+from . import timing
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+logger = logging.getLogger(__name__)
+
+
+class OctoPrintSession(requests.Session):
+    def request(self, method, url, *args, **kwargs):
+        path = re.sub(r'/+', '/', urlparse(url).path)
+        with timing.span(timing.STAGE_HTTP, f"{method.upper()} {path}"):
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except requests.exceptions.RequestException:
+                metrics.octoprint_errors.inc()
+                raise
+        if not response.ok:
+            metrics.octoprint_errors.inc()
+        return response
+
+
+def _never_sent(error):
+    """ True if `error` means the request didn't reach the server, so it's safe to send again """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.exceptions.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+class OctoPrintClient(object):
+    """
+    :param config: the rig's Configuration, read on every request so changes apply right away,
+        except octoprint_pool_size, which is read when the first connection is opened
+    """
+    def __init__(self, config):
+        self.config = config
+        self._session = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """ The pooled session, opened on first use """
+        with self._lock:
+            if self._session is None:
+                session = OctoPrintSession()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.config.get('octoprint_pool_size'))
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update({
+                    'X-Api-Key': self.config.get('octoprint_api_key'),
+                    'Content-Type': 'application/json',
+                })
+                self._session = session
+            return self._session
+
+    @property
+    def timeout(self):
+        """ (connect, read) timeout in seconds for requests that don't give their own """
+        return self.config.get('octoprint_connect_timeout'), self.config.get('octoprint_read_timeout')
+
+    def url(self, path):
+        return f"http://{self.config.get('octoprint_ip_address')}/{path}"
+
+    def request(self, method, path, timeout=None, retries=None, **kwargs):
+        """ Sends one request, retrying it if that's safe, and returns the response
+
+            :param path: path under the OctoPrint root, e.g. 'api/printer'
+            :param timeout: seconds, or (connect, read), instead of the configured timeouts
+            :param retries: retries instead of octoprint_retries
+            :raises requests.RequestException: if the last attempt failed to get a response
+        """
+        method = method.upper()
+        url = self.url(path)
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.config.get('octoprint_retries') if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == retries or not (method in IDEMPOTENT_METHODS or _never_sent(e)):
+                    raise
+                failure = type(e).__name__
+            else:
+                if attempt == retries or method not in IDEMPOTENT_METHODS or \
+                        response.status_code not in RETRY_STATUSES:
+                    return response
+                failure = f"status {response.status_code}"
+            # full jitter, so several rigs or threads retrying at once don't stay in lockstep
+            delay = random.uniform(0, self.config.get('octoprint_retry_backoff') * 2 ** attempt)
+            logger.warning(f"{method} {path} failed with {failure}, retrying in {delay:.2f}s")
+            metrics.octoprint_retries.inc()
+            time.sleep(delay)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, data, **kwargs):
+        """ POSTs `data` as JSON """
+        return self.request('POST', path, data=json.dumps(data), **kwargs)
+
+    def submit(self, method, path, **kwargs):
+        """ Like `request`, but returns right away with a future for the response
+
+            Requests submitted together are sent at the same time, on separate connections, so
+            only use this for requests that don't depend on each other's order.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.config.get('octoprint_pool_size'),
+                    thread_name_prefix='octoprint',
+                )
+            executor = self._executor
+        return executor.submit(self.request, method, path, **kwargs)
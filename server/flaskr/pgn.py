@@ -0,0 +1,115 @@
+"""
+Incremental PGN reading.
+
+PgnReader pulls lines from any iterable of text lines and yields the main line's moves one at a
+time, so a game can start playing on the board while the rest of the file is still being read, or
+still being uploaded. Tag pairs are collected into `headers` as they go by, comments, NAGs and
+variations are skipped. Only the first game in the file is read.
+"""
+import queue
+import re
+
+from .exceptions import IllegalMoveException
+
+token_regex = re.compile(r'''
+    (?P<tag>\[\s*(?P<tag_name>[A-Za-z0-9_]+)\s+"(?P<tag_value>(?:[^"\\]|\\.)*)"\s*\])
+  | (?P<comment>\{)
+  | (?P<line_comment>;)
+  | (?P<variation_start>\()
+  | (?P<variation_end>\))
+  | (?P<result>1-0|0-1|1/2-1/2|\*)
+  | (?P<move_number>\d+\.+)
+  | (?P<nag>\$\d+|[!?]+)
+  | (?P<move>[^\s{}();\[\]$!?.]+)
+  | (?P<invalid>\S)
+''', re.VERBOSE)
+
+_END = object()
+
+
+class PgnReader(object):
+    """
+    :param lines: an iterable of str lines, read lazily
+    """
+    def __init__(self, lines):
+        self.lines = lines
+        self.headers = {}
+        self.result = None
+        self._in_comment = False
+        self._variation_depth = 0
+
+    def moves(self):
+        """ Yields each move of the first game's main line, as written (SAN, sometimes UCI)
+
+            :raises IllegalMoveException: if the movetext can't be read
+        """
+        seen_moves = False
+        for line_number, line in enumerate(self.lines, 1):
+            if line.startswith('%'):
+                continue  # escape line, for other software
+            position = 0
+            while position < len(line):
+                if self._in_comment:
+                    end = line.find('}', position)
+                    if end == -1:
+                        break
+                    self._in_comment = False
+                    position = end + 1
+                    continue
+                if line[position].isspace():
+                    position += 1
+                    continue
+                match = token_regex.match(line, position)
+                position = match.end()
+                kind = match.lastgroup if match.lastgroup not in ('tag_name', 'tag_value') else 'tag'
+                if kind == 'tag':
+                    if seen_moves:
+                        return  # the next game's tags, the first one had no result
+                    self.headers[match.group('tag_name')] = re.sub(r'\\(.)', r'\1', match.group('tag_value'))
+                elif kind == 'comment':
+                    self._in_comment = True
+                elif kind == 'line_comment':
+                    break
+                elif kind == 'variation_start':
+                    self._variation_depth += 1
+                elif kind == 'variation_end':
+                    if not self._variation_depth:
+                        raise IllegalMoveException(f"unbalanced ')' on line {line_number}")
+                    self._variation_depth -= 1
+                elif self._variation_depth or kind in ('move_number', 'nag'):
+                    continue
+                elif kind == 'result':
+                    self.result = match.group('result')
+                    return
+                elif kind == 'move':
+                    seen_moves = True
+                    yield match.group('move')
+                else:
+                    raise IllegalMoveException(f"unexpected {match.group()!r} on line {line_number}")
+        if self._in_comment or self._variation_depth:
+            raise IllegalMoveException("PGN ended inside a comment or variation")
+
+
+class LineFeed(object):
+    """
+    Lines handed over from one thread, like the one reading a replay job's upload, to a PgnReader
+    on another.
+    """
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def put(self, line):
+        self._queue.put(line)
+
+    def close(self, error=None):
+        """ Ends the feed, `error` is raised to the reader if the upload failed """
+        self._queue.put(error if error is not None else _END)
+
+    def __iter__(self):
+        while True:
+            line = self._queue.get()
+            if line is _END:
+                return
+            if isinstance(line, Exception):
+                raise line
+            yield line
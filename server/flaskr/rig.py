@@ -0,0 +1,136 @@
+from collections import OrderedDict
+import functools
+import logging
+import threading
+
+from flask import current_app, g
+from werkzeug.exceptions import NotFound
+from werkzeug.local import LocalProxy
+
+from .axis_controller import AxisController
+from .chess_controller import ChessController
+from .config import Configuration, DEFAULT_RIG, configured_rigs
+from .events import EventBus
+from .job_queue import JobQueue
+from .motor_controller import MotorController
+
+logger = logging.getLogger(__name__)
+
+# the rig the current request is for, in views registered with rig_route
+current_rig = LocalProxy(lambda: g.rig)
+
+
+class Rig(object):
+    """
+    One printer and Arduino pair, with everything it needs to run on its own: configuration,
+    OctoPrint session, serial link, event bus and job worker. Rigs share nothing, so each one
+    executes its moves concurrently with and independently of the others.
+    """
+    def __init__(self, app, rig_id, registry):
+        self.id = rig_id
+        self.config = Configuration(rig_id)
+        self.events = EventBus()
+        self.axis_controller = AxisController(self.config, events=self.events)
+        self.motor_controller = MotorController(
+            self.config,
+            events=self.events,
+            claimed_ports=lambda: registry.claimed_ports(exclude=self),
+        )
+        self.chess_controller = ChessController(self.axis_controller, self.motor_controller, events=self.events)
+        self.job_queue = JobQueue(app, events=self.events, name=f"job-worker-{rig_id}")
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'octoprint_initialized': self.axis_controller._initialized,
+            'arduino_initialized': self.motor_controller._initialized,
+            'arduino_port': self.motor_controller.port,
+        }
+
+
+class RigRegistry(object):
+    """
+    Every rig this server drives: the default rig configured by user.json, and one for each
+    directory under the config directory's rigs/.
+
+    A rig is only built the first time it's asked for, so creating the app reads no configuration
+    and touches no hardware.
+    """
+    def __init__(self, app):
+        self.app = app
+        self._rigs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, rig_id):
+        """ The rig, built if this is the first time it's needed, or None if there's no such rig """
+        rig = self._rigs.get(rig_id)
+        if rig is not None:
+            return rig
+        with self._lock:
+            if rig_id not in self._rigs:
+                if rig_id not in configured_rigs():
+                    return None
+                self._rigs[rig_id] = Rig(self.app, rig_id, self)
+                logger.info(f"rig {rig_id} ready")
+            return self._rigs[rig_id]
+
+    @property
+    def default(self):
+        return self.get(DEFAULT_RIG)
+
+    def rigs(self):
+        return [self.get(rig_id) for rig_id in configured_rigs()]
+
+    def status(self):
+        """ Rig.to_dict for every configured rig, without building the ones nobody has used yet """
+        statuses = []
+        for rig_id in configured_rigs():
+            rig = self._rigs.get(rig_id)
+            if rig is not None:
+                statuses.append(rig.to_dict())
+            else:
+                statuses.append({
+                    'id': rig_id,
+                    'octoprint_initialized': False,
+                    'arduino_initialized': False,
+                    'arduino_port': None,
+                })
+        return statuses
+
+    def claimed_ports(self, exclude=None):
+        """ Serial ports held by any rig but `exclude` """
+        return {
+            rig.motor_controller.port for rig in list(self._rigs.values())
+            if rig is not exclude and rig.motor_controller.port is not None
+        }
+
+
+def rig_route(bp, rule, **options):
+    """ Like bp.route, also registering the rule under /rigs/<rig_id> for any rig
+
+        The plain rule is for the default rig. The view can use current_rig, which is only looked
+        up (and built, the first time) for these views, so other routes never touch a rig.
+    """
+    def decorator(f):
+        endpoint = options.pop('endpoint', f.__name__)
+
+        @functools.wraps(f)
+        def view(*args, rig_id=DEFAULT_RIG, **kwargs):
+            select_rig(rig_id)
+            return f(*args, **kwargs)
+
+        bp.add_url_rule(rule, endpoint, view, **options)
+        bp.add_url_rule(f"/rigs/<rig_id>{rule}", endpoint, view, **options)
+        return f
+    return decorator
+
+
+def select_rig(rig_id):
+    """ Makes the rig `rig_id` current_rig
+
+        :raises NotFound: if there's no such rig
+    """
+    rig = current_app.rigs.get(rig_id)
+    if rig is None:
+        raise NotFound(f"no rig {rig_id}")
+    g.rig = rig
@@ -0,0 +1,157 @@
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import itertools
+import logging
+import threading
+import time
+
+import serial
+
+from .exceptions import MotorControllerException
+from . import metrics
+from . import serial_protocol as protocol
+
+UNSOLICITED_HISTORY = 100  # unsolicited messages kept around for inspection
+
+logger = logging.getLogger(__name__)
+
+
+class SerialLink(object):
+    """
+    Owns the reading side of an open serial port.
+
+    A reader thread drains the port, decodes frames and resolves the future returned by `send`
+    with the ACK carrying the same tag. The sketch handles commands one at a time, so several can
+    be sent back to back and they complete in order. Anything the sketch sends on its own (boot
+    frames after a reset, debug or limit switch events) is kept in `unsolicited` and passed to
+    the listeners.
+    """
+    def __init__(self, _serial):
+        self.serial = _serial
+        self.unsolicited = deque(maxlen=UNSOLICITED_HISTORY)
+        self._listeners = []
+        self._pending = {}  # tag -> (command, frame type, future)
+        self._tags = itertools.cycle(range(1, 256))
+        self._decoder = protocol.FrameDecoder()
+        self._busy_until = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='serial-reader', daemon=True)
+        self._thread.start()
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def add_listener(self, callback):
+        """ `callback(message)` is called on the reader thread for every unsolicited message """
+        self._listeners.append(callback)
+
+    def send(self, cmd, expected=0, timeout=0.5):
+        """ Queues the text command `cmd` and returns a future for its result
+
+            The future's `deadline` (time.monotonic) allows for every command queued ahead of this
+            one, plus `expected` seconds of work and `timeout` seconds of slack for this one.
+
+            :raises MotorControllerException: if `cmd` isn't a command the sketch knows, or on the
+                future if the sketch answers with an error code
+        """
+        frame_type, payload = protocol.parse_command(cmd)
+        future = Future()
+        future.command = cmd
+        with self._lock:
+            tag = next(self._tags)
+            start = max(time.monotonic(), self._busy_until)
+            self._busy_until = start + expected
+            future.deadline = self._busy_until + timeout
+            self._pending[tag] = (cmd, frame_type, future)
+        future.set_running_or_notify_cancel()
+        try:
+            with self._write_lock:
+                self.serial.write(protocol.encode_frame(frame_type, tag, payload))
+        except serial.SerialException as e:
+            self._fail(tag, MotorControllerException(f"could not send {cmd}: {e}"))
+        return future
+
+    def wait(self, future):
+        """ Blocks until `future` is done or its deadline passes
+
+            :raises MotorControllerException: if it timed out or failed
+            :returns: the command's result
+        """
+        remaining = max(0, future.deadline - time.monotonic())
+        try:
+            return future.result(timeout=remaining)
+        except FutureTimeoutError:
+            with self._lock:
+                for tag, (_, _, pending) in list(self._pending.items()):
+                    if pending is future:
+                        del self._pending[tag]
+                        break
+            metrics.serial_timeouts.inc()
+            raise MotorControllerException(f"timed out waiting for {future.command} to complete")
+
+    def _fail(self, tag, error):
+        with self._lock:
+            entry = self._pending.pop(tag, None)
+        if entry is not None:
+            entry[2].set_exception(error)
+
+    def _fail_all(self, error):
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for _, _, future in pending:
+            future.set_exception(error)
+
+    def _unsolicited(self, message):
+        self.unsolicited.append((time.time(), message))
+        for callback in self._listeners:
+            try:
+                callback(message)
+            except Exception:
+                logger.exception("serial listener failed")
+
+    def _handle_frame(self, frame):
+        if frame.type == protocol.TYPE_EVENT:
+            message = frame.payload.decode('utf-8', errors='replace')
+            logger.info(f"unsolicited serial output: {message}")
+            self._unsolicited(message)
+            return
+
+        if frame.type == protocol.TYPE_BOOT:
+            logger.warning("Arduino rebooted")
+            self._unsolicited('boot')
+            return
+
+        if frame.type != protocol.TYPE_ACK:
+            logger.info(f"unexpected frame type {frame.type:#x}")
+            return
+
+        with self._lock:
+            entry = self._pending.pop(frame.tag, None)
+        if entry is None:
+            logger.info(f"ACK for unknown or expired command, tag {frame.tag}")
+            return
+        cmd, frame_type, future = entry
+        code, result = protocol.decode_ack(frame_type, frame.payload)
+        if code == protocol.ACK_OK:
+            future.set_result(result)
+        else:
+            message = protocol.ACK_MESSAGES.get(code, f"code {code}")
+            future.set_exception(MotorControllerException(f"{cmd} failed: {message}"))
+
+    def _run(self):
+        while True:
+            try:
+                data = self.serial.read(self.serial.in_waiting or 1)
+            except (serial.SerialException, OSError, TypeError) as e:
+                # TypeError is what pyserial raises when the port is closed under a blocked read
+                logger.error(f"serial reader stopped: {e}")
+                self._fail_all(MotorControllerException(f"serial connection lost: {e}"))
+                return
+            errors = self._decoder.errors
+            for frame in self._decoder.feed(data):
+                self._handle_frame(frame)
+            if self._decoder.errors > errors:
+                metrics.serial_frame_errors.inc(self._decoder.errors - errors)
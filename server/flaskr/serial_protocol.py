@@ -0,0 +1,189 @@
+"""
+Binary framing for the link with stepper_controller.ino
+
+Every frame, in either direction:
+
+    SYNC | VERSION | TYPE | TAG | LENGTH | PAYLOAD (LENGTH bytes) | CRC
+
+SYNC is 0xA5, CRC is a CRC-8 (polynomial 0x07) over VERSION through the end of the payload. The
+host picks a TAG for every command and the sketch answers with a single ACK frame carrying the same
+tag, whose first payload byte is one of the ACK_* codes and the rest is the command's result. Tag 0
+is for frames that answer nothing, the sketch's EVENT and BOOT frames.
+"""
+from collections import namedtuple
+import struct
+
+from .exceptions import MotorControllerException
+
+SYNC = 0xA5
+PROTOCOL_VERSION = 1
+HEADER_LENGTH = 5  # sync, version, type, tag, length
+MAX_PAYLOAD = 16  # keeps a handful of queued frames inside the Arduino's 64 byte receive buffer
+
+# host -> sketch
+TYPE_HANDSHAKE = 0x01
+TYPE_DEBUG = 0x02
+TYPE_HAND = 0x03
+TYPE_Z = 0x04
+TYPE_SET_BAUD = 0x05
+
+# sketch -> host
+TYPE_ACK = 0x80
+TYPE_EVENT = 0x81  # unsolicited text
+TYPE_BOOT = 0x82  # sent once setup() is done, payload is the sketch's protocol version
+
+UNTAGGED = 0
+
+ACK_OK = 0
+ACK_UNKNOWN_COMMAND = 1
+ACK_INVALID_POSITION = 2
+ACK_BAD_FRAME = 3
+ACK_BAD_VERSION = 4
+ACK_UNSUPPORTED_BAUD = 5
+ACK_MESSAGES = {
+    ACK_UNKNOWN_COMMAND: 'unknown command',
+    ACK_INVALID_POSITION: 'invalid position',
+    ACK_BAD_FRAME: 'corrupt frame',
+    ACK_BAD_VERSION: 'unsupported protocol version',
+    ACK_UNSUPPORTED_BAUD: 'unsupported baud rate',
+}
+
+HAND_OPEN = 0
+HAND_CLOSE = 1
+Z_UP = 0
+Z_DOWN = 1
+
+# where a stepper last drove to, in the debug readout
+STEPPER_POSITION_UNKNOWN = 0
+STEPPER_POSITION_HOME = 1
+STEPPER_POSITION_AWAY = 2
+STEPPER_POSITIONS = {
+    STEPPER_POSITION_HOME: 'home',
+    STEPPER_POSITION_AWAY: 'away',
+}
+
+# the text form of each command, as used in logs, spans and the raw_write endpoint
+COMMANDS = {
+    'heybuddy': (TYPE_HANDSHAKE, {'': b''}),
+    'debug': (TYPE_DEBUG, {'': b''}),
+    'hand': (TYPE_HAND, {'open': bytes([HAND_OPEN]), 'close': bytes([HAND_CLOSE])}),
+    'z': (TYPE_Z, {'up': bytes([Z_UP]), 'down': bytes([Z_DOWN])}),
+}
+
+Frame = namedtuple('Frame', ['type', 'tag', 'payload'])
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def encode_frame(frame_type, tag, payload=b''):
+    if len(payload) > MAX_PAYLOAD:
+        raise MotorControllerException(f"payload too long: {len(payload)} bytes")
+    body = bytes([PROTOCOL_VERSION, frame_type, tag, len(payload)]) + payload
+    return bytes([SYNC]) + body + bytes([crc8(body)])
+
+
+def parse_command(cmd):
+    """ Turns a text command like "hand:open" into its frame type and payload
+
+        :raises MotorControllerException: if there's no such command
+    """
+    stepper_id, _, position = cmd.partition(':')
+    command = COMMANDS.get(stepper_id.strip())
+    if command is None:
+        raise MotorControllerException(f"{cmd} failed: unknown command")
+    frame_type, payloads = command
+    payload = payloads.get(position.strip())
+    if payload is None:
+        raise MotorControllerException(f"{cmd} failed: invalid position")
+    return frame_type, payload
+
+
+def command_name(cmd):
+    """ `cmd` in its canonical text form, or 'unknown' if it isn't a command
+
+        Safe to use as a metrics label for commands that come from users, there are only as many
+        names as there are commands.
+    """
+    try:
+        parse_command(cmd)
+    except MotorControllerException:
+        return 'unknown'
+    stepper_id, separator, position = cmd.partition(':')
+    return f"{stepper_id.strip()}{separator}{position.strip()}"
+
+
+def set_baud_payload(baudrate):
+    return struct.pack('<I', baudrate)
+
+
+def decode_ack(command_type, payload):
+    """ Splits an ACK payload into its code and the command's result
+
+        :returns: (ack code, dict)
+    """
+    if not payload:
+        return ACK_BAD_FRAME, {}
+    code, data = payload[0], payload[1:]
+    if code != ACK_OK:
+        return code, {}
+    if command_type == TYPE_HANDSHAKE and len(data) >= 1:
+        return code, {'version': data[0]}
+    if command_type == TYPE_DEBUG and len(data) >= 4:
+        return code, {
+            'hand_home': bool(data[0]),
+            'z_home': bool(data[1]),
+            'hand_position': STEPPER_POSITIONS.get(data[2]),
+            'z_position': STEPPER_POSITIONS.get(data[3]),
+        }
+    return code, {}
+
+
+class FrameDecoder(object):
+    """
+    Incremental decoder for the byte stream from the sketch. Bytes that don't form a valid frame
+    (line noise, a partial frame from before a reset, another device entirely) are skipped until
+    the next SYNC byte, and counted in `errors`.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self.errors = 0
+
+    def feed(self, data):
+        """ Adds bytes from the port, returns every frame they complete """
+        self._buffer += data
+        frames = []
+        while True:
+            start = self._buffer.find(SYNC)
+            if start == -1:
+                if self._buffer:
+                    self.errors += 1
+                self._buffer.clear()
+                return frames
+            if start > 0:
+                self.errors += 1
+                del self._buffer[:start]
+            if len(self._buffer) < HEADER_LENGTH:
+                return frames
+            version, frame_type, tag, length = self._buffer[1:HEADER_LENGTH]
+            if version != PROTOCOL_VERSION or length > MAX_PAYLOAD:
+                self._skip()
+                continue
+            end = HEADER_LENGTH + length
+            if len(self._buffer) < end + 1:
+                return frames
+            if crc8(self._buffer[1:end]) != self._buffer[end]:
+                self._skip()
+                continue
+            frames.append(Frame(frame_type, tag, bytes(self._buffer[HEADER_LENGTH:end])))
+            del self._buffer[:end + 1]
+
+    def _skip(self):
+        self.errors += 1
+        del self._buffer[:1]
@@ -0,0 +1,94 @@
+import logging
+import threading
+
+from .events import EVENT_STEP
+from . import timing
+
+DEVICE_PRINTER = 'printer'
+DEVICE_ARDUINO = 'arduino'
+
+logger = logging.getLogger(__name__)
+
+
+class Step(object):
+    def __init__(self, name, device, action, after=(), checkpoint=False):
+        self.name = name
+        self.device = device
+        self.action = action
+        self.after = [step for step in after if step is not None]
+        # the job can only be cancelled right before a checkpoint step
+        self.checkpoint = checkpoint
+        self.done = False
+
+    def __repr__(self):
+        return f"<Step {self.device}: {self.name}>"
+
+
+class StepGraph(object):
+    """
+    A small dependency graph of device actions.
+
+    Each device runs its own steps in the order they were added, one at a time, on its own thread.
+    A step also waits for every step in its `after` list, which is how cross-device ordering and
+    safety constraints are expressed. Steps on different devices with nothing between them run at
+    the same time.
+
+    Steps can only depend on steps added before them, so the graph can't deadlock.
+    """
+    def __init__(self, events=None):
+        self.events = events
+        self.steps = []
+        self._condition = threading.Condition()
+        self._error = None
+
+    def add(self, name, device, action, after=(), checkpoint=False):
+        step = Step(name, device, action, after=after, checkpoint=checkpoint)
+        self.steps.append(step)
+        return step
+
+    def run(self, job=None):
+        """ Runs every step, raising the first exception any step raised once all devices have stopped """
+        devices = {}
+        for step in self.steps:
+            devices.setdefault(step.device, []).append(step)
+
+        threads = [
+            threading.Thread(target=self._run_device, args=(device, steps, job), name=f"steps-{device}")
+            for device, steps in devices.items()
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def _run_device(self, device, steps, job):
+        for step in steps:
+            with timing.span(timing.STAGE_WAIT, 'step_dependencies'), self._condition:
+                self._condition.wait_for(lambda: self._error is not None or all(s.done for s in step.after))
+                if self._error is not None:
+                    return
+            try:
+                if step.checkpoint and job is not None:
+                    job.check_cancelled()
+                logger.debug(f"starting {step}")
+                self._publish(step, 'started')
+                step.action()
+            except Exception as e:
+                self._publish(step, 'failed', error=str(e))
+                with self._condition:
+                    if self._error is None:
+                        logger.error(f"{step} failed, stopping all devices")
+                        self._error = e
+                    self._condition.notify_all()
+                return
+            self._publish(step, 'finished')
+            with self._condition:
+                step.done = True
+                self._condition.notify_all()
+
+    def _publish(self, step, status, **data):
+        if self.events is not None:
+            self.events.publish(EVENT_STEP, name=step.name, device=step.device, status=status, **data)
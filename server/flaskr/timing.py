@@ -0,0 +1,90 @@
+from contextlib import contextmanager
+import functools
+import threading
+import time
+
+from . import metrics
+
+STAGE_HTTP = 'http'          # round trips to OctoPrint
+STAGE_SERIAL = 'serial'      # round trips to the Arduino, including the stepper moves it blocks on
+STAGE_CONFIG = 'config'      # configuration reads and board geometry lookups
+STAGE_PLANNING = 'planning'  # move planning
+STAGE_WAIT = 'wait'          # idle, waiting for hardware or for the other device
+STAGE_INIT = 'init'          # handshakes and device initialization
+
+STAGES = (STAGE_HTTP, STAGE_SERIAL, STAGE_CONFIG, STAGE_PLANNING, STAGE_WAIT, STAGE_INIT)
+
+
+class StageTimer(object):
+    """
+    Accumulates time spent in each stage of the move hot path, across all threads.
+
+    Spans nest; time spent in an inner span only counts towards the inner stage, so the stage
+    totals for a single thread never add up to more than the time that thread spent in spans.
+    The full duration of every span is also recorded in the span latency histogram.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.seconds = {stage: 0.0 for stage in STAGES}
+            self.counts = {stage: 0 for stage in STAGES}
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                stage: {'seconds': self.seconds[stage], 'count': self.counts[stage]}
+                for stage in STAGES
+            }
+
+    def _add(self, stage, seconds, count=0):
+        with self._lock:
+            self.seconds[stage] += seconds
+            self.counts[stage] += count
+
+    @contextmanager
+    def span(self, stage, name=''):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        now = time.perf_counter()
+        if stack:
+            parent = stack[-1]
+            self._add(parent[0], now - parent[1])
+        started = now
+        entry = [stage, now]
+        stack.append(entry)
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._add(stage, now - entry[1], count=1)
+            metrics.span_seconds.observe(now - started, stage=stage, name=name)
+            stack.pop()
+            if stack:
+                stack[-1][1] = now
+
+
+_timer = StageTimer()
+
+
+def timer():
+    return _timer
+
+
+def span(stage, name=''):
+    return _timer.span(stage, name=name)
+
+
+def timed(stage, name):
+    """ Decorator that wraps every call in a span """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapped(*args, **kwargs):
+            with _timer.span(stage, name=name):
+                return fn(*args, **kwargs)
+        return wrapped
+    return decorator
@@ -2,9 +2,9 @@ from flask import (Blueprint, render_template, request, Response, jsonify)
 from flask_cors import cross_origin
 from werkzeug.exceptions import BadRequest
 
-from .config import Configuration
 from .exceptions import InvalidConfigurationException
-from .motor_controller import MotorController
+from .metrics import registry
+from .rig import current_rig, rig_route
 
 
 bp = Blueprint('base', __name__, url_prefix='/')
@@ -15,11 +15,11 @@ def landing():
     return render_template('landing.html')
 
 
-@bp.route('/status', methods=['GET'])
+@rig_route(bp, '/status', methods=['GET'])
 @cross_origin()
 def status():
     # complete status endpoint for now. This should get broken up into more specific endpoints if necessary.
-    instance = MotorController.instance()
+    instance = current_rig.motor_controller
     return jsonify({
         'status': 'OK',
         'axis_controller': {
@@ -35,10 +35,16 @@ def status():
     })
 
 
-@bp.route('/configure', methods=['GET', 'PATCH'])
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    # rendered from memory, never touches the hardware
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@rig_route(bp, '/configure', methods=['GET', 'PATCH'])
 @cross_origin()
 def configure():
-    config = Configuration.config()
+    config = current_rig.config
     if request.method == 'GET':
         return jsonify(config._config)
     else:
@@ -0,0 +1,2 @@
+from .arduino import FakeArduino
+from .octoprint import FakeOctoPrint
@@ -0,0 +1,60 @@
+"""
+Runs a fake OctoPrint server and a fake Arduino until interrupted.
+
+Run from the server directory: python -m simulator
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+
+from .arduino import FakeArduino
+from .octoprint import FakeOctoPrint
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001, help='fake OctoPrint port')
+    parser.add_argument('--api-key', default='', help='require this X-Api-Key')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every OctoPrint request')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='multiplier on simulated motion times')
+    parser.add_argument('--hand-speed-delay', type=int, default=25, help='ms between hand stepper phases')
+    parser.add_argument('--z-speed-delay', type=int, default=2, help='ms between z stepper phases')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='%(asctime)s - %(name)s - %(message)s')
+
+    octoprint = FakeOctoPrint(
+        host=args.host,
+        port=args.port,
+        api_key=args.api_key,
+        time_scale=args.time_scale,
+        latency=args.latency,
+    ).start()
+    arduino = FakeArduino(
+        hand_speed_delay=args.hand_speed_delay,
+        z_speed_delay=args.z_speed_delay,
+        time_scale=args.time_scale,
+    ).start()
+
+    print("add to flaskr/config/user.json:")
+    print(json.dumps({
+        'octoprint_ip_address': octoprint.address,
+        'octoprint_api_key': args.api_key,
+        'arduino_port': arduino.port,
+    }, indent=4))
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        octoprint.stop()
+        arduino.stop()
+
+
+if __name__ == '__main__':
+    main()
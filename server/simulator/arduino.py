@@ -0,0 +1,222 @@
+"""
+Fake of stepper_controller.ino on a pseudo-terminal.
+
+Point `arduino_port` at `FakeArduino.port` and MotorController talks to it like the real board: a
+BOOT frame once the simulated bootloader is done, then binary command frames, each answered with an
+ACK frame once the simulated stepper move is done. The framing is implemented here independently
+of flaskr.serial_protocol, the way the sketch does, so the two are checked against each other.
+"""
+import logging
+import os
+import select
+import struct
+import threading
+import time
+import tty
+
+SYNC = 0xA5
+PROTOCOL_VERSION = 1
+HEADER_LENGTH = 5
+MAX_PAYLOAD = 16
+
+TYPE_HANDSHAKE = 0x01
+TYPE_DEBUG = 0x02
+TYPE_HAND = 0x03
+TYPE_Z = 0x04
+TYPE_SET_BAUD = 0x05
+TYPE_ACK = 0x80
+TYPE_EVENT = 0x81
+TYPE_BOOT = 0x82
+
+ACK_OK = 0
+ACK_UNKNOWN_COMMAND = 1
+ACK_INVALID_POSITION = 2
+ACK_BAD_FRAME = 3
+ACK_BAD_VERSION = 4
+ACK_UNSUPPORTED_BAUD = 5
+
+SUPPORTED_BAUDRATES = (9600, 19200, 38400, 57600, 115200)
+BOOT_BAUDRATE = 9600
+BAUD_CONFIRM_TIMEOUT = 0.5  # seconds without a valid frame at a new rate before reverting
+BITS_PER_BYTE = 10  # 8N1
+
+POSITION_HOME = 'home'
+POSITION_AWAY = 'away'
+# how the debug readout reports each position
+POSITION_CODES = {None: 0, POSITION_HOME: 1, POSITION_AWAY: 2}
+
+PHASES_PER_STEP = 4
+ENABLE_DELAY = 100  # ms, the sketch's delay after toggling the hand/z driver
+
+logger = logging.getLogger(__name__)
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+class SimulatedStepper(object):
+    def __init__(self, steps, speed_delay):
+        self.steps = steps
+        self.speed_delay = speed_delay
+        self.position = None  # the sketch doesn't know where it is until it has moved
+
+    @property
+    def move_time(self):
+        return abs(self.steps) * PHASES_PER_STEP * self.speed_delay / 1000.0
+
+
+class FakeArduino(object):
+    """
+    :param hand_steps/z_steps: steps between the two positions, as in the sketch
+    :param hand_speed_delay/z_speed_delay: ms between coil phases, as in the sketch
+    :param boot_delay: seconds between start() and the boot frame, like the bootloader after a reset
+    :param time_scale: multiplier on every simulated delay, < 1 for faster than real life
+    :param simulate_line_rate: delay every frame sent by the time it would take on the wire at the
+        current baud rate, which a pty otherwise ignores. Not scaled by time_scale.
+    """
+    def __init__(self, hand_steps=15, hand_speed_delay=25, z_steps=500, z_speed_delay=2, boot_delay=1.0,
+                 time_scale=1.0, simulate_line_rate=False):
+        self.hand = SimulatedStepper(hand_steps, hand_speed_delay)
+        self.z = SimulatedStepper(z_steps, z_speed_delay)
+        self.boot_delay = boot_delay
+        self.time_scale = time_scale
+        self.simulate_line_rate = simulate_line_rate
+        self.baudrate = BOOT_BAUDRATE
+        self.commands = []  # every command received in its text form, for inspection
+        self.frame_errors = 0
+        self._baud_confirm_deadline = None
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._running = False
+
+    @property
+    def port(self):
+        return os.ttyname(self._slave)
+
+    def start(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)  # no echo or newline translation, like a real serial port
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='fake-arduino', daemon=True)
+        self._thread.start()
+        logger.info(f"fake Arduino listening on {self.port}")
+        return self
+
+    def stop(self):
+        self._running = False
+        os.close(self._master)
+        os.close(self._slave)
+
+    def event(self, message):
+        """ Sends an unsolicited EVENT frame, like a limit switch report from the sketch """
+        self._send(TYPE_EVENT, 0, message.encode('utf-8'))
+
+    def _sleep(self, seconds):
+        time.sleep(seconds * self.time_scale)
+
+    def _send(self, frame_type, tag, payload=b''):
+        body = bytes([PROTOCOL_VERSION, frame_type, tag, len(payload)]) + payload
+        frame = bytes([SYNC]) + body + bytes([crc8(body)])
+        if self.simulate_line_rate:
+            time.sleep(len(frame) * BITS_PER_BYTE / self.baudrate)
+        os.write(self._master, frame)
+
+    def _ack(self, tag, code, data=b''):
+        self._send(TYPE_ACK, tag, bytes([code]) + data)
+
+    def _run(self):
+        self._sleep(self.boot_delay)
+        self._send(TYPE_BOOT, 0, bytes([PROTOCOL_VERSION]))
+        buffer = bytearray()
+        while self._running:
+            try:
+                readable, _, _ = select.select([self._master], [], [], 0.05)
+                data = os.read(self._master, 64) if readable else b''
+            except (OSError, ValueError):
+                return
+            buffer += data
+            self._parse(buffer)
+            if self._baud_confirm_deadline and time.monotonic() > self._baud_confirm_deadline:
+                logger.info(f"no frame at {self.baudrate} baud, reverting to {BOOT_BAUDRATE}")
+                self.baudrate = BOOT_BAUDRATE
+                self._baud_confirm_deadline = None
+
+    def _parse(self, buffer):
+        while buffer:
+            if buffer[0] != SYNC:
+                self.frame_errors += 1
+                del buffer[:1]
+                continue
+            if len(buffer) < HEADER_LENGTH:
+                return
+            version, frame_type, tag, length = buffer[1:HEADER_LENGTH]
+            if length > MAX_PAYLOAD:
+                self.frame_errors += 1
+                del buffer[:1]
+                continue
+            end = HEADER_LENGTH + length
+            if len(buffer) < end + 1:
+                return
+            if crc8(buffer[1:end]) != buffer[end]:
+                self.frame_errors += 1
+                self._ack(tag, ACK_BAD_FRAME)
+                del buffer[:1]
+                continue
+            payload = bytes(buffer[HEADER_LENGTH:end])
+            del buffer[:end + 1]
+            self._baud_confirm_deadline = None
+            if version != PROTOCOL_VERSION:
+                self._ack(tag, ACK_BAD_VERSION)
+                continue
+            self._handle_frame(frame_type, tag, payload)
+
+    def _drive(self, stepper, position):
+        if stepper.position == position:
+            return
+        self._sleep(stepper.move_time)
+        stepper.position = position
+
+    def _handle_frame(self, frame_type, tag, payload):
+        if frame_type == TYPE_HANDSHAKE:
+            self.commands.append('heybuddy:')
+            self._ack(tag, ACK_OK, bytes([PROTOCOL_VERSION]))
+        elif frame_type == TYPE_DEBUG:
+            self.commands.append('debug:')
+            self._ack(tag, ACK_OK, bytes([
+                int(self.hand.position == POSITION_HOME),
+                int(self.z.position == POSITION_HOME),
+                POSITION_CODES[self.hand.position],
+                POSITION_CODES[self.z.position],
+            ]))
+        elif frame_type == TYPE_SET_BAUD and len(payload) == 4:
+            baudrate = struct.unpack('<I', payload)[0]
+            self.commands.append(f"baud:{baudrate}")
+            if baudrate not in SUPPORTED_BAUDRATES:
+                self._ack(tag, ACK_UNSUPPORTED_BAUD)
+                return
+            self._ack(tag, ACK_OK)
+            self.baudrate = baudrate
+            self._baud_confirm_deadline = time.monotonic() + BAUD_CONFIRM_TIMEOUT
+        elif frame_type in (TYPE_HAND, TYPE_Z) and len(payload) == 1:
+            away = payload[0] == 0 if frame_type == TYPE_HAND else payload[0] == 1
+            names = ('open', 'close') if frame_type == TYPE_HAND else ('up', 'down')
+            stepper = self.hand if frame_type == TYPE_HAND else self.z
+            stepper_id = 'hand' if frame_type == TYPE_HAND else 'z'
+            if payload[0] > 1:
+                self.commands.append(f"{stepper_id}:{payload[0]}")
+                self._ack(tag, ACK_INVALID_POSITION)
+                return
+            self.commands.append(f"{stepper_id}:{names[payload[0]]}")
+            self._sleep(ENABLE_DELAY / 1000.0)
+            self._drive(stepper, POSITION_AWAY if away else POSITION_HOME)
+            self._ack(tag, ACK_OK)
+        else:
+            self.commands.append(f"unknown:{frame_type:#x}")
+            self._ack(tag, ACK_UNKNOWN_COMMAND)
@@ -0,0 +1,261 @@
+"""
+Fake OctoPrint server implementing the parts of the REST API that AxisController uses.
+
+Moves are queued like a printer's planner: each one starts when the previous one finishes and
+takes as long as the trapezoidal motion model says it would on the real printer.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+from flaskr import motion
+
+API_VERSION = {'api': '0.1', 'server': '1.5.3', 'text': 'OctoPrint 1.5.3 (simulated)'}
+
+DEFAULT_PROFILE = {
+    'id': '_default',
+    'name': 'Simulated Ender 3',
+    'model': 'Creality Ender 3',
+    'volume': {'width': 235, 'depth': 235, 'height': 250, 'formFactor': 'rectangular', 'origin': 'lowerleft'},
+    'axes': {
+        'x': {'speed': 6000, 'inverted': False},
+        'y': {'speed': 6000, 'inverted': False},
+        'z': {'speed': 200, 'inverted': False},
+        'e': {'speed': 300, 'inverted': False},
+    },
+}
+
+DEFAULT_ACCELERATION = 500  # mm/s^2, Ender 3 stock firmware
+HOMING_TIME = 5  # seconds for a home, regardless of axes
+
+gcode_word_regex = re.compile(r'([A-Z])(-?[0-9.]+)')
+
+logger = logging.getLogger(__name__)
+
+
+class SimulatedPrinter(object):
+    def __init__(self, profile=DEFAULT_PROFILE, acceleration=DEFAULT_ACCELERATION, time_scale=1.0):
+        self.profile = profile
+        self.acceleration = acceleration
+        self.time_scale = time_scale
+        self.position = {'x': 0.0, 'y': 0.0, 'z': 0.0}
+        self.absolute = True
+        self.feedrate = 3000
+        self.busy_until = time.monotonic()
+        self.commands = []  # every G-code line received, for inspection
+        self._lock = threading.Lock()
+
+    @property
+    def axis_feedrates(self):
+        return {axis: settings['speed'] for axis, settings in self.profile['axes'].items()}
+
+    @property
+    def idle(self):
+        return time.monotonic() >= self.busy_until
+
+    def _queue_motion(self, seconds):
+        self.busy_until = max(self.busy_until, time.monotonic()) + seconds * self.time_scale
+
+    def move(self, target, feedrate=None, relative=False):
+        with self._lock:
+            if feedrate:
+                self.feedrate = feedrate
+            end = dict(self.position)
+            for axis, value in target.items():
+                if value is None:
+                    continue
+                end[axis] = self.position[axis] + value if relative else value
+            self._queue_motion(motion.printhead_move_time(
+                self.position,
+                end,
+                feedrate=self.feedrate,
+                acceleration=self.acceleration,
+                axis_feedrates=self.axis_feedrates,
+            ))
+            self.position = end
+
+    def home(self, axes):
+        with self._lock:
+            for axis in axes:
+                self.position[axis] = 0.0
+            self._queue_motion(HOMING_TIME)
+
+    def wait_until_idle(self):
+        remaining = self.busy_until - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def run_gcode(self, line):
+        self.commands.append(line)
+        line = line.split(';')[0].strip().upper()
+        if not line:
+            return
+        code, _, rest = line.partition(' ')
+        words = {letter.lower(): float(value) for letter, value in gcode_word_regex.findall(rest)}
+        if code in ('G0', 'G1'):
+            feedrate = words.pop('f', None)
+            target = {axis: words.get(axis) for axis in ('x', 'y', 'z')}
+            self.move(target, feedrate=feedrate, relative=not self.absolute)
+        elif code == 'G28':
+            self.home([axis for axis in ('x', 'y', 'z') if axis in rest.lower()] or ['x', 'y', 'z'])
+        elif code == 'G90':
+            self.absolute = True
+        elif code == 'G91':
+            self.absolute = False
+        elif code == 'M400':
+            # real OctoPrint sends the next line once the printer acks, and the ack waits for the planner
+            self.wait_until_idle()
+        elif code == 'M114':
+            logger.info("M114: X:{x:.2f} Y:{y:.2f} Z:{z:.2f}".format(**self.position))
+
+
+class OctoPrintRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'SimulatedOctoPrint/0.1'
+    protocol_version = 'HTTP/1.1'  # keep-alive, like OctoPrint's own server
+    # headers and body go out in separate writes, don't let them wait on each other's ack
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    @property
+    def printer(self):
+        return self.server.printer
+
+    def _path(self):
+        return re.sub(r'/+', '/', urlparse(self.path).path)
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_empty(self, status=204):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _authorized(self):
+        time.sleep(self.server.latency)
+        if self.server.api_key and self.headers.get('X-Api-Key') != self.server.api_key:
+            self._send_json({'error': 'Invalid API key'}, status=403)
+            return False
+        return True
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        path = self._path()
+        if path == '/api/version':
+            self._send_json(API_VERSION)
+        elif path == '/api/connection':
+            self._send_json({
+                'current': {'state': 'Operational', 'port': '/dev/ttyUSB0', 'baudrate': 115200,
+                            'printerProfile': '_default'},
+                'options': {'ports': ['/dev/ttyUSB0'], 'baudrates': [115200], 'printerProfiles': [
+                    {'id': '_default', 'name': self.printer.profile['name']}]},
+            })
+        elif path == '/api/job':
+            self._send_json({
+                'job': {'file': {'name': None}},
+                'progress': {'completion': None},
+                'state': 'Operational',
+            })
+        elif path == '/api/printer':
+            # stricter than OctoPrint, whose ready flag stays true through jogs and G-code, so that
+            # AxisController's idle poll has something to wait on
+            ready = self.printer.idle and not self.server.command_lock.locked()
+            self._send_json({
+                'state': {
+                    'text': 'Operational',
+                    'flags': {'operational': True, 'ready': ready, 'printing': False, 'paused': False,
+                              'cancelling': False, 'pausing': False, 'error': False, 'closedOrError': False},
+                },
+            })
+        elif path.startswith('/api/printerprofiles/'):
+            profile_id = path[len('/api/printerprofiles/'):]
+            if profile_id != self.printer.profile['id']:
+                self._send_json({'error': f"Profile {profile_id} doesn't exist"}, status=404)
+                return
+            self._send_json(self.printer.profile)
+        else:
+            self._send_json({'error': 'Not found'}, status=404)
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        path = self._path()
+        data = self._read_json()
+        if path == '/api/printer/printhead':
+            command = data.get('command')
+            if command == 'jog':
+                feedrate = data.get('speed')
+                target = {axis: data.get(axis) for axis in ('x', 'y', 'z')}
+                self.printer.move(target, feedrate=feedrate, relative=not data.get('absolute', False))
+            elif command == 'home':
+                self.printer.home(data.get('axes', []))
+            else:
+                self._send_json({'error': f"Unknown command {command}"}, status=400)
+                return
+            self._send_empty()
+        elif path == '/api/printer/command':
+            commands = data.get('commands') or [data.get('command', '')]
+            # OctoPrint queues the lines and answers right away
+            threading.Thread(target=self._run_commands, args=(commands,), daemon=True).start()
+            self._send_empty()
+        else:
+            self._send_json({'error': 'Not found'}, status=404)
+
+    def _run_commands(self, commands):
+        with self.server.command_lock:
+            for line in commands:
+                self.printer.run_gcode(line)
+
+
+class FakeOctoPrint(object):
+    """
+    :param port: 0 picks a free port
+    :param api_key: if set, requests must send it as X-Api-Key
+    :param profile: printer profile to serve and to limit axis speeds with
+    :param acceleration: printer acceleration in mm/s^2
+    :param time_scale: multiplier on every simulated motion time, < 1 for faster than real life
+    :param latency: seconds added to every request, roughly the round trip to a Raspberry Pi
+    """
+    def __init__(self, host='127.0.0.1', port=0, api_key='', profile=DEFAULT_PROFILE,
+                 acceleration=DEFAULT_ACCELERATION, time_scale=1.0, latency=0.0):
+        self.printer = SimulatedPrinter(profile=profile, acceleration=acceleration, time_scale=time_scale)
+        self.server = ThreadingHTTPServer((host, port), OctoPrintRequestHandler)
+        self.server.daemon_threads = True
+        self.server.printer = self.printer
+        self.server.api_key = api_key
+        self.server.latency = latency
+        self.server.command_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-octoprint', daemon=True)
+        self._thread.start()
+        logger.info(f"fake OctoPrint listening on {self.address}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,7 +1,4 @@
-#include "TwoPositionStepper.h":
-
-#define POSITION_HOME "pos_home"
-#define POSITION_AWAY "pos_away"
+#include "TwoPositionStepper.h"
 
 const int HOME_BACKOFF = 5; // cycles to back off of home switch
 
@@ -81,12 +78,14 @@ bool TwoPositionStepper::ccwStep(bool interruptable) {
   return false;
 }
 
-void TwoPositionStepper::driveAway() {
+int TwoPositionStepper::position() {
+  return _position;
+}
+
+bool TwoPositionStepper::driveAway() {
   if (_position == POSITION_AWAY) {
-    Serial.println("already away");
-    return;
+    return false;
   }
-  Serial.println("moving away");
   for (int i = 0; i < abs(_distanceFromHome); i++) {
     if (_distanceFromHome > 0) {
       cwStep(false);
@@ -96,23 +95,21 @@ void TwoPositionStepper::driveAway() {
   }
   _write(LOW, LOW, LOW, LOW);
   _position = POSITION_AWAY;
+  return true;
 }
 
-void TwoPositionStepper::driveHome() {
+bool TwoPositionStepper::driveHome() {
   if (_position == POSITION_HOME) {
-    Serial.println("already home");
-    return;
+    return false;
   }
   bool interrupted = false;
   while(true) {
-    Serial.println("moving home");
     if (_distanceFromHome > 0) {
       interrupted = ccwStep(true);
     } else {
       interrupted = cwStep(true);
     }
     if (interrupted) {
-      Serial.println("interrupted");
       break;
     }
   }
@@ -120,4 +117,5 @@ void TwoPositionStepper::driveHome() {
     _write(LOW, LOW, LOW, LOW); 
   }
   _position = POSITION_HOME;
+  return true;
 }
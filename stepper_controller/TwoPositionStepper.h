@@ -4,14 +4,21 @@
 #define SPEED_DELAY_SLOW 25
 #define SPEED_DELAY_MEDIUM 2
 
+// where the stepper last drove to, reported to the host in the debug readout
+#define POSITION_UNKNOWN 0
+#define POSITION_HOME 1
+#define POSITION_AWAY 2
+
 #include "Arduino.h"
 
 class TwoPositionStepper {
   public:
     TwoPositionStepper(int pin1, int pin2, int pin3, int pin4, int homePin, int distanceFromHome, int speedDelay, bool holdAtHome);
 
-    void driveAway();
-    void driveHome();
+    // both return false if the stepper was already there
+    bool driveAway();
+    bool driveHome();
+    int position();
 
     void setDistanceFromHome(int newDistanceFromHome);
 
@@ -23,7 +30,7 @@ class TwoPositionStepper {
     int _pin4;
 
     int _speedDelay;
-    int _position;
+    int _position = POSITION_UNKNOWN;
     int _distanceFromHome;
     bool _holdAtHome;
 
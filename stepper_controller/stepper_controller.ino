@@ -1,19 +1,46 @@
 #include "TwoPositionStepper.h"
 
-#define STEPPER_ID_X_AXIS "x"
-#define STEPPER_ID_Y_AXIS "y"
-#define STEPPER_ID_Z_AXIS "z"
-#define STEPPER_ID_HAND "hand"
-#define STEPPER_ID_Z "z"
+// Binary framing shared with server/flaskr/serial_protocol.py, every frame in either direction is
+//   SYNC | VERSION | TYPE | TAG | LENGTH | PAYLOAD (LENGTH bytes) | CRC-8 over VERSION..PAYLOAD
+// Each command frame is answered with one ACK frame carrying the same tag, whose first payload
+// byte is an ACK_* code
+const byte SYNC = 0xA5;
+const byte PROTOCOL_VERSION = 1;
+const int HEADER_LENGTH = 5;
+const int MAX_PAYLOAD = 16;
 
-#define HANDSHAKE "heybuddy"
-#define HANDSHAKE_ACK "eyyy"
-#define DEBUG_ID "debug"
+// host -> sketch
+const byte TYPE_HANDSHAKE = 0x01;
+const byte TYPE_DEBUG = 0x02;
+const byte TYPE_HAND = 0x03;
+const byte TYPE_Z = 0x04;
+const byte TYPE_SET_BAUD = 0x05;
 
-#define HAND_OPEN "open"
-#define HAND_CLOSE "close"
-#define Z_UP "up"
-#define Z_DOWN "down"
+// sketch -> host
+const byte TYPE_ACK = 0x80;
+const byte TYPE_EVENT = 0x81;
+const byte TYPE_BOOT = 0x82;  // sent once setup() is done, so the host knows the bootloader has handed over
+
+const byte UNTAGGED = 0;
+
+const byte ACK_OK = 0;
+const byte ACK_UNKNOWN_COMMAND = 1;
+const byte ACK_INVALID_POSITION = 2;
+const byte ACK_BAD_FRAME = 3;
+const byte ACK_BAD_VERSION = 4;
+const byte ACK_UNSUPPORTED_BAUD = 5;
+
+const byte HAND_OPEN = 0;
+const byte HAND_CLOSE = 1;
+const byte Z_UP = 0;
+const byte Z_DOWN = 1;
+
+const long SUPPORTED_BAUDRATES[] = {9600, 19200, 38400, 57600, 115200};
+const unsigned long BAUD_CONFIRM_TIMEOUT = 500;  // ms without a valid frame at a new rate before reverting
+
+byte frameBuffer[HEADER_LENGTH + MAX_PAYLOAD + 1];
+int frameLength = 0;
+unsigned long baudConfirmDeadline = 0;
 
 const int BAUD = 9600;
 
@@ -50,70 +77,159 @@ TwoPositionStepper zStepper(
   SPEED_DELAY_MEDIUM,
   false);
 
+
+byte crc8(byte crc, const byte *data, int length) {
+  for (int i = 0; i < length; i++) {
+    crc ^= data[i];
+    for (int bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+void sendFrame(byte type, byte tag, const byte *payload, int length) {
+  byte header[HEADER_LENGTH] = {SYNC, PROTOCOL_VERSION, type, tag, (byte)length};
+  byte crc = crc8(crc8(0, header + 1, HEADER_LENGTH - 1), payload, length);
+  Serial.write(header, HEADER_LENGTH);
+  Serial.write(payload, length);
+  Serial.write(crc);
+}
+
+void sendAck(byte tag, byte code) {
+  sendFrame(TYPE_ACK, tag, &code, 1);
+}
+
 void setup() {
   pinMode(LED_BUILTIN, OUTPUT);
   pinMode(HAND_Z_TOGGLE_PIN, OUTPUT);
-  Serial.begin(BAUD);  // start serial communication at 9600 baud
-  Serial.setTimeout(3);
+  Serial.begin(BAUD);  // always boot at 9600 baud, the host negotiates up from there
+  sendFrame(TYPE_BOOT, UNTAGGED, &PROTOCOL_VERSION, 1);
 }
 
-void handleHandCommand(String position) {
+byte handleHandCommand(byte position) {
+  if (position != HAND_OPEN && position != HAND_CLOSE) {
+    return ACK_INVALID_POSITION;
+  }
   digitalWrite(HAND_Z_TOGGLE_PIN, HAND_ENABLED_STATE);
   delay(100); // are these necessary?
-  Serial.println("moving grabber");
-  if (position == HAND_OPEN ) {
-    Serial.println("opening");
+  if (position == HAND_OPEN) {
     handStepper.driveAway();
-  } else if (position == HAND_CLOSE) {
-    Serial.println("closing");
-    handStepper.driveHome();
   } else {
-    Serial.println("invalid");
+    handStepper.driveHome();
   }
+  return ACK_OK;
 }
 
-void handleZCommand(String position) {
+byte handleZCommand(byte position) {
+  if (position != Z_UP && position != Z_DOWN) {
+    return ACK_INVALID_POSITION;
+  }
   digitalWrite(HAND_Z_TOGGLE_PIN, HAND_ENABLED_STATE);
   delay(100); // are these necessary?
-  Serial.println("moving z");
   if (position == Z_UP) {
-    Serial.println("moving up");
     zStepper.driveHome();
-  } else if (position == Z_DOWN) {
-    Serial.println("moving down");
+  } else {
     zStepper.driveAway();
+  }
+  return ACK_OK;
+}
+
+void handleSetBaud(byte tag, const byte *payload, int length) {
+  if (length != 4) {
+    sendAck(tag, ACK_BAD_FRAME);
+    return;
+  }
+  long baudrate = (long)payload[0] | ((long)payload[1] << 8) | ((long)payload[2] << 16) | ((long)payload[3] << 24);
+  for (unsigned int i = 0; i < sizeof(SUPPORTED_BAUDRATES) / sizeof(SUPPORTED_BAUDRATES[0]); i++) {
+    if (SUPPORTED_BAUDRATES[i] == baudrate) {
+      sendAck(tag, ACK_OK);
+      Serial.flush();  // the ACK goes out at the old rate
+      Serial.end();
+      Serial.begin(baudrate);
+      // if the host can't follow, it won't send anything valid and we fall back in loop()
+      baudConfirmDeadline = millis() + BAUD_CONFIRM_TIMEOUT;
+      return;
+    }
+  }
+  sendAck(tag, ACK_UNSUPPORTED_BAUD);
+}
+
+void handleFrame(byte type, byte tag, const byte *payload, int length) {
+  if (type == TYPE_HANDSHAKE) {
+    byte response[2] = {ACK_OK, PROTOCOL_VERSION};
+    sendFrame(TYPE_ACK, tag, response, 2);
+  } else if (type == TYPE_DEBUG) {
+    byte response[5] = {
+      ACK_OK,
+      (byte)digitalRead(HAND_HOME_PIN),
+      (byte)digitalRead(Z_HOME_PIN),
+      (byte)handStepper.position(),
+      (byte)zStepper.position(),
+    };
+    sendFrame(TYPE_ACK, tag, response, 5);
+  } else if (type == TYPE_SET_BAUD) {
+    handleSetBaud(tag, payload, length);
+  } else if (type == TYPE_HAND && length == 1) {
+    // steppers are driven synchronously, so by the time this returns the move is finished.
+    // Frames sent meanwhile wait in the 64 byte receive buffer
+    sendAck(tag, handleHandCommand(payload[0]));
+  } else if (type == TYPE_Z && length == 1) {
+    sendAck(tag, handleZCommand(payload[0]));
   } else {
-    Serial.println("invalid");
+    sendAck(tag, ACK_UNKNOWN_COMMAND);
   }
 }
 
+// drops the first byte of the buffer and looks for the next sync byte, after line noise or a
+// corrupt frame
+void resync() {
+  int next = 1;
+  while (next < frameLength && frameBuffer[next] != SYNC) {
+    next++;
+  }
+  memmove(frameBuffer, frameBuffer + next, frameLength - next);
+  frameLength -= next;
+}
+
 void loop() {
-  if (Serial.available()) {
-    String stepperId = Serial.readStringUntil(':');
-    Serial.read(); 
-    String position = Serial.readString();
-    stepperId.trim();
-    position.trim();
-    Serial.println(stepperId);
-    if (stepperId == HANDSHAKE) {
-      Serial.println(HANDSHAKE_ACK);
-    } else if (stepperId == DEBUG_ID) {
-      int handHome = digitalRead(HAND_HOME_PIN);
-      Serial.println("Hand Home");
-      Serial.println(handHome);
-      int zHome = digitalRead(Z_HOME_PIN);
-      Serial.println("Z Home");
-      Serial.println(zHome);
-    } else {
-      Serial.println("STEPPER ID");
-      Serial.println(stepperId);
-      Serial.println("POSITION");
-      Serial.println(position);      
-      if (stepperId == STEPPER_ID_HAND) {
-        handleHandCommand(position);
-      } else if (stepperId == STEPPER_ID_Z) {
-        handleZCommand(position);
+  // frames are buffered byte by byte as they arrive, so one split across reads is still parsed whole
+  while (Serial.available()) {
+    byte b = Serial.read();
+    if (frameLength == 0 && b != SYNC) {
+      continue;
+    }
+    frameBuffer[frameLength++] = b;
+    while (frameLength >= HEADER_LENGTH) {
+      int payloadLength = frameBuffer[4];
+      if (payloadLength > MAX_PAYLOAD) {
+        resync();
+        continue;
+      }
+      int end = HEADER_LENGTH + payloadLength;
+      if (frameLength < end + 1) {
+        break;
       }
+      byte tag = frameBuffer[3];
+      if (crc8(0, frameBuffer + 1, end - 1) != frameBuffer[end]) {
+        sendAck(tag, ACK_BAD_FRAME);
+        resync();
+        continue;
+      }
+      baudConfirmDeadline = 0;
+      if (frameBuffer[1] != PROTOCOL_VERSION) {
+        sendAck(tag, ACK_BAD_VERSION);
+      } else {
+        handleFrame(frameBuffer[2], tag, frameBuffer + HEADER_LENGTH, payloadLength);
+      }
+      frameLength = 0;
+      break;
     }
   }
+
+  if (baudConfirmDeadline != 0 && (long)(millis() - baudConfirmDeadline) > 0) {
+    baudConfirmDeadline = 0;
+    Serial.end();
+    Serial.begin(BAUD);
+  }
 }